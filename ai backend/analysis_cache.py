@@ -0,0 +1,82 @@
+import os
+import hashlib
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from google.cloud import firestore
+from gcp_handler import db
+
+# Cross-request cache of the document-specific part of the initial analysis.
+#
+# Many uploads are copies of the same template agreement. Agent 1's research and
+# Agent 2's detailed analysis depend only on the document's text, so they are cached
+# in the 'analysis_cache' collection under a key made of the document's text
+# fingerprint (text_processing.TextFingerprint, stored on the request at ingestion)
+# and a version string covering the prompts and models. Only Agent 3, which is
+# tailored to the user's question, runs again on a hit.
+#
+# Entries expire after ANALYSIS_CACHE_TTL_DAYS. The 'expires_at' field can also be
+# used as the collection's Firestore TTL policy field so expired entries get deleted.
+
+load_dotenv()
+
+ANALYSIS_CACHE_COLLECTION = "analysis_cache"
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_TTL_DAYS = float(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "30"))
+
+
+def analysis_cache_key(document_fingerprint: str, version: str) -> str:
+    """The cache document ID for a document fingerprint under a prompt/model version."""
+    return hashlib.sha256(f"{version}\n{document_fingerprint}".encode("utf-8")).hexdigest()
+
+def get_cached_analysis(document_fingerprint: str, version: str) -> dict | None:
+    """
+    Looks up a cached analysis.
+
+    Returns:
+        dict | None: The entry's 'research_findings' and 'agent2_detailed_analysis', or
+                     None if there is no unexpired entry for this fingerprint and version.
+    """
+    if not ANALYSIS_CACHE_ENABLED or not document_fingerprint:
+        return None
+    try:
+        doc_ref = db.collection(ANALYSIS_CACHE_COLLECTION).document(analysis_cache_key(document_fingerprint, version))
+        snapshot = doc_ref.get()
+        if not snapshot.exists:
+            print("Analysis cache miss.")
+            return None
+
+        entry = snapshot.to_dict()
+        if entry.get("expires_at") and entry["expires_at"] <= datetime.now(timezone.utc):
+            print("Analysis cache entry has expired.")
+            return None
+
+        doc_ref.update({"hits": firestore.Increment(1), "last_hit_time": firestore.SERVER_TIMESTAMP})
+        print(f"✅ Analysis cache hit (cached from request {entry.get('source_request_id')}).")
+        return {
+            "research_findings": entry["research_findings"],
+            "agent2_detailed_analysis": entry["agent2_detailed_analysis"]
+        }
+    except Exception as e:
+        # The cache is an optimization; a failed lookup just means a full analysis
+        print(f"❌ Error reading analysis cache: {e}")
+        return None
+
+def save_cached_analysis(document_fingerprint: str, version: str, research_findings: str, detailed_analysis: str, source_request_id: str):
+    """Stores a completed analysis so identical documents can reuse it until it expires."""
+    if not ANALYSIS_CACHE_ENABLED or not document_fingerprint:
+        return
+    try:
+        doc_ref = db.collection(ANALYSIS_CACHE_COLLECTION).document(analysis_cache_key(document_fingerprint, version))
+        doc_ref.set({
+            "document_fingerprint": document_fingerprint,
+            "version": version,
+            "research_findings": research_findings,
+            "agent2_detailed_analysis": detailed_analysis,
+            "source_request_id": source_request_id,
+            "created_time": firestore.SERVER_TIMESTAMP,
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=ANALYSIS_CACHE_TTL_DAYS),
+            "hits": 0
+        })
+        print(f"💾 Cached analysis of request {source_request_id} for identical documents.")
+    except Exception as e:
+        print(f"❌ Error saving analysis to cache: {e}")
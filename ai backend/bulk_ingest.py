@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from text_processing import parse_pdf_for_indexing
+
+# NOTE: gcp_handler and doc_processor are imported inside BulkIngestor.__init__ rather
+# than at the top of this file. The parse pool uses the "spawn" start method, which
+# re-imports this module in every worker; keeping the Google Cloud imports out of
+# module scope stops each worker from opening its own Firestore/Vertex AI clients.
+
+DEFAULT_JOURNAL_PATH = "bulk_ingest_journal.jsonl"
+DEFAULT_PROMPT = "Please provide a general summary."
+
+
+class IngestionJournal:
+    """
+    Append-only JSONL log of per-document ingestion progress.
+
+    Every stage a document completes is written as one line, so an interrupted run
+    can be resumed: finished documents are skipped and partially ingested ones reuse
+    the GCS URI and Firestore ID they were already given.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a killed run; everything before it is still valid
+                        continue
+                    self.entries.setdefault(record["source"], {}).update(record)
+
+    def get(self, source: str) -> dict:
+        """Returns the merged progress record for a source (empty if it was never seen)."""
+        with self._lock:
+            return dict(self.entries.get(source, {}))
+
+    def record(self, source: str, stage: str, **fields):
+        """Appends a progress record for a source and flushes it to disk."""
+        record = {"source": source, "stage": stage, "time": time.time(), **fields}
+        with self._lock:
+            self.entries.setdefault(source, {}).update(record)
+            with open(self.path, "a", encoding="utf-8") as journal_file:
+                journal_file.write(json.dumps(record) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+
+class ThroughputMeter:
+    """Tracks completed documents and chunks and reports their rates."""
+
+    def __init__(self, total_docs: int):
+        self.total_docs = total_docs
+        self.docs_done = 0
+        self.docs_failed = 0
+        self.chunks_done = 0
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, num_chunks: int = 0, failed: bool = False):
+        with self._lock:
+            if failed:
+                self.docs_failed += 1
+            else:
+                self.docs_done += 1
+                self.chunks_done += num_chunks
+
+    def summary(self) -> str:
+        with self._lock:
+            elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+            finished = self.docs_done + self.docs_failed
+            return (
+                f"[{finished}/{self.total_docs}] "
+                f"{self.docs_done / elapsed:.2f} docs/sec, "
+                f"{self.chunks_done / elapsed:.1f} chunks/sec "
+                f"({self.docs_done} done, {self.docs_failed} failed, {elapsed:.1f}s elapsed)"
+            )
+
+
+def load_manifest(manifest_path: str) -> list[dict]:
+    """
+    Reads a manifest of documents to ingest.
+
+    Each non-empty line is either a JSON object with a "path" (local PDF) or a
+    "gcs_uri" (already uploaded PDF) and an optional "prompt", or a bare local path.
+    """
+    entries = []
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entries.append(json.loads(line))
+            else:
+                entries.append({"path": line})
+    return entries
+
+def discover_pdfs(directory: str) -> list[dict]:
+    """Finds every PDF under a directory (recursively), in a stable order."""
+    entries = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if file_name.lower().endswith(".pdf"):
+                entries.append({"path": os.path.join(root, file_name)})
+    return sorted(entries, key=lambda entry: entry["path"])
+
+def storage_object_name(local_path: str) -> str:
+    """
+    The Cloud Storage object name for a local file: its base name under a prefix of
+    its content hash, so same-named files from different directories don't overwrite
+    each other (and identical files map to the same object).
+    """
+    digest = hashlib.sha256()
+    with open(local_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"bulk/{digest.hexdigest()[:16]}/{os.path.basename(local_path)}"
+
+def source_key(entry: dict) -> str:
+    """The journal key for a manifest entry."""
+    if entry.get("path"):
+        return os.path.abspath(entry["path"])
+    return entry["gcs_uri"]
+
+
+class BulkIngestor:
+    """
+    Ingests many documents concurrently.
+
+    PDF parsing and chunking run on a process pool (they are CPU bound), while GCS
+    uploads, Firestore writes, embedding calls and Vector Search upserts each run
+    under their own concurrency limit so one slow service can't starve the others.
+    """
+
+    def __init__(
+        self,
+        journal: IngestionJournal,
+        default_prompt: str = DEFAULT_PROMPT,
+        parse_workers: int = os.cpu_count() or 2,
+        upload_concurrency: int = 8,
+        firestore_concurrency: int = 8,
+        embedding_concurrency: int = 4,
+        upsert_concurrency: int = 2,
+        max_in_flight: int | None = None,
+    ):
+        import gcp_handler
+        import doc_processor
+
+        self.gcp_handler = gcp_handler
+        self.doc_processor = doc_processor
+        self.journal = journal
+        self.default_prompt = default_prompt
+        self.parse_workers = parse_workers
+        self.max_in_flight = max_in_flight or max(parse_workers * 2, upload_concurrency)
+
+        self.upload_slots = threading.BoundedSemaphore(upload_concurrency)
+        self.firestore_slots = threading.BoundedSemaphore(firestore_concurrency)
+        self.embedding_slots = threading.BoundedSemaphore(embedding_concurrency)
+        self.upsert_slots = threading.BoundedSemaphore(upsert_concurrency)
+
+    def run(self, entries: list[dict]) -> ThroughputMeter:
+        """Ingests all entries not already marked done in the journal."""
+        pending = [entry for entry in entries if self.journal.get(source_key(entry)).get("stage") != "done"]
+        skipped = len(entries) - len(pending)
+        if skipped:
+            print(f"⏭️ Skipping {skipped} documents already completed in {self.journal.path}")
+
+        meter = ThroughputMeter(len(pending))
+        if not pending:
+            return meter
+
+        parse_pool = ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as document_pool:
+                futures = [document_pool.submit(self._ingest_one, entry, parse_pool) for entry in pending]
+                for future in as_completed(futures):
+                    num_chunks = future.result()
+                    meter.add(num_chunks or 0, failed=num_chunks is None)
+                    print(f"📈 {meter.summary()}")
+        finally:
+            parse_pool.shutdown()
+
+        print(f"\n✅ Bulk ingestion finished: {meter.summary()}")
+        return meter
+
+    def _ingest_one(self, entry: dict, parse_pool: ProcessPoolExecutor) -> int | None:
+        """Runs one document through every stage. Returns its chunk count, or None on failure."""
+        source = source_key(entry)
+        progress = self.journal.get(source)
+        temp_path = None
+
+        try:
+            gcs_uri = progress.get("gcs_uri") or entry.get("gcs_uri")
+            local_path = entry.get("path")
+
+            # 1. Get a local copy to parse. Local files start parsing immediately, in parallel with the upload.
+            if not local_path:
+                with self.upload_slots:
+                    temp_path = self.doc_processor.download_to_temp_file(gcs_uri)
+                local_path = temp_path
+            parse_future = parse_pool.submit(parse_pdf_for_indexing, local_path)
+
+            # 2. Upload to GCS
+            if not gcs_uri:
+                with self.upload_slots:
+                    gcs_uri = self.gcp_handler.upload_to_storage(local_path, storage_object_name(local_path))
+                if not gcs_uri:
+                    raise RuntimeError("Failed to upload document to Cloud Storage.")
+                self.journal.record(source, "uploaded", gcs_uri=gcs_uri)
+
+            # 3. Register the analysis request
+            firestore_doc_id = progress.get("firestore_id")
+            if not firestore_doc_id:
+                with self.firestore_slots:
+                    firestore_doc_id = self.gcp_handler.save_prompt_to_firestore(
+                        entry.get("prompt", self.default_prompt), gcs_uri
+                    )
+                if not firestore_doc_id:
+                    raise RuntimeError("Failed to save prompt to Firestore.")
+                self.journal.record(source, "registered", gcs_uri=gcs_uri, firestore_id=firestore_doc_id)
+
+            # 4. Wait for parsing. Chunk IDs are deterministic, so a resumed run overwrites
+            #    any chunks and datapoints a previous attempt already wrote.
+            chunk_spans, fingerprint, clause_entries = parse_future.result()
+            chunks = [chunk["text"] for chunk in chunk_spans]
+            if not chunks:
+                raise RuntimeError("No suitable text chunks found to process.")
+            chunk_ids = self.gcp_handler.deterministic_chunk_ids(firestore_doc_id, len(chunks))
+
+            with self.firestore_slots:
+                chunk_id_map = self.gcp_handler.save_chunks_to_firestore(firestore_doc_id, chunks, chunk_ids, positions=chunk_spans)
+            self.journal.record(source, "chunks_saved", num_chunks=len(chunks))
+
+            # 5. Embed and upsert
+            with self.embedding_slots:
+                datapoints = self.doc_processor.build_datapoints(chunk_id_map, firestore_doc_id)
+            with self.upsert_slots:
+                indexed = self.doc_processor.upsert_datapoints(datapoints, firestore_doc_id)
+            # No local vector shard: this host doesn't serve queries, so the serving
+            # nodes build theirs from the stored embeddings on the first query.
+            with self.firestore_slots:
+                self.doc_processor.publish_document_index(firestore_doc_id, None, fingerprint, clause_entries, write_shard=False)
+
+            self.journal.record(
+                source, "done",
+                num_chunks=len(chunks), num_datapoints=len(datapoints), vector_search_indexed=indexed
+            )
+            return len(chunks)
+
+        except Exception as e:
+            print(f"❌ Failed to ingest '{source}': {e}")
+            self.journal.record(source, "failed", error=str(e))
+            return None
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest PDFs into Cloud Storage, Firestore and Vector Search.")
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument("--manifest", help="JSONL manifest of {\"path\"|\"gcs_uri\", \"prompt\"} entries, or one local path per line.")
+    source_group.add_argument("--directory", help="Directory to scan recursively for PDFs.")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, help="Checkpoint journal used to resume interrupted runs.")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt stored for entries that don't define one.")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--upload-concurrency", type=int, default=8)
+    parser.add_argument("--firestore-concurrency", type=int, default=8)
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--upsert-concurrency", type=int, default=2)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Documents processed at once (default: the larger of 2x parse workers and the upload concurrency).")
+    args = parser.parse_args()
+
+    entries = load_manifest(args.manifest) if args.manifest else discover_pdfs(args.directory)
+    print(f"Found {len(entries)} documents to ingest.")
+
+    ingestor = BulkIngestor(
+        journal=IngestionJournal(args.journal),
+        default_prompt=args.prompt,
+        parse_workers=args.parse_workers,
+        upload_concurrency=args.upload_concurrency,
+        firestore_concurrency=args.firestore_concurrency,
+        embedding_concurrency=args.embedding_concurrency,
+        upsert_concurrency=args.upsert_concurrency,
+        max_in_flight=args.max_in_flight,
+    )
+    meter = ingestor.run(entries)
+    if meter.docs_failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
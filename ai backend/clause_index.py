@@ -0,0 +1,331 @@
+import re
+
+# Structural index of a contract's numbered clauses and schedules.
+#
+# At ingestion the document's text is scanned line by line for clause numbers
+# ("6.", "12.3", "Section 12.3", "(b)" sub-clauses) and for headings (upper-case
+# lines such as "LATE PAYMENT AND DEFAULT:", and "Schedule A" / "Annexure II"
+# titles). Every clause gets an entry with its exact text and character span in
+# the document, keyed by a normalized clause ID ("6", "12.3(b)", "annexure ii").
+# Schedules and annexures often restart their numbering, so clauses that follow a
+# schedule title are qualified by it ("schedule a:1" is clause 1 of Schedule A;
+# Firestore document IDs can't contain "/"). An inline annexure ends when, after a
+# later heading, the main body's numbering resumes.
+# The entries are stored in the request's 'clauses' subcollection under those IDs
+# (see gcp_handler.save_clause_index), so a question that names a clause is
+# answered with a direct document read instead of an embedding + Vector Search.
+#
+# Like text_processing, this module has no Google Cloud imports, so it can be used
+# inside bulk ingestion's worker processes.
+
+# Stored clause texts are capped to keep each Firestore document small
+MAX_CLAUSE_CHARS = 20000
+MAX_HEADING_CHARS = 120
+
+NUMBERED_CLAUSE = re.compile(
+    r"^(?:(?P<keyword>clause|section|article)\s+)?"
+    r"(?P<number>\d{1,3}(?:\.\d{1,3})*)"
+    r"(?P<delimiter>[.):])?\s+(?=\S)",
+    re.IGNORECASE
+)
+SUB_CLAUSE = re.compile(r"^\((?P<marker>[a-z]{1,2}|[ivx]{1,5}|\d{1,2})\)\s+(?=\S)")
+ROMAN_NUMERAL = re.compile(r"^[ivx]+$")
+SCHEDULE_NAME = re.compile(r"\b(schedule|annexure|annex|appendix|exhibit)\s+([a-z]|[ivxlc]+|\d{1,3})\b", re.IGNORECASE)
+CLAUSE_NUMBER = r"\d{1,3}(?:\.\d{1,3})*(?!\d)(?:\s*\((?:[a-z]{1,2}|[ivx]{1,5}|\d{1,2})\))*"
+# Joins the numbers of a list or range reference: "clauses 3 and 4", "clause 3, 5 or 7", "sections 2 to 4"
+CLAUSE_LIST_SEPARATOR = r"(?:\s*,\s*(?:(?:and|or)\s+)?|\s+(?:and|or|to|through)\s+|\s*[-\u2013&]\s*)"
+CLAUSE_RANGE_SEPARATOR = re.compile(r"^(?:\s+(?:to|through)\s+|\s*[-\u2013]\s*)$", re.IGNORECASE)
+CLAUSE_REFERENCE = re.compile(
+    r"\b(?:clause|section|article|para(?:graph)?|sub-clause)(?P<plural>s)?\s+"
+    r"(?P<numbers>" + CLAUSE_NUMBER + r"(?:" + CLAUSE_LIST_SEPARATOR + CLAUSE_NUMBER + r")*)",
+    re.IGNORECASE
+)
+# Longest range reference expanded clause by clause ("clauses 2 to 40" is treated as its two ends)
+MAX_CLAUSE_RANGE = 20
+# What follows a number that refers to a statute rather than the contract ("section 21 of the Rent Act")
+STATUTE_TAIL = re.compile(
+    r"\s*,?\s*of\s+(?:the\s+|this\s+|that\s+)?(?:[\w.'()&-]+\s+){0,8}?(?:act|code|rules|regulations|ordinance)\b",
+    re.IGNORECASE
+)
+# "clause 2 of Schedule A" / "Schedule A, clause 2": a clause reference qualified by its schedule
+SCHEDULE_AFTER = re.compile(r"\s*,?\s*(?:of|in|under|to)\s+(?:the\s+)?" + SCHEDULE_NAME.pattern, re.IGNORECASE)
+SCHEDULE_BEFORE = re.compile(SCHEDULE_NAME.pattern + r"\s*,?\s*$", re.IGNORECASE)
+# Separates a schedule's ID from the number of a clause inside it
+SCHEDULE_SEPARATOR = ":"
+
+
+def normalize_clause_id(reference: str, schedule_id: str | None = None) -> str:
+    """
+    Normalizes a clause or schedule reference to its index ID, e.g.
+    "Section 12.3 (b)" -> "12.3(b)" and "Annex II" -> "annexure ii". A clause
+    inside a schedule is qualified by the schedule's ID: ("1", "schedule a") -> "schedule a:1".
+    """
+    schedule = SCHEDULE_NAME.search(reference)
+    if schedule:
+        kind = schedule.group(1).lower()
+        return f"{'annexure' if kind == 'annex' else kind} {schedule.group(2).lower()}"
+    reference = re.sub(r"^(?:clause|section|article|para(?:graph)?|sub-clause)\s+", "", reference.strip(), flags=re.IGNORECASE)
+    clause_id = re.sub(r"\s+", "", reference).lower()
+    return f"{schedule_id}{SCHEDULE_SEPARATOR}{clause_id}" if schedule_id else clause_id
+
+def _referenced_numbers(numbers: str) -> tuple[list[str], bool]:
+    """
+    Splits the numbers of a clause reference into the clauses it names:
+    "3, 5 or 7" -> ["3", "5", "7"] and "2 to 4" -> ["2", "3", "4"]. A range is
+    expanded only between clauses that differ in their last number, and only up to
+    MAX_CLAUSE_RANGE clauses; otherwise just its ends are kept.
+
+    Returns:
+        tuple[list[str], bool]: The clause numbers, and whether every range was expanded.
+    """
+    items = list(re.finditer(CLAUSE_NUMBER, numbers, re.IGNORECASE))
+    clause_numbers = [items[0].group(0)]
+    complete = True
+    for previous, item in zip(items, items[1:]):
+        first, last = previous.group(0), item.group(0)
+        if CLAUSE_RANGE_SEPARATOR.match(numbers[previous.end():item.start()]):
+            first_prefix, _, first_last = first.rpartition(".")
+            last_prefix, _, last_last = last.rpartition(".")
+            if ("(" not in first + last and first_prefix == last_prefix
+                    and 0 < int(last_last) - int(first_last) <= MAX_CLAUSE_RANGE):
+                prefix = f"{first_prefix}." if first_prefix else ""
+                clause_numbers.extend(f"{prefix}{number}" for number in range(int(first_last) + 1, int(last_last)))
+            else:
+                complete = False
+        clause_numbers.append(last)
+    return clause_numbers, complete
+
+def find_clause_references(query: str) -> list[str]:
+    """
+    Returns the normalized IDs of the clauses and schedules a query names explicitly,
+    e.g. "What does clause 6 say about late fees?" -> ["6"], "clauses 3 and 4" ->
+    ["3", "4"] and "clause 2 of Schedule A" -> ["schedule a:2"]. References to
+    statutes ("section 21 of the Rent Act") are ignored. Order is preserved.
+    """
+    references = []
+    qualifier_spans = []
+    for match in CLAUSE_REFERENCE.finditer(query):
+        if STATUTE_TAIL.match(query, match.end()):
+            continue
+        schedule = SCHEDULE_AFTER.match(query, match.end()) or SCHEDULE_BEFORE.search(query, 0, match.start())
+        schedule_id = None
+        if schedule:
+            schedule_id = normalize_clause_id(schedule.group(0))
+            qualifier_spans.append(schedule.span())
+        clause_numbers, _ = _referenced_numbers(match.group("numbers"))
+        references.extend(normalize_clause_id(number, schedule_id) for number in clause_numbers)
+    for match in SCHEDULE_NAME.finditer(query):
+        # A schedule named only to qualify a clause isn't a reference of its own
+        if not any(start <= match.start() < end for start, end in qualifier_spans):
+            references.append(normalize_clause_id(match.group(0)))
+    return list(dict.fromkeys(references))
+
+def names_unresolved_clauses(query: str) -> bool:
+    """
+    True if the query names more clauses than find_clause_references returns: a
+    plural reference with a single parsed number ("clauses 3 through to 5",
+    "sections 4 et seq.") or a range too long to expand ("clauses 2 to 40"), so the
+    caller shouldn't answer from just the clauses that were resolved.
+    """
+    for match in CLAUSE_REFERENCE.finditer(query):
+        if STATUTE_TAIL.match(query, match.end()):
+            continue
+        clause_numbers, complete = _referenced_numbers(match.group("numbers"))
+        if not complete or (match.group("plural") and len(clause_numbers) < 2):
+            return True
+    return False
+
+def clause_lookup_ids(clause_id: str) -> list[str]:
+    """
+    The index IDs to try for a reference, most specific first: "12.3(b)(ii)" ->
+    ["12.3(b)(ii)", "12.3(b)", "12.3", "12"], so a reference still resolves to the
+    enclosing clause when the exact sub-clause wasn't recognized at ingestion.
+    A schedule's clauses fall back to the schedule: "schedule a:2" -> [..., "schedule a"].
+    """
+    lookup_ids = [clause_id]
+    while True:
+        if clause_id.endswith(")") and "(" in clause_id:
+            clause_id = clause_id[:clause_id.rindex("(")]
+        elif "." in clause_id:
+            clause_id = clause_id[:clause_id.rindex(".")]
+        elif SCHEDULE_SEPARATOR in clause_id:
+            clause_id = clause_id[:clause_id.rindex(SCHEDULE_SEPARATOR)]
+        else:
+            return lookup_ids
+        lookup_ids.append(clause_id)
+
+def _heading_text(line: str) -> str | None:
+    """Returns the line as a heading if it looks like one (an upper-case title or a schedule title)."""
+    if not 3 <= len(line) <= MAX_HEADING_CHARS or line[0].isdigit():
+        return None
+    letters = [character for character in line if character.isalpha()]
+    if len(letters) >= 3 and line == line.upper():
+        return line.rstrip(":").strip()
+    if SCHEDULE_NAME.match(line):
+        return line.rstrip(":").strip()
+    return None
+
+
+class ClauseIndexBuilder:
+    """
+    Builds the clause index of a document from a stream of text parts (e.g. PDF
+    pages), which are treated as joined with newlines like extract_text_from_pdf.
+    Character offsets refer to that joined text. Only the text of clauses that are
+    still open is held in memory.
+
+    Usage:
+        builder = ClauseIndexBuilder()
+        for page_text in pages:
+            builder.update(page_text)
+        entries = builder.finish()
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._open = []  # Open entries, outermost first
+        self._heading = None
+        self._schedule = None  # (ID, title) of the schedule the current text belongs to
+        self._heading_in_schedule = False
+        self._next_main_number = 1
+        self._paragraph_start = True
+        self._carry = ""
+        self._carry_start = 0
+        self._started = False
+
+    def update(self, text_part: str):
+        if self._started:
+            buffer = self._carry + "\n" + text_part
+        else:
+            buffer = text_part
+            self._started = True
+
+        line_start = self._carry_start
+        lines = buffer.split("\n")
+        for line in lines[:-1]:
+            self._process_line(line, line_start)
+            line_start += len(line) + 1
+        self._carry = lines[-1]
+        self._carry_start = line_start
+
+    def finish(self) -> list[dict]:
+        """Processes the last line and returns every entry, in document order."""
+        if self._carry:
+            self._process_line(self._carry, self._carry_start)
+        self._close_from(0, self._carry_start + len(self._carry))
+        self._carry = ""
+        return sorted(self.entries, key=lambda entry: entry["start"])
+
+    def _close_from(self, level: int, end: int):
+        # Closes every open entry at `level` or deeper; they end where the new one starts
+        while self._open and self._open[-1]["level"] >= level:
+            entry = self._open.pop()
+            entry.pop("marker", None)
+            entry.pop("marker_kind", None)
+            text = "\n".join(entry.pop("lines")).strip()
+            entry["end"] = entry["start"] + len(text)
+            entry["text"] = text[:MAX_CLAUSE_CHARS]
+            self.entries.append(entry)
+
+    def _open_entry(self, clause_id: str, label: str, level: int, start: int, parent: str | None):
+        self._open.append({
+            "clause_id": clause_id,
+            "label": label,
+            "heading": self._heading,
+            "parent": parent,
+            "level": level,
+            "start": start,
+            "lines": []
+        })
+
+    def _enclosing_numbered_clause(self) -> dict | None:
+        return next((entry for entry in reversed(self._open) if entry["level"] > 0 and "marker" not in entry), None)
+
+    def _process_line(self, line: str, line_start: int):
+        stripped = line.strip()
+        start = line_start + (len(line) - len(line.lstrip()))
+
+        heading = _heading_text(stripped) if stripped else None
+        numbered = NUMBERED_CLAUSE.match(stripped) if stripped and not heading else None
+        sub_clause = SUB_CLAUSE.match(stripped) if stripped and not heading and not numbered else None
+
+        if numbered and numbered.group("keyword") and not numbered.group("delimiter"):
+            # "Section 4 of the ... Act" wrapped onto a new line isn't a clause: an undelimited
+            # keyword-led number must start a paragraph and not refer to a statute
+            if not self._paragraph_start or STATUTE_TAIL.match(stripped, numbered.end("number")):
+                numbered = None
+        elif numbered and not (numbered.group("delimiter") or "." in numbered.group("number")):
+            # A bare number ("30 days ...") is only a clause number if it is introduced or delimited
+            numbered = None
+
+        if heading:
+            self._close_from(0, start)
+            self._heading = heading
+            schedule = SCHEDULE_NAME.search(heading)
+            if schedule:
+                schedule_id = normalize_clause_id(schedule.group(0))
+                self._schedule = (schedule_id, f"{schedule.group(1).capitalize()} {schedule.group(2).upper()}")
+                self._heading_in_schedule = False
+                self._open_entry(schedule_id, heading, 0, start, None)
+            else:
+                self._heading_in_schedule = self._schedule is not None
+        elif numbered:
+            number = numbered.group("number")
+            level = number.count(".") + 1
+            self._close_from(level, start)
+            top_number = int(number.split(".")[0])
+            if self._heading_in_schedule and top_number == self._next_main_number:
+                # The main body's numbering resumes after an inline annexure
+                self._schedule = None
+            if self._schedule is None and level == 1:
+                self._next_main_number = top_number + 1
+            schedule_id, schedule_title = self._schedule or (None, None)
+            parent = number[:number.rindex(".")] if "." in number else None
+            parent = normalize_clause_id(parent, schedule_id) if parent else schedule_id
+            label = f"{(numbered.group('keyword') or 'Clause').capitalize()} {number}"
+            if schedule_title:
+                label = f"{schedule_title}, {label}"
+            self._open_entry(normalize_clause_id(number, schedule_id), label, level, start, parent)
+        elif sub_clause and self._enclosing_numbered_clause():
+            marker = sub_clause.group("marker").lower()
+            parent_entry = self._enclosing_numbered_clause()
+            lettered = next((entry for entry in reversed(self._open) if entry.get("marker_kind") == "letter"), None)
+            # Roman numerals nest inside a lettered sub-clause, except "(i)" continuing "(h)"
+            if (lettered and ROMAN_NUMERAL.match(marker) and not ROMAN_NUMERAL.match(lettered["marker"])
+                    and not (marker == "i" and lettered["marker"] == "h")):
+                parent_entry = lettered
+            level = parent_entry["level"] + 1
+            self._close_from(level, start)
+            clause_id = f"{parent_entry['clause_id']}({marker})"
+            self._open_entry(clause_id, f"{parent_entry['label']}({marker})", level, start, parent_entry["clause_id"])
+            self._open[-1]["marker"] = marker
+            self._open[-1]["marker_kind"] = "roman" if parent_entry is lettered else "letter"
+
+        for entry in self._open:
+            entry["lines"].append(line)
+        # The next line starts a paragraph after a blank line, a heading or a finished sentence
+        self._paragraph_start = not stripped or bool(heading) or stripped.endswith((".", ":", ";"))
+
+def build_clause_index(text_parts) -> list[dict]:
+    """Returns the clause index entries of a document given as an iterable of text parts."""
+    builder = ClauseIndexBuilder()
+    for text_part in text_parts:
+        builder.update(text_part)
+    return builder.finish()
+
+def format_clause(entry: dict) -> str:
+    """Formats an index entry as a context passage, with its heading for orientation."""
+    if entry["level"] == 0:
+        # A schedule's text already starts with its title
+        return entry["text"]
+    title = f"{entry['label']} ({entry['heading']})" if entry.get("heading") else entry["label"]
+    return f"{title}:\n{entry['text']}"
+
+
+if __name__ == "__main__":
+    from text_processing import extract_text_from_pdf
+
+    entries = build_clause_index([extract_text_from_pdf("fake_rent_agreement_filled_expanded.pdf")])
+    print(f"Found {len(entries)} clauses.")
+    for entry in entries[:10]:
+        print(f"{entry['clause_id']:>12}  [{entry['start']}:{entry['end']}]  {entry['text'][:60]!r}")
+    print(find_clause_references("What does clause 6 say, and how does it relate to Annexure I?"))
@@ -1,192 +1,322 @@
-import os
-import tempfile
-import uuid
-import re
-from dotenv import load_dotenv
-from google.cloud import aiplatform, storage
-import pypdf
-from vertexai.language_models import TextEmbeddingModel
-from gcp_handler import save_chunks_to_firestore
-
-# --- Configuration & Initialization ---
-
-# 1. Load variables from .env file into the environment
-load_dotenv()
-
-# 2. Get the Project ID from the environment
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-GCP_REGION = "asia-south1"  # Or your configured region
-
-# 3. **CRUCIAL STEP**: Initialize Vertex AI with the explicit Project ID
-# This prevents the "Permission Denied on project google" error.
-try:
-    aiplatform.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-    print(f"✅ Vertex AI initialized successfully for project: {GCP_PROJECT_ID}")
-except Exception as e:
-    print(f"❌ Error initializing Vertex AI. Your GCP_PROJECT_ID might be missing or incorrect in the .env file.")
-    print(f"   Loaded Project ID: '{GCP_PROJECT_ID}'")
-    raise e
-
-# 4. Continue with other configurations and clients
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
-VECTOR_SEARCH_INDEX_ID = os.getenv("VECTOR_SEARCH_INDEX_ID")
-VECTOR_SEARCH_ENDPOINT_ID = os.getenv("VECTOR_SEARCH_ENDPOINT_ID")
-
-# Initialize other clients
-storage_client = storage.Client(project=GCP_PROJECT_ID)
-
-# Use latest embedding model with proper initialization
-embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-
-# Initialize streaming-enabled Vector Search index
-streaming_index = aiplatform.MatchingEngineIndex(index_name=VECTOR_SEARCH_INDEX_ID)
-
-def chunk_document_text(text, max_chunk_size=1500, min_chunk_size=100, overlap_size=200):
-    """
-    Robust text chunking for legal documents
-    """
-    chunks = []
-    current_chunk = ""
-    
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    
-    for sentence in sentences:
-        # Check if adding this sentence exceeds max size
-        if len(current_chunk) + len(sentence) > max_chunk_size and len(current_chunk) > min_chunk_size:
-            chunks.append(current_chunk.strip())
-            # Start new chunk with overlap
-            words = current_chunk.split()
-            overlap_words = words[-overlap_size//10:] if len(words) > overlap_size//10 else words
-            current_chunk = ' '.join(overlap_words) + ' ' + sentence
-        else:
-            current_chunk += ' ' + sentence if current_chunk else sentence
-    
-    # Add the last chunk
-    if current_chunk.strip() and len(current_chunk.strip()) > min_chunk_size:
-        chunks.append(current_chunk.strip())
-    
-    return [chunk for chunk in chunks if len(chunk.strip()) > min_chunk_size]
-
-def process_and_index_document(gcs_uri: str, firestore_doc_id: str):
-    """
-    Downloads, processes, and indexes a document from GCS into Vector Search
-    and saves its text chunks to Firestore for retrieval.
-
-    Args:
-        gcs_uri (str): The GCS URI of the document (e.g., "gs://bucket/file.pdf").
-        firestore_doc_id (str): The ID of the document's record in the 'analysis_requests' collection.
-    """
-    print(f"Starting processing for document: {gcs_uri}")
-    
-    temp_path = None
-    
-    # 1. Download file from GCS with Windows-compatible temp file handling
-    try:
-        bucket_name, file_name = gcs_uri.replace("gs://", "").split("/", 1)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
-
-        # Windows-safe temp file handling
-        temp_file = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
-        temp_path = temp_file.name
-        temp_file.close()  # Close so Windows can write to it
-        
-        blob.download_to_filename(temp_path)
-        print(f"Downloaded file to: {temp_path}")
-
-        # 2. Parse text from the downloaded PDF
-        reader = pypdf.PdfReader(temp_path)
-        full_text = "\n".join([
-            page.extract_text() for page in reader.pages 
-            if page.extract_text()
-        ])
-        print(f"Extracted {len(full_text)} characters of text.")
-
-    except Exception as e:
-        print(f"❌ Error during file download or parsing: {e}")
-        return None
-    finally:
-        # Clean up temp file
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
-
-    # 3. Chunk the text with improved algorithm
-    chunks = chunk_document_text(full_text)
-    print(f"Split text into {len(chunks)} chunks.")
-
-    if not chunks:
-        print("No suitable text chunks found to process.")
-        return None
-
-    # 4. Save chunks to Firestore and get their unique IDs
-    try:
-        chunk_id_map = save_chunks_to_firestore(firestore_doc_id, chunks)
-        print(f"✅ Saved {len(chunks)} chunks to Firestore for document {firestore_doc_id}.")
-    except Exception as e:
-        print(f"❌ Error saving chunks to Firestore: {e}")
-        return None
-
-    # 5. Generate embeddings with correct format
-    datapoints = []
-    for chunk_id, chunk_text in chunk_id_map.items():
-        try:
-            # Generate embedding using the latest model
-            embeddings = embedding_model.get_embeddings([chunk_text])
-            embedding = embeddings[0].values
-            
-            # Create properly formatted datapoint
-            datapoint = aiplatform.gapic.IndexDatapoint(
-                datapoint_id=chunk_id,
-                feature_vector=embedding,
-                restricts=[
-                    aiplatform.gapic.IndexDatapoint.Restriction(
-                        namespace="firestore_doc_id",
-                        allow_list=[firestore_doc_id]
-                    )
-                ]
-            )
-            datapoints.append(datapoint)
-            
-        except Exception as e:
-            print(f"❌ Error generating embedding for chunk {chunk_id}: {e}")
-            continue
-
-    # 6. Upsert embeddings into Vertex AI Vector Search (streaming)
-    if datapoints:
-        try:
-            streaming_index.upsert_datapoints(datapoints=datapoints)
-            print(f"✅ Successfully upserted {len(datapoints)} datapoints to Vector Search.")
-        except Exception as e:
-            print(f"❌ Error upserting to Vector Search: {e}")
-            print("💾 Saving embeddings to Firestore as fallback...")
-            
-            # Save embeddings within existing chunks as backup
-            from google.cloud import firestore
-            db = firestore.Client(project=GCP_PROJECT_ID)
-            
-            for datapoint in datapoints:
-                chunk_ref = db.collection('analysis_requests').document(firestore_doc_id).collection('chunks').document(datapoint.datapoint_id)
-                
-                # Add embedding field to existing chunk document
-                chunk_ref.update({
-                    'embedding': list(datapoint.feature_vector),
-                    'embedding_model': 'text-embedding-004',
-                    'embedding_timestamp': firestore.SERVER_TIMESTAMP
-                })
-            
-            print(f"✅ Saved {len(datapoints)} embeddings to Firestore chunks as backup.")
-                
-    print("✅ Document processing complete!")
-    return chunk_id_map
-
-# --- Example Usage for Standalone Testing ---
-if __name__ == "__main__":
-    # Check if Vector Search IDs are configured
-    if not VECTOR_SEARCH_INDEX_ID or "YOUR_VECTOR" in str(VECTOR_SEARCH_INDEX_ID):
-        print("❌ Please update the VECTOR_SEARCH_INDEX_ID in your .env file.")
-    else:
-        # Test with your existing document
-        TEST_GCS_URI = "gs://legal_assistant_bucket/tmp6pwhxyvz.pdf"
-        TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
-        
+import os
+import tempfile
+import threading
+from dotenv import load_dotenv
+from google.cloud import aiplatform, storage
+from vertexai.language_models import TextEmbeddingModel
+from gcp_handler import save_chunks_to_firestore, deterministic_chunk_ids, save_chunk_embeddings, mark_document_indexed, save_clause_index
+from text_processing import iter_document_chunk_spans, iter_pdf_page_texts, TextFingerprint
+from clause_index import ClauseIndexBuilder
+from pipeline import Pipeline, batched, format_pipeline_report
+from embedding_codec import encode_embeddings
+from embedding_settings import EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSIONALITY, EMBEDDING_BATCH_SIZE, EMBEDDING_STORAGE_FORMAT
+from vector_shards import ShardWriter, invalidate_shard
+
+# --- Configuration & Initialization ---
+
+# 1. Load variables from .env file into the environment
+load_dotenv()
+
+# 2. Get the Project ID from the environment
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
+GCP_REGION = "asia-south1"  # Or your configured region
+
+# 3. **CRUCIAL STEP**: Initialize Vertex AI with the explicit Project ID
+# This prevents the "Permission Denied on project google" error.
+try:
+    aiplatform.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+    print(f"✅ Vertex AI initialized successfully for project: {GCP_PROJECT_ID}")
+except Exception as e:
+    print(f"❌ Error initializing Vertex AI. Your GCP_PROJECT_ID might be missing or incorrect in the .env file.")
+    print(f"   Loaded Project ID: '{GCP_PROJECT_ID}'")
+    raise e
+
+# 4. Continue with other configurations and clients
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+VECTOR_SEARCH_INDEX_ID = os.getenv("VECTOR_SEARCH_INDEX_ID")
+VECTOR_SEARCH_ENDPOINT_ID = os.getenv("VECTOR_SEARCH_ENDPOINT_ID")
+# Pipelined ingestion: chunks per micro-batch, queue depth between stages, parallel embedding workers
+INGESTION_MICRO_BATCH_SIZE = int(os.getenv("INGESTION_MICRO_BATCH_SIZE", "16"))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "4"))
+INGESTION_EMBEDDING_WORKERS = int(os.getenv("INGESTION_EMBEDDING_WORKERS", "2"))
+
+# Initialize other clients
+storage_client = storage.Client(project=GCP_PROJECT_ID)
+
+# Use latest embedding model with proper initialization
+embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
+
+# Initialize streaming-enabled Vector Search index
+streaming_index = aiplatform.MatchingEngineIndex(index_name=VECTOR_SEARCH_INDEX_ID)
+
+def _make_datapoint(chunk_id: str, embedding: list[float], firestore_doc_id: str):
+    """Creates a properly formatted Vector Search datapoint restricted to its document."""
+    return aiplatform.gapic.IndexDatapoint(
+        datapoint_id=chunk_id,
+        feature_vector=embedding,
+        restricts=[
+            aiplatform.gapic.IndexDatapoint.Restriction(
+                namespace="firestore_doc_id",
+                allow_list=[firestore_doc_id]
+            )
+        ]
+    )
+
+def build_datapoints(chunk_id_map: dict[str, str], firestore_doc_id: str) -> list:
+    """
+    Generates embeddings for a document's chunks and wraps them as Vector Search datapoints.
+
+    Chunks are embedded in batches of EMBEDDING_BATCH_SIZE. If a batch fails, its chunks
+    are retried one at a time so a single bad chunk doesn't drop the whole batch.
+
+    Args:
+        chunk_id_map (dict[str, str]): A mapping of chunk ID to chunk text.
+        firestore_doc_id (str): The ID of the document's record in 'analysis_requests'.
+
+    Returns:
+        list: The datapoints for every chunk that was embedded successfully.
+    """
+    datapoints = []
+    items = list(chunk_id_map.items())
+    for start in range(0, len(items), EMBEDDING_BATCH_SIZE):
+        batch = items[start:start + EMBEDDING_BATCH_SIZE]
+        try:
+            embeddings = embedding_model.get_embeddings(
+                [chunk_text for _, chunk_text in batch], output_dimensionality=EMBEDDING_DIMENSIONALITY
+            )
+            for (chunk_id, _), embedding in zip(batch, embeddings):
+                datapoints.append(_make_datapoint(chunk_id, embedding.values, firestore_doc_id))
+        except Exception as batch_error:
+            print(f"❌ Error generating embeddings for batch starting at chunk {start}: {batch_error}")
+            for chunk_id, chunk_text in batch:
+                try:
+                    embedding = embedding_model.get_embeddings([chunk_text], output_dimensionality=EMBEDDING_DIMENSIONALITY)[0].values
+                    datapoints.append(_make_datapoint(chunk_id, embedding, firestore_doc_id))
+                except Exception as e:
+                    print(f"❌ Error generating embedding for chunk {chunk_id}: {e}")
+                    continue
+    return datapoints
+
+def upsert_datapoints(datapoints: list, firestore_doc_id: str) -> bool:
+    """
+    Saves the datapoints' embeddings on their Firestore chunk documents (compactly
+    encoded, see embedding_codec.py) and upserts them into the streaming Vector
+    Search index. The stored embeddings let any node build a local vector shard
+    without re-embedding, and serve as a fallback if the upsert fails.
+
+    Args:
+        datapoints (list): The datapoints produced by build_datapoints.
+        firestore_doc_id (str): The ID of the document's record in 'analysis_requests'.
+
+    Returns:
+        bool: True if the datapoints reached Vector Search, False otherwise.
+    """
+    if not datapoints:
+        return False
+
+    try:
+        encoded_embeddings = encode_embeddings(
+            [list(datapoint.feature_vector) for datapoint in datapoints], EMBEDDING_STORAGE_FORMAT
+        )
+        save_chunk_embeddings(
+            firestore_doc_id, [datapoint.datapoint_id for datapoint in datapoints], encoded_embeddings, EMBEDDING_MODEL_NAME
+        )
+    except Exception as e:
+        # Shards for this document will be rebuilt in the background (see retrieval_agent.load_vector_shard)
+        print(f"⚠️ Could not save embeddings to Firestore: {e}")
+
+    try:
+        streaming_index.upsert_datapoints(datapoints=datapoints)
+        print(f"✅ Successfully upserted {len(datapoints)} datapoints to Vector Search.")
+        return True
+    except Exception as e:
+        print(f"❌ Error upserting to Vector Search: {e}")
+        return False
+
+def add_to_shard(shard_writer: ShardWriter, datapoints: list):
+    """Appends datapoints' embeddings to a document's local vector shard (see vector_shards.ShardWriter)."""
+    shard_writer.append(
+        [datapoint.datapoint_id for datapoint in datapoints],
+        [list(datapoint.feature_vector) for datapoint in datapoints]
+    )
+
+def publish_document_index(firestore_doc_id: str, shard_writer: ShardWriter | None, document_fingerprint: str | None = None,
+                           clause_entries: list[dict] | None = None, write_shard: bool = True) -> str | None:
+    """
+    Finishes indexing a document: saves its clause index (see clause_index.py),
+    gives it a new index generation (and its text fingerprint) in Firestore and
+    publishes this node's local vector shard from the embeddings appended to
+    shard_writer (see add_to_shard), so workers here can serve the document
+    without calling Vector Search.
+
+    Args:
+        write_shard (bool): False on machines that don't serve queries (e.g. bulk
+                            ingestion). Local shards are then left alone, and the
+                            serving nodes build theirs on the first query, since
+                            the new index generation makes any older shard stale.
+
+    Returns:
+        str | None: The new index generation, or None if it couldn't be recorded.
+    """
+    if clause_entries is not None:
+        try:
+            save_clause_index(firestore_doc_id, clause_entries)
+        except Exception as e:
+            # Clause lookups fall back to semantic retrieval without the index
+            print(f"⚠️ Could not save clause index: {e}")
+
+    try:
+        index_generation = mark_document_indexed(firestore_doc_id, document_fingerprint)
+    except Exception as e:
+        print(f"❌ Error recording index generation: {e}")
+        if shard_writer is not None:
+            shard_writer.discard()
+        if write_shard:
+            invalidate_shard(firestore_doc_id)
+        return None
+
+    if not write_shard:
+        if shard_writer is not None:
+            shard_writer.discard()
+        return index_generation
+    try:
+        if shard_writer is None or shard_writer.commit(index_generation) is None:
+            invalidate_shard(firestore_doc_id)
+    except Exception as e:
+        # The shard is only a cache; workers rebuild it on demand
+        print(f"⚠️ Could not write local vector shard: {e}")
+        invalidate_shard(firestore_doc_id)
+    return index_generation
+
+def download_to_temp_file(gcs_uri: str) -> str:
+    """
+    Downloads a GCS object to a temp file and returns the file's path.
+    The caller is responsible for deleting the file.
+    """
+    bucket_name, file_name = gcs_uri.replace("gs://", "").split("/", 1)
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(file_name)
+
+    # Windows-safe temp file handling
+    temp_file = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    temp_path = temp_file.name
+    temp_file.close()  # Close so Windows can write to it
+
+    try:
+        blob.download_to_filename(temp_path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    print(f"Downloaded file to: {temp_path}")
+    return temp_path
+
+def process_and_index_document(gcs_uri: str, firestore_doc_id: str, full_text: str | None = None):
+    """
+    Downloads, processes, and indexes a document from GCS into Vector Search
+    and saves its text chunks to Firestore for retrieval.
+
+    Ingestion runs as a pipeline of concurrent stages connected by bounded queues:
+    page extraction -> chunking -> Firestore writes -> embedding -> upsert. Chunks
+    flow through in micro-batches of INGESTION_MICRO_BATCH_SIZE, so each batch is
+    searchable as soon as it is upserted, and memory use doesn't grow with the
+    size of the document.
+
+    Args:
+        gcs_uri (str): The GCS URI of the document (e.g., "gs://bucket/file.pdf").
+        firestore_doc_id (str): The ID of the document's record in the 'analysis_requests' collection.
+        full_text (str | None): The document's text, if it was already extracted during upload
+                                (see input.process_legal_document). Skips the GCS download.
+
+    Returns:
+        dict | None: Chunk, datapoint and clause counts, the new index generation and the pipeline
+                     timing report, or None on failure.
+    """
+    print(f"Starting processing for document: {gcs_uri}")
+    
+    temp_path = None
+    stats = {"num_chunks": 0, "num_datapoints": 0, "indexed_batches": 0, "fallback_batches": 0}
+    stats_lock = threading.Lock()
+    shard_writer = ShardWriter(firestore_doc_id)
+    fingerprint = TextFingerprint()
+    clause_index = ClauseIndexBuilder()
+
+    def observed(text_parts):
+        # Fingerprints and clause-indexes the text as it streams into the chunking stage
+        for text_part in text_parts:
+            fingerprint.update(text_part)
+            clause_index.update(text_part)
+            yield text_part
+
+    def save_batch(chunk_batch: list[dict]) -> dict[str, str]:
+        # Batches arrive in document order, so the chunks saved so far give the next sequence number.
+        # Stable IDs make a re-index overwrite the document's chunks instead of adding a second set.
+        first_seq = stats["num_chunks"]
+        chunk_id_map = save_chunks_to_firestore(
+            firestore_doc_id, [chunk["text"] for chunk in chunk_batch],
+            chunk_ids=deterministic_chunk_ids(firestore_doc_id, len(chunk_batch), first_index=first_seq),
+            first_seq=first_seq, positions=chunk_batch
+        )
+        stats["num_chunks"] += len(chunk_id_map)
+        return chunk_id_map
+
+    def embed_batch(chunk_id_map: dict[str, str]) -> list | None:
+        return build_datapoints(chunk_id_map, firestore_doc_id) or None
+
+    def upsert_batch(datapoints: list):
+        indexed = upsert_datapoints(datapoints, firestore_doc_id)
+        with stats_lock:
+            stats["num_datapoints"] += len(datapoints)
+            stats["indexed_batches" if indexed else "fallback_batches"] += 1
+        add_to_shard(shard_writer, datapoints)
+
+    try:
+        # 1. Pick the text source. pypdf needs random access to the whole file, so a
+        #    GCS document is downloaded first; its pages are then extracted lazily.
+        if full_text is None:
+            temp_path = download_to_temp_file(gcs_uri)
+            text_source = iter_pdf_page_texts(temp_path)
+        else:
+            print(f"Using {len(full_text)} characters of text extracted during upload.")
+            text_source = [full_text]
+
+        # 2. Extract -> chunk -> save -> embed -> upsert, all stages running concurrently
+        ingestion_pipeline = (
+            Pipeline(f"ingest-{firestore_doc_id}", queue_size=INGESTION_QUEUE_SIZE)
+            .add_stream_stage("chunk", lambda pages: batched(iter_document_chunk_spans(observed(pages)), INGESTION_MICRO_BATCH_SIZE))
+            .add_stage("firestore", save_batch)
+            .add_stage("embed", embed_batch, workers=INGESTION_EMBEDDING_WORKERS)
+            .add_stage("upsert", upsert_batch)
+        )
+        report = ingestion_pipeline.run(text_source)
+    except Exception as e:
+        print(f"❌ Error during document ingestion: {e}")
+        shard_writer.discard()
+        return None
+    finally:
+        # Clean up temp file
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    if not stats["num_chunks"]:
+        print("No suitable text chunks found to process.")
+        shard_writer.discard()
+        return None
+
+    clause_entries = clause_index.finish()
+    stats["num_clauses"] = len(clause_entries)
+    stats["index_generation"] = publish_document_index(firestore_doc_id, shard_writer, fingerprint.hexdigest(), clause_entries)
+    print(format_pipeline_report(report))
+    print(f"✅ Document processing complete! {stats['num_chunks']} chunks, {stats['num_datapoints']} datapoints.")
+    return {**stats, "pipeline_report": report}
+
+# --- Example Usage for Standalone Testing ---
+if __name__ == "__main__":
+    # Check if Vector Search IDs are configured
+    if not VECTOR_SEARCH_INDEX_ID or "YOUR_VECTOR" in str(VECTOR_SEARCH_INDEX_ID):
+        print("❌ Please update the VECTOR_SEARCH_INDEX_ID in your .env file.")
+    else:
+        # Test with your existing document
+        TEST_GCS_URI = "gs://legal_assistant_bucket/tmp6pwhxyvz.pdf"
+        TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
+        
         process_and_index_document(TEST_GCS_URI, TEST_FIRESTORE_ID)
\ No newline at end of file
@@ -0,0 +1,333 @@
+import os
+import json
+import math
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from text_processing import iter_pdf_page_texts, iter_document_chunk_spans
+from clause_index import build_clause_index
+from embedding_codec import encode_embeddings, decode_embeddings
+from embedding_settings import EMBEDDING_MODEL_NAME, EMBEDDING_BATCH_SIZE
+
+# Offline benchmark of embedding sizes for EMBEDDING_DIMENSIONALITY.
+#
+# The sample contracts are split into clause-sized chunks (--chunk-size, 400
+# characters by default). Ingestion's 1,500-character chunks leave a contract with
+# about a dozen chunks, too few candidates for recall@k to tell dimension settings
+# apart; use --chunk-size 1500 to measure those. More contracts can be added with
+# --questions. For each dimension setting, every chunk and labeled question is
+# embedded with text-embedding-004 at that output size. Each question is searched
+# against its own document's chunks, like a single-document query. A question is
+# answered at k if one of its top-k chunks overlaps the character span of the
+# clause it asks about. The spans come from the clause index (see clause_index.py).
+#
+# For each dimension the report gives:
+#   - recall@k, for full-precision vectors and for the int8 vectors stored on
+#     Firestore chunks;
+#   - mean reciprocal rank;
+# next to the recall@k and mean reciprocal rank of a random ranking of the same
+# chunks (the "random" row), and:
+#   - embedding call latency;
+#   - brute-force search latency over a corpus of --search-rows vectors, like a
+#     large local vector shard;
+#   - bytes per vector as float32 (Vector Search), float16 and int8 (Firestore).
+#
+# Example:
+#   python embedding_benchmark.py --dimensions 768,512,256,128 --k 1,3,5
+#   python embedding_benchmark.py --local-fakes   # dry run, no Vertex AI calls
+#   python embedding_benchmark.py --questions more_contracts.json
+#     where more_contracts.json maps PDF paths (relative to this directory) to
+#     [question, clause ID] pairs, e.g. {"lease.pdf": [["Who pays the rent?", "2"]]}
+
+load_dotenv()
+
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
+GCP_REGION = "asia-south1"
+SAMPLE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Labeled questions for each sample contract: (question, clause ID in its clause index)
+BENCHMARK_QUESTIONS = {
+    "fake_rent_agreement_filled_expanded.pdf": [
+        ("When does the tenancy start and how long does it last?", "1"),
+        ("How much do I have to pay every month and by which date?", "2"),
+        ("Is there a separate monthly charge for upkeep of the building?", "3"),
+        ("How much money did I hand over upfront and when do I get it back?", "4"),
+        ("Which bank account should the rent be transferred to?", "5"),
+        ("What penalty applies if I pay the rent after the due date?", "6"),
+        ("Who pays for electricity, water and gas?", "7"),
+        ("Who is responsible for the municipal taxes on the flat?", "8"),
+        ("Do I have to fix small things like bulbs and taps myself?", "9"),
+        ("Who pays if the building structure needs major repair?", "10"),
+        ("Can I make changes to the walls or remove fittings?", "11"),
+        ("Am I allowed to run a business from the apartment?", "12"),
+        ("Can I rent out a room to someone else?", "13"),
+        ("What furniture and appliances come with the flat?", "annexure i"),
+        ("How many parking spots are included?", "14"),
+        ("Am I required to insure my own belongings?", "16"),
+        ("Do I have to compensate the landlord for claims caused by me?", "17"),
+        ("Can I keep a dog in the apartment?", "18"),
+        ("How much notice do I need to give to leave early?", "20"),
+        ("What condition must the flat be in when I move out?", "21"),
+        ("What happens if I stay on after the lease ends?", "22"),
+        ("How are disagreements between us settled and where?", "23"),
+        ("What if a flood or pandemic stops either side from performing?", "24"),
+        ("Am I allowed to smoke inside?", "28"),
+        ("Can I change the locks on the door?", "30"),
+        ("By how much can the rent go up each year?", "34"),
+        ("Who repaints the exterior and services the water tank?", "annexure ii"),
+        ("What can the owner do if I break the terms of the agreement?", "36"),
+        ("What is the carpet area of the flat?", "annexure iii"),
+    ],
+}
+
+
+def load_benchmark_documents(questions_by_file: dict, chunk_size: int, overlap_size: int) -> list[dict]:
+    """
+    Chunks each sample contract and resolves its questions' clauses to character spans.
+
+    Args:
+        questions_by_file (dict): PDF path (relative to this directory) -> (question, clause ID) pairs.
+        chunk_size (int): Maximum chunk length in characters.
+        overlap_size (int): Overlap between consecutive chunks, as for ingestion.
+
+    Returns:
+        list[dict]: Per document: 'name', 'chunks' (text/start/end dicts) and
+                    'questions' ((question, clause ID, (start, end)) tuples).
+    """
+    documents = []
+    for file_name, questions in questions_by_file.items():
+        pages = list(iter_pdf_page_texts(os.path.join(SAMPLE_DIRECTORY, file_name)))
+        chunks = list(iter_document_chunk_spans(pages, max_chunk_size=chunk_size,
+                                                min_chunk_size=min(100, chunk_size // 4), overlap_size=overlap_size))
+        clauses = {entry["clause_id"]: entry for entry in build_clause_index(pages)}
+        missing = [clause_id for _, clause_id in questions if clause_id not in clauses]
+        if missing:
+            raise ValueError(f"Clauses {missing} are not in the clause index of {file_name}.")
+        documents.append({
+            "name": file_name,
+            "chunks": chunks,
+            "questions": [(question, clause_id, (clauses[clause_id]["start"], clauses[clause_id]["end"]))
+                          for question, clause_id in questions],
+        })
+    return documents
+
+def relevant_rows(chunks: list[dict], span: tuple[int, int]) -> set[int]:
+    """The chunks whose own text overlaps a clause's character span."""
+    start, end = span
+    return {row for row, chunk in enumerate(chunks) if chunk["start"] < end and chunk["end"] > start}
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+def embed_texts(embedding_model, texts: list[str], dimensionality: int, batch_size: int) -> tuple[np.ndarray, list[float]]:
+    """Embeds texts in batches at the given output size. Returns the vectors and each call's latency."""
+    vectors, latencies = [], []
+    for start in range(0, len(texts), batch_size):
+        started = time.perf_counter()
+        embeddings = embedding_model.get_embeddings(texts[start:start + batch_size], output_dimensionality=dimensionality)
+        latencies.append(time.perf_counter() - started)
+        vectors.extend(embedding.values for embedding in embeddings)
+    return np.asarray(vectors, dtype=np.float32), latencies
+
+def score_rankings(chunk_matrix: np.ndarray, query_matrix: np.ndarray, relevant: list[set[int]], ks: list[int]) -> dict:
+    """recall@k for each k and the mean reciprocal rank of the first relevant chunk."""
+    rankings = np.argsort(-(_normalize(query_matrix) @ _normalize(chunk_matrix).T), axis=1)
+    recall = {k: 0 for k in ks}
+    reciprocal_ranks = 0.0
+    for ranking, relevant_set in zip(rankings, relevant):
+        first_hit = next((rank for rank, row in enumerate(ranking) if row in relevant_set), None)
+        if first_hit is None:
+            continue
+        reciprocal_ranks += 1 / (first_hit + 1)
+        for k in ks:
+            recall[k] += first_hit < k
+    return {"recall": recall, "reciprocal_ranks": reciprocal_ranks}
+
+def random_baseline(num_rows: int, relevant: list[set[int]], ks: list[int]) -> dict:
+    """
+    Expected recall@k (summed over questions) and sum of reciprocal ranks of a random
+    ranking of num_rows chunks: the floor a real embedding has to beat.
+    """
+    recall = {k: 0.0 for k in ks}
+    reciprocal_ranks = 0.0
+    for relevant_set in relevant:
+        hits = len(relevant_set)
+        if not hits:
+            continue
+        for k in ks:
+            # Chance that at least one of the relevant chunks is among k drawn at random
+            recall[k] += 1 - math.comb(num_rows - hits, min(k, num_rows)) / math.comb(num_rows, min(k, num_rows))
+        # P(first relevant chunk at rank r) = C(num_rows - r, hits - 1) / C(num_rows, hits)
+        reciprocal_ranks += sum(math.comb(num_rows - rank, hits - 1) / rank
+                                for rank in range(1, num_rows - hits + 2)) / math.comb(num_rows, hits)
+    return {"recall": recall, "reciprocal_ranks": reciprocal_ranks}
+
+def search_latency(chunk_matrix: np.ndarray, query_matrix: np.ndarray, num_rows: int, k: int, repeats: int) -> float:
+    """
+    Median seconds of one brute-force top-k search (as in vector_shards.VectorShard.search)
+    over num_rows vectors built by repeating the document chunks with a little noise.
+    """
+    rng = np.random.default_rng(0)
+    corpus = np.resize(chunk_matrix, (num_rows, chunk_matrix.shape[1]))
+    corpus = _normalize(corpus + 0.01 * rng.standard_normal(corpus.shape).astype(np.float32))
+    queries = _normalize(query_matrix)
+    timings = []
+    for repeat in range(repeats):
+        query = queries[repeat % len(queries)]
+        started = time.perf_counter()
+        scores = corpus @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+def storage_bytes(dimensionality: int) -> dict:
+    """Bytes per vector in Vector Search (float32) and on Firestore chunks (encoded, with header)."""
+    sample = np.zeros((1, dimensionality), dtype=np.float32)
+    return {
+        "float32": dimensionality * 4,
+        "float16": len(encode_embeddings(sample, "float16")[0]),
+        "int8": len(encode_embeddings(sample, "int8")[0]),
+    }
+
+def benchmark_dimension(embedding_model, documents: list[dict], dimensionality: int, ks: list[int],
+                        search_rows: int, repeats: int) -> dict:
+    """Runs the benchmark for one output dimensionality."""
+    totals = {"full": {k: 0 for k in ks}, "int8": {k: 0 for k in ks}}
+    reciprocal_ranks = {"full": 0.0, "int8": 0.0}
+    chunk_latencies, query_latencies, search_seconds = [], [], []
+    num_questions = 0
+
+    for document in documents:
+        chunk_matrix, latencies = embed_texts(embedding_model, [chunk["text"] for chunk in document["chunks"]],
+                                              dimensionality, EMBEDDING_BATCH_SIZE)
+        chunk_latencies.extend(latencies)
+        # Queries are embedded one per call, like a conversation turn
+        query_matrix, latencies = embed_texts(embedding_model, [question for question, _, _ in document["questions"]],
+                                              dimensionality, 1)
+        query_latencies.extend(latencies)
+        relevant = [relevant_rows(document["chunks"], span) for _, _, span in document["questions"]]
+        num_questions += len(relevant)
+
+        int8_matrix = decode_embeddings(encode_embeddings(chunk_matrix, "int8"))
+        for variant, matrix in (("full", chunk_matrix), ("int8", int8_matrix)):
+            scores = score_rankings(matrix, query_matrix, relevant, ks)
+            for k in ks:
+                totals[variant][k] += scores["recall"][k]
+            reciprocal_ranks[variant] += scores["reciprocal_ranks"]
+        search_seconds.append(search_latency(chunk_matrix, query_matrix, search_rows, max(ks), repeats))
+
+    return {
+        "dimensionality": dimensionality,
+        "questions": num_questions,
+        "recall": {f"@{k}": round(totals["full"][k] / num_questions, 3) for k in ks},
+        "recall_int8": {f"@{k}": round(totals["int8"][k] / num_questions, 3) for k in ks},
+        "mrr": round(reciprocal_ranks["full"] / num_questions, 3),
+        "mrr_int8": round(reciprocal_ranks["int8"] / num_questions, 3),
+        "chunk_embedding_call_p50_ms": round(float(np.median(chunk_latencies)) * 1000, 1),
+        "query_embedding_p50_ms": round(float(np.median(query_latencies)) * 1000, 1),
+        "search_p50_us": round(float(np.median(search_seconds)) * 1e6, 1),
+        "bytes_per_vector": storage_bytes(dimensionality),
+    }
+
+def benchmark_random(documents: list[dict], ks: list[int]) -> dict:
+    """The random-ranking baseline over the same documents and questions (independent of dimensionality)."""
+    totals = {k: 0.0 for k in ks}
+    reciprocal_ranks = 0.0
+    num_questions = 0
+    for document in documents:
+        relevant = [relevant_rows(document["chunks"], span) for _, _, span in document["questions"]]
+        num_questions += len(relevant)
+        scores = random_baseline(len(document["chunks"]), relevant, ks)
+        for k in ks:
+            totals[k] += scores["recall"][k]
+        reciprocal_ranks += scores["reciprocal_ranks"]
+    return {
+        "recall": {f"@{k}": round(totals[k] / num_questions, 3) for k in ks},
+        "mrr": round(reciprocal_ranks / num_questions, 3),
+    }
+
+def format_report(report: dict) -> str:
+    ks = report["k"]
+    header = (f"{'dim':>6} " + " ".join(f"{'R@' + str(k):>6}" for k in ks) + " "
+              + " ".join(f"{'R@' + str(k) + 'q8':>7}" for k in ks)
+              + f" {'MRR':>6} {'query ms':>9} {'search us':>10} {'f32 B':>7} {'int8 B':>7}")
+    lines = [
+        f"Embedding benchmark: {report['questions']} questions over {report['chunks']} chunks "
+        f"of up to {report['chunk_size']} characters in {len(report['documents'])} document(s) "
+        f"({report['search_rows']} rows searched for latency)",
+        header,
+        "-" * len(header),
+        f"{'random':>6} " + " ".join(f"{report['random']['recall'][f'@{k}']:>6.3f}" for k in ks) + " "
+        + " ".join(f"{'':>7}" for k in ks) + f" {report['random']['mrr']:>6.3f}",
+    ]
+    for result in report["results"]:
+        lines.append(
+            f"{result['dimensionality']:>6} "
+            + " ".join(f"{result['recall'][f'@{k}']:>6.3f}" for k in ks) + " "
+            + " ".join(f"{result['recall_int8'][f'@{k}']:>7.3f}" for k in ks)
+            + f" {result['mrr']:>6.3f} {result['query_embedding_p50_ms']:>9.1f} {result['search_p50_us']:>10.1f}"
+            + f" {result['bytes_per_vector']['float32']:>7} {result['bytes_per_vector']['int8']:>7}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding sizes by recall on labeled contract questions, latency and storage.")
+    parser.add_argument("--dimensions", default="768,512,256,128", help="Comma-separated output dimensionalities to compare.")
+    parser.add_argument("--k", default="1,3,5", help="Comma-separated cut-offs for recall@k.")
+    parser.add_argument("--chunk-size", type=int, default=400,
+                        help="Maximum chunk length in characters (ingestion uses 1500).")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="Overlap between consecutive chunks (ingestion uses 200).")
+    parser.add_argument("--questions",
+                        help="JSON file mapping more sample PDFs to [question, clause ID] pairs, added to the built-in ones.")
+    parser.add_argument("--search-rows", type=int, default=10000, help="Vectors in the corpus used to time brute-force search.")
+    parser.add_argument("--search-repeats", type=int, default=200, help="Timed searches per document.")
+    parser.add_argument("--local-fakes", action="store_true",
+                        help="Use local_fakes' bag-of-words embeddings instead of Vertex AI (checks the script, not the model).")
+    parser.add_argument("--json-out", help="Also write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    dimensions = [int(dimension) for dimension in args.dimensions.split(",")]
+    ks = sorted(int(k) for k in args.k.split(","))
+
+    if args.local_fakes:
+        import local_fakes
+        local_fakes.install_fakes(profile="fast")
+    import vertexai
+    from vertexai.language_models import TextEmbeddingModel
+    vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+    embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
+
+    questions_by_file = {file_name: list(questions) for file_name, questions in BENCHMARK_QUESTIONS.items()}
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as questions_file:
+            for file_name, pairs in json.load(questions_file).items():
+                questions_by_file.setdefault(file_name, []).extend(tuple(pair) for pair in pairs)
+    documents = load_benchmark_documents(questions_by_file, args.chunk_size, args.chunk_overlap)
+    results = []
+    for dimensionality in dimensions:
+        print(f"Benchmarking {dimensionality} dimensions...")
+        results.append(benchmark_dimension(embedding_model, documents, dimensionality, ks, args.search_rows, args.search_repeats))
+
+    report = {
+        "model": EMBEDDING_MODEL_NAME,
+        "k": ks,
+        "documents": [document["name"] for document in documents],
+        "chunks": sum(len(document["chunks"]) for document in documents),
+        "chunk_size": args.chunk_size,
+        "questions": sum(len(document["questions"]) for document in documents),
+        "search_rows": args.search_rows,
+        "random": benchmark_random(documents, ks),
+        "results": results,
+    }
+    print(format_report(report))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Report written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
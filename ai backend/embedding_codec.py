@@ -0,0 +1,151 @@
+import struct
+import numpy as np
+
+# Compact storage format for embeddings saved on Firestore chunk documents.
+#
+# Each vector is one bytes value: a 16-byte header followed by the payload.
+#   magic   4s   b"EMBQ"
+#   version u8   CODEC_VERSION
+#   format  u8   FORMAT_FLOAT16 or FORMAT_INT8
+#   dim     u16  number of dimensions
+#   scale   f32  int8 only: value = offset + scale * q
+#   offset  f32
+# A 768-dim vector takes 1,552 bytes as float16 or 784 bytes as int8, instead of
+# an array of 768 doubles.
+
+MAGIC = b"EMBQ"
+CODEC_VERSION = 1
+FORMAT_FLOAT16 = 1
+FORMAT_INT8 = 2
+FORMATS = {"float16": FORMAT_FLOAT16, "int8": FORMAT_INT8}
+
+_HEADER = struct.Struct("<4sBBHff")
+HEADER_SIZE = _HEADER.size
+_PAYLOAD_DTYPES = {FORMAT_FLOAT16: np.dtype("<f2"), FORMAT_INT8: np.dtype("i1")}
+
+
+def encode_embeddings(embeddings, storage_format: str = "int8") -> list[bytes]:
+    """
+    Encodes a batch of vectors into the compact format, one bytes value per vector.
+
+    int8 vectors are quantized per vector onto [-127, 127] around the midpoint of
+    their range, so each vector keeps its own scale and offset.
+
+    Args:
+        embeddings: A 2-D array-like of shape (num_vectors, dim).
+        storage_format (str): "int8" or "float16".
+
+    Returns:
+        list[bytes]: The encoded vectors, in input order.
+    """
+    if storage_format not in FORMATS:
+        raise ValueError(f"Unknown embedding storage format '{storage_format}'. Use one of: {', '.join(FORMATS)}")
+    format_code = FORMATS[storage_format]
+    matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    num_vectors, dim = matrix.shape
+
+    if format_code == FORMAT_FLOAT16:
+        payload = matrix.astype("<f2")
+        scales = np.ones(num_vectors, dtype=np.float32)
+        offsets = np.zeros(num_vectors, dtype=np.float32)
+    else:
+        minimums = matrix.min(axis=1)
+        maximums = matrix.max(axis=1)
+        offsets = (minimums + maximums) / 2
+        scales = np.maximum((maximums - minimums) / 254, np.finfo(np.float32).tiny)
+        payload = np.clip(np.rint((matrix - offsets[:, None]) / scales[:, None]), -127, 127).astype("i1")
+
+    payload_bytes = payload.tobytes()
+    row_size = dim * payload.itemsize
+    return [
+        _HEADER.pack(MAGIC, CODEC_VERSION, format_code, dim, float(scales[row]), float(offsets[row]))
+        + payload_bytes[row * row_size:(row + 1) * row_size]
+        for row in range(num_vectors)
+    ]
+
+def encode_embedding(embedding, storage_format: str = "int8") -> bytes:
+    """Encodes a single vector. See encode_embeddings."""
+    return encode_embeddings([embedding], storage_format)[0]
+
+def embedding_dim(blob: bytes) -> int:
+    """The number of dimensions of an encoded vector, read from its header."""
+    return _HEADER.unpack_from(blob)[3]
+
+def _record_dtype(format_code: int, dim: int) -> np.dtype:
+    return np.dtype([
+        ("magic", "S4"), ("version", "u1"), ("format", "u1"), ("dim", "<u2"),
+        ("scale", "<f4"), ("offset", "<f4"),
+        ("payload", _PAYLOAD_DTYPES[format_code], (dim,)),
+    ])
+
+def decode_embeddings(blobs: list[bytes]) -> np.ndarray:
+    """
+    Decodes encoded vectors back into a float32 matrix of shape (len(blobs), dim).
+
+    Vectors sharing a format are decoded together by viewing their concatenated
+    bytes as one structured NumPy array, so there is no per-element Python work.
+    """
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    headers = [_HEADER.unpack_from(blob) for blob in blobs]
+    dims = {header[3] for header in headers}
+    if len(dims) != 1:
+        raise ValueError(f"Cannot decode embeddings with mixed dimensions: {sorted(dims)}")
+    dim = dims.pop()
+
+    matrix = np.empty((len(blobs), dim), dtype=np.float32)
+    rows_by_format = {}
+    for row, (magic, version, format_code, _, _, _) in enumerate(headers):
+        if magic != MAGIC or version != CODEC_VERSION or format_code not in _PAYLOAD_DTYPES:
+            raise ValueError(f"Unsupported embedding encoding (magic={magic!r}, version={version}, format={format_code}).")
+        rows_by_format.setdefault(format_code, []).append(row)
+
+    for format_code, rows in rows_by_format.items():
+        records = np.frombuffer(b"".join(blobs[row] for row in rows), dtype=_record_dtype(format_code, dim))
+        values = records["payload"].astype(np.float32)
+        if format_code == FORMAT_INT8:
+            values = records["offset"][:, None] + records["scale"][:, None] * values
+        matrix[rows] = values
+    return matrix
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """Decodes a single vector. See decode_embeddings."""
+    return decode_embeddings([blob])[0]
+
+def _top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest-cosine rows of matrix for each query."""
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    scores = queries @ matrix.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def recall_check(embeddings, queries, k: int = 10, storage_format: str = "int8") -> float:
+    """
+    Measures how well search over quantized vectors matches full-precision search:
+    the fraction of each query's full-precision top-k neighbours that are also in
+    its top-k over the encoded/decoded vectors (recall@k, 1.0 is identical).
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    k = min(k, len(matrix))
+    decoded = decode_embeddings(encode_embeddings(matrix, storage_format))
+
+    expected = _top_k(matrix, queries, k)
+    actual = _top_k(decoded, queries, k)
+    hits = sum(len(set(expected_row) & set(actual_row)) for expected_row, actual_row in zip(expected, actual))
+    return hits / (len(queries) * k)
+
+
+# --- Example Usage: recall check on synthetic clustered embeddings ---
+if __name__ == "__main__":
+    rng = np.random.default_rng(7)
+    centers = rng.normal(size=(50, 768))
+    corpus = centers[rng.integers(0, 50, size=5000)] + 0.35 * rng.normal(size=(5000, 768))
+    test_queries = centers[rng.integers(0, 50, size=200)] + 0.35 * rng.normal(size=(200, 768))
+
+    full_size = 768 * 8
+    for storage_format in FORMATS:
+        blob_size = len(encode_embedding(corpus[0], storage_format))
+        recall = recall_check(corpus, test_queries, k=10, storage_format=storage_format)
+        print(f"{storage_format:>8}: {blob_size} bytes/vector ({full_size / blob_size:.1f}x smaller than doubles), recall@10 = {recall:.4f}")
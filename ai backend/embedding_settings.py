@@ -0,0 +1,18 @@
+import os
+from dotenv import load_dotenv
+
+# Embedding settings shared by ingestion (doc_processor.py), retrieval (retrieval_agent.py),
+# index creation (create_streaming_index.py) and embedding_benchmark.py. Kept free of
+# Google Cloud imports, so scripts can read them without initializing any client.
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+# Size of the embedding vectors (text-embedding-004 supports up to 768). Must match the
+# Vector Search index's dimensions, so changing it means creating a new index and
+# re-ingesting. See embedding_benchmark.py for the recall, latency and storage of each size.
+EMBEDDING_DIMENSIONALITY = int(os.getenv("EMBEDDING_DIMENSIONALITY", "768"))
+# Texts per get_embeddings call; keeps each request under the model's token limit
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+# Format of the embeddings stored on Firestore chunks (see embedding_codec.py): "int8" or "float16"
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "int8")
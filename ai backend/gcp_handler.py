@@ -1,158 +1,612 @@
-import os
-from google.cloud import firestore, storage
-from datetime import datetime
-from dotenv import load_dotenv
-import uuid
-
-load_dotenv()
-
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
-
-# Initialize Google Cloud Clients
-try:
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    storage_client = storage.Client(project=GCP_PROJECT_ID)
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    print("✅ Initialization Successful!")
-except Exception as e:
-    print(f"Error initializing Google Cloud clients: {e}")
-    print("Please ensure you've authenticated via 'gcloud auth application-default login'")
-    exit()
-
-
-def upload_to_storage(file_path: str) -> str | None:
-    """
-    Uploads a local file to the Google Cloud Storage bucket.
-
-    Args:
-        file_path (str): The local path to the file to upload.
-
-    Returns:
-        str | None: The GCS URI of the uploaded file (e.g., 'gs://bucket/file'), or None if upload fails.
-    """
-    try:
-        # Get the filename from the path
-        file_name = os.path.basename(file_path)
-        
-        # Create a "blob" (the object in GCS)
-        blob = bucket.blob(file_name)
-
-        print(f"Uploading file '{file_name}' to bucket '{GCS_BUCKET_NAME}'...")
-        blob.upload_from_filename(file_path)
-        
-        gcs_uri = f"gs://{GCS_BUCKET_NAME}/{file_name}"
-        print(f"✅ File uploaded successfully. GCS URI: {gcs_uri}")
-        
-        return gcs_uri
-    except Exception as e:
-        print(f"❌ Error uploading file to GCS: {e}")
-        return None
-
-def save_prompt_to_firestore(user_prompt: str, document_gcs_uri: str) -> str | None:
-    """
-    Saves the user's prompt and document location to Firestore.
-
-    Args:
-        user_prompt (str): The text prompt from the user.
-        document_gcs_uri (str): The GCS URI of the associated document.
-
-    Returns:
-        str | None: The ID of the new Firestore document, or None if it fails.
-    """
-    try:
-        # We will store each request in a collection named 'analysis_requests'
-        collection_ref = db.collection('analysis_requests')
-        
-        data = {
-            'prompt': user_prompt,
-            'document_uri': document_gcs_uri,
-            'status': 'pending', # To track the analysis status later
-            'timestamp': datetime.utcnow()
-        }
-        
-        print("Saving prompt to Firestore...")
-        update_time, doc_ref = collection_ref.add(data)
-        
-        print(f"✅ Prompt saved successfully to Firestore with Document ID: {doc_ref.id}")
-        return doc_ref.id
-    except Exception as e:
-        print(f"❌ Error saving prompt to Firestore: {e}")
-        return None
-    
-def save_chunks_to_firestore(request_doc_id: str, text_chunks: list[str]) -> dict[str, str]:
-    """Saves text chunks to a subcollection in Firestore and returns their IDs."""
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    batch = db.batch()
-    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
-    
-    chunk_id_map = {}
-    for chunk_text in text_chunks:
-        chunk_id = str(uuid.uuid4())
-        doc_ref = chunks_collection_ref.document(chunk_id)
-        batch.set(doc_ref, {"text": chunk_text, "indexed_time": firestore.SERVER_TIMESTAMP})
-        chunk_id_map[chunk_id] = chunk_text
-        
-    batch.commit()
-    print(f"✅ Saved {len(text_chunks)} chunks to Firestore for document {request_doc_id}.")
-    return chunk_id_map
-
-def get_chunks_by_ids(request_doc_id: str, chunk_ids: list[str]) -> list[str]:
-    """Retrieves text chunks from Firestore based on a list of chunk IDs."""
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
-    
-    retrieved_chunks = []
-    for chunk_id in chunk_ids:
-        doc_ref = chunks_collection_ref.document(chunk_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            retrieved_chunks.append(doc.to_dict().get("text", ""))
-            
-    print(f"Retrieved {len(retrieved_chunks)} text chunks from Firestore.")
-    return retrieved_chunks
-
-def get_request_details(request_doc_id: str) -> dict:
-    """Fetches the main request document from Firestore."""
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    doc_ref = db.collection('analysis_requests').document(request_doc_id)
-    doc = doc_ref.get()
-    if doc.exists:
-        print(f"✅ Fetched request details for doc ID: {request_doc_id}")
-        return doc.to_dict()
-    else:
-        print(f"❌ No request document found with ID: {request_doc_id}")
-        return None
-
-def get_all_chunks_for_document(request_doc_id: str) -> str:
-    """Retrieves all text chunks for a document and concatenates them."""
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
-    
-    all_chunks = []
-    for doc in chunks_collection_ref.stream():
-        chunk_text = doc.to_dict().get("text")
-        if chunk_text:
-            all_chunks.append(chunk_text)
-    
-    if all_chunks:
-        print(f"✅ Fetched and concatenated {len(all_chunks)} chunks for doc ID: {request_doc_id}")
-        return "\n\n".join(all_chunks)
-    else:
-        print(f"❌ No text chunks found for doc ID: {request_doc_id}")
-        return None
-    
-def update_conversation_history(request_doc_id: str, user_query: str, model_response: str):
-    """Appends a user query and a model response to the chat history array in Firestore."""
-    db = firestore.Client(project=GCP_PROJECT_ID)
-    doc_ref = db.collection('analysis_requests').document(request_doc_id)
-    
-    # Structure the conversation turn as objects in an array
-    user_message = {"role": "user", "content": user_query, "timestamp": firestore.SERVER_TIMESTAMP}
-    model_message = {"role": "model", "content": model_response, "timestamp": firestore.SERVER_TIMESTAMP}
-    
-    # Use ArrayUnion to append the new messages
-    doc_ref.update({
-        "chat_history": firestore.ArrayUnion([user_message, model_message])
-    })
-    print(f"✅ Appended conversation turn to Firestore for doc ID: {request_doc_id}")
\ No newline at end of file
+import os
+from google.cloud import firestore, storage
+from datetime import datetime
+from dotenv import load_dotenv
+import uuid
+import time
+
+load_dotenv()
+
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+FIRESTORE_MAX_BATCH_WRITES = 500
+# Chunks read per query when streaming a document's chunks in order
+CHUNK_PAGE_SIZE = int(os.getenv("CHUNK_PAGE_SIZE", "50"))
+# Uploads above this size use resumable, chunked transfers (chunk size must be a multiple of 256 KB)
+RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Initialize Google Cloud Clients
+try:
+    db = firestore.Client(project=GCP_PROJECT_ID)
+    storage_client = storage.Client(project=GCP_PROJECT_ID)
+    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    print("✅ Initialization Successful!")
+except Exception as e:
+    print(f"Error initializing Google Cloud clients: {e}")
+    print("Please ensure you've authenticated via 'gcloud auth application-default login'")
+    exit()
+
+
+def upload_to_storage(file_path: str, object_name: str | None = None) -> str | None:
+    """
+    Uploads a local file to the Google Cloud Storage bucket.
+
+    Args:
+        file_path (str): The local path to the file to upload.
+        object_name (str | None): The object name to create; defaults to the file's name.
+
+    Returns:
+        str | None: The GCS URI of the uploaded file (e.g., 'gs://bucket/file'), or None if upload fails.
+    """
+    # Get the filename from the path
+    file_name = object_name or os.path.basename(file_path)
+    with open(file_path, "rb") as file_obj:
+        return upload_stream_to_storage(file_obj, file_name, size=os.path.getsize(file_path))
+
+def upload_stream_to_storage(file_obj, file_name: str, size: int | None = None, content_type: str | None = None) -> str | None:
+    """
+    Streams a binary file-like object (e.g. an in-memory buffer) straight to the
+    Google Cloud Storage bucket, without staging it on local disk.
+
+    Files larger than RESUMABLE_UPLOAD_THRESHOLD, or of unknown size, are sent as a
+    resumable upload in UPLOAD_CHUNK_SIZE pieces, so a dropped connection only
+    retries the current chunk instead of the whole file.
+
+    Args:
+        file_obj: A readable binary file-like object, positioned at the start of the content.
+        file_name (str): The object name to create in the bucket.
+        size (int | None): The number of bytes to upload, if known.
+        content_type (str | None): The MIME type to store with the object.
+
+    Returns:
+        str | None: The GCS URI of the uploaded file (e.g., 'gs://bucket/file'), or None if upload fails.
+    """
+    try:
+        # Create a "blob" (the object in GCS)
+        if size is None or size > RESUMABLE_UPLOAD_THRESHOLD:
+            blob = bucket.blob(file_name, chunk_size=UPLOAD_CHUNK_SIZE)
+        else:
+            blob = bucket.blob(file_name)
+
+        print(f"Uploading file '{file_name}' to bucket '{GCS_BUCKET_NAME}'...")
+        blob.upload_from_file(file_obj, size=size, content_type=content_type)
+        
+        gcs_uri = f"gs://{GCS_BUCKET_NAME}/{file_name}"
+        print(f"✅ File uploaded successfully. GCS URI: {gcs_uri}")
+        
+        return gcs_uri
+    except Exception as e:
+        print(f"❌ Error uploading file to GCS: {e}")
+        return None
+
+def save_prompt_to_firestore(user_prompt: str, document_gcs_uri: str, use_analysis_cache: bool = True) -> str | None:
+    """
+    Saves the user's prompt and document location to Firestore.
+
+    Args:
+        user_prompt (str): The text prompt from the user.
+        document_gcs_uri (str): The GCS URI of the associated document.
+        use_analysis_cache (bool): Whether this request may reuse a cached analysis of an
+                                   identical document (see analysis_cache.py).
+
+    Returns:
+        str | None: The ID of the new Firestore document, or None if it fails.
+    """
+    try:
+        # We will store each request in a collection named 'analysis_requests'
+        collection_ref = db.collection('analysis_requests')
+        
+        data = {
+            'prompt': user_prompt,
+            'document_uri': document_gcs_uri,
+            'status': 'pending', # To track the analysis status later
+            'timestamp': datetime.utcnow(),
+            'use_analysis_cache': use_analysis_cache
+        }
+        
+        print("Saving prompt to Firestore...")
+        update_time, doc_ref = collection_ref.add(data)
+        
+        print(f"✅ Prompt saved successfully to Firestore with Document ID: {doc_ref.id}")
+        return doc_ref.id
+    except Exception as e:
+        print(f"❌ Error saving prompt to Firestore: {e}")
+        return None
+    
+def deterministic_chunk_ids(request_doc_id: str, num_chunks: int, first_index: int = 0) -> list[str]:
+    """
+    Builds stable chunk IDs for a document, so re-running ingestion for the same
+    document overwrites its chunks and datapoints instead of duplicating them.
+    Pass first_index when the chunks are saved in batches.
+    """
+    return [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{request_doc_id}/{index}"))
+            for index in range(first_index, first_index + num_chunks)]
+
+def save_chunks_to_firestore(request_doc_id: str, text_chunks: list[str], chunk_ids: list[str] | None = None,
+                             first_seq: int = 0, positions: list[dict] | None = None) -> dict[str, str]:
+    """
+    Saves text chunks to a subcollection in Firestore and returns their IDs.
+
+    Each chunk is stored with its sequence number in the document ('seq'), so it
+    can be read back in document order (see stream_document_chunks).
+
+    Args:
+        request_doc_id (str): The ID of the document's record in 'analysis_requests'.
+        text_chunks (list[str]): The chunk texts to save, in document order.
+        chunk_ids (list[str] | None): Optional IDs to use for the chunks. Random UUIDs are used if omitted.
+        first_seq (int): The sequence number of the first chunk (for documents saved in batches).
+        positions (list[dict] | None): Each chunk's 'start', 'end' and 'overlap_chars'
+                                       (see text_processing.iter_document_chunk_spans).
+
+    Returns:
+        dict[str, str]: A mapping of chunk ID to chunk text.
+    """
+    if chunk_ids is None:
+        chunk_ids = [str(uuid.uuid4()) for _ in text_chunks]
+    if positions is None:
+        positions = [{} for _ in text_chunks]
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+    
+    chunk_id_map = {}
+    batch = db.batch()
+    pending_writes = 0
+    for seq, (chunk_id, chunk_text, position) in enumerate(zip(chunk_ids, text_chunks, positions), start=first_seq):
+        doc_ref = chunks_collection_ref.document(chunk_id)
+        batch.set(doc_ref, {
+            "text": chunk_text,
+            "seq": seq,
+            "start": position.get("start"),
+            "end": position.get("end"),
+            "overlap_chars": position.get("overlap_chars", 0),
+            "indexed_time": firestore.SERVER_TIMESTAMP
+        })
+        chunk_id_map[chunk_id] = chunk_text
+        pending_writes += 1
+
+        # Firestore rejects batches with more than 500 writes
+        if pending_writes == FIRESTORE_MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+
+    if pending_writes:
+        batch.commit()
+    print(f"✅ Saved {len(text_chunks)} chunks to Firestore for document {request_doc_id}.")
+    return chunk_id_map
+
+def save_chunk_embeddings(request_doc_id: str, chunk_ids: list[str], encoded_embeddings: list[bytes], embedding_model: str):
+    """
+    Stores encoded embeddings (see embedding_codec.py) on their existing chunk
+    documents as 'embedding_q', in batches of at most FIRESTORE_MAX_BATCH_WRITES.
+    """
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+    batch = db.batch()
+    pending_writes = 0
+    for chunk_id, encoded_embedding in zip(chunk_ids, encoded_embeddings):
+        batch.update(chunks_collection_ref.document(chunk_id), {
+            'embedding_q': encoded_embedding,
+            'embedding_model': embedding_model,
+            'embedding_timestamp': firestore.SERVER_TIMESTAMP
+        })
+        pending_writes += 1
+        if pending_writes == FIRESTORE_MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+
+    if pending_writes:
+        batch.commit()
+
+def get_chunks_for_documents(chunk_refs: list[tuple[str, str]]) -> dict[str, tuple[str, str]]:
+    """
+    Retrieves chunks of several documents in one batched read, one document read per chunk.
+
+    Args:
+        chunk_refs (list[tuple[str, str]]): (document ID, chunk ID) pairs; duplicates are read once.
+
+    Returns:
+        dict[str, tuple[str, str]]: A mapping of chunk ID to (document ID, chunk text).
+    """
+    chunk_refs = list(dict.fromkeys(chunk_refs))
+    doc_refs = [
+        db.collection('analysis_requests').document(request_doc_id).collection('chunks').document(chunk_id)
+        for request_doc_id, chunk_id in chunk_refs
+    ]
+    if not doc_refs:
+        return {}
+
+    chunks = {}
+    for doc in db.get_all(doc_refs):
+        if doc.exists:
+            request_doc_id = doc.reference.parent.parent.id
+            chunks[doc.id] = (request_doc_id, doc.to_dict().get("text", ""))
+
+    print(f"Retrieved {len(chunks)} text chunks from Firestore across {len({doc_id for doc_id, _ in chunk_refs})} documents.")
+    return chunks
+
+def get_request_details(request_doc_id: str) -> dict:
+    """Fetches the main request document from Firestore."""
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    doc = doc_ref.get()
+    if doc.exists:
+        print(f"✅ Fetched request details for doc ID: {request_doc_id}")
+        return doc.to_dict()
+    else:
+        print(f"❌ No request document found with ID: {request_doc_id}")
+        return None
+
+def _chunk_record(doc) -> dict:
+    data = doc.to_dict()
+    return {
+        "id": doc.id,
+        "seq": data.get("seq"),
+        "text": data.get("text", ""),
+        "start": data.get("start"),
+        "end": data.get("end"),
+        "overlap_chars": data.get("overlap_chars", 0)
+    }
+
+def stitch_chunks(chunks: list[dict]) -> list[str]:
+    """
+    Joins chunks (as returned by stream_document_chunks, in document order) into
+    passages. Consecutive chunks are joined without the overlap each one repeats
+    from its predecessor; a gap in the sequence starts a new passage.
+    """
+    passages = []
+    previous_seq = None
+    for chunk in chunks:
+        if passages and previous_seq is not None and chunk["seq"] == previous_seq + 1:
+            passages[-1] += " " + chunk["text"][chunk["overlap_chars"]:].strip()
+        else:
+            passages.append(chunk["text"])
+        previous_seq = chunk["seq"]
+    return passages
+
+def stream_document_chunks(request_doc_id: str, start_seq: int = 0, end_seq: int | None = None, page_size: int = CHUNK_PAGE_SIZE):
+    """
+    Yields a document's chunks in document order, from sequence number start_seq up
+    to (but not including) end_seq, reading page_size chunks per query. Stopping
+    early stops the reads, so callers only fetch what they consume.
+
+    Yields:
+        dict: 'id', 'seq', 'text', 'start', 'end' and 'overlap_chars' of each chunk.
+    """
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+    next_seq = start_seq
+    while end_seq is None or next_seq < end_seq:
+        limit = page_size if end_seq is None else min(page_size, end_seq - next_seq)
+        query = chunks_collection_ref.where(filter=firestore.FieldFilter("seq", ">=", next_seq))
+        if end_seq is not None:
+            query = query.where(filter=firestore.FieldFilter("seq", "<", end_seq))
+        page = [_chunk_record(doc) for doc in query.order_by("seq").limit(limit).stream()]
+        yield from page
+        if len(page) < limit:
+            return
+        next_seq = page[-1]["seq"] + 1
+
+def get_chunk_range(request_doc_id: str, start_seq: int, end_seq: int) -> list[dict]:
+    """Returns the chunks with sequence numbers in [start_seq, end_seq), in document order."""
+    return list(stream_document_chunks(request_doc_id, start_seq, end_seq, page_size=max(end_seq - start_seq, 1)))
+
+def get_chunk_neighbors(request_doc_id: str, chunk_ids: list[str], window: int = 1) -> list[list[dict]]:
+    """
+    Expands retrieval hits to their neighboring chunks.
+
+    Args:
+        request_doc_id (str): The ID of the document's record in 'analysis_requests'.
+        chunk_ids (list[str]): The hit chunks' IDs, best first.
+        window (int): How many chunks to include on each side of a hit.
+
+    Returns:
+        list[list[dict]]: Runs of consecutive chunks in document order, one per group of
+                          hits whose windows overlap, ordered by their best hit.
+    """
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+    hits = {doc.id: _chunk_record(doc) for doc in db.get_all([chunks_collection_ref.document(chunk_id) for chunk_id in chunk_ids]) if doc.exists}
+
+    runs = []  # [first_seq, last_seq, hit chunk (for chunks without a sequence number)]
+    for chunk_id in chunk_ids:
+        hit = hits.get(chunk_id)
+        if hit is None:
+            continue
+        if hit["seq"] is None:
+            runs.append([None, None, hit])
+            continue
+        first_seq, last_seq = max(hit["seq"] - window, 0), hit["seq"] + window
+        overlapping = next((run for run in runs if run[0] is not None and first_seq <= run[1] + 1 and run[0] <= last_seq + 1), None)
+        if overlapping:
+            overlapping[0], overlapping[1] = min(overlapping[0], first_seq), max(overlapping[1], last_seq)
+        else:
+            runs.append([first_seq, last_seq, None])
+
+    return [
+        [hit] if hit is not None else get_chunk_range(request_doc_id, first_seq, last_seq + 1)
+        for first_seq, last_seq, hit in runs
+    ]
+
+def _stream_unordered_chunk_texts(request_doc_id: str):
+    # Chunks saved before sequence numbers were stored can only be read in ID order
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+    for doc in chunks_collection_ref.stream():
+        chunk_text = doc.to_dict().get("text")
+        if chunk_text:
+            yield chunk_text
+
+def get_all_chunks_for_document(request_doc_id: str) -> str:
+    """Retrieves all text chunks for a document and joins them in document order, without their overlaps."""
+    all_chunks = [chunk for chunk in stream_document_chunks(request_doc_id) if chunk["text"]]
+    if all_chunks:
+        print(f"✅ Fetched and concatenated {len(all_chunks)} chunks for doc ID: {request_doc_id}")
+        return "\n\n".join(stitch_chunks(all_chunks))
+
+    legacy_chunks = list(_stream_unordered_chunk_texts(request_doc_id))
+    if legacy_chunks:
+        print(f"✅ Fetched and concatenated {len(legacy_chunks)} unordered chunks for doc ID: {request_doc_id}")
+        return "\n\n".join(legacy_chunks)
+    print(f"❌ No text chunks found for doc ID: {request_doc_id}")
+    return None
+    
+def get_document_head(request_doc_id: str, max_chars: int = 2000) -> str | None:
+    """
+    Returns the first `max_chars` characters of a document's text, reading its
+    chunks in document order and stopping as soon as enough text has been read.
+    """
+    head_chunks = []
+    head_length = 0
+    for chunk in stream_document_chunks(request_doc_id, page_size=max(max_chars // 1000, 1)):
+        head_chunks.append(chunk)
+        head_length += len(chunk["text"]) - chunk["overlap_chars"]
+        if head_length >= max_chars:
+            break
+    if head_chunks:
+        return "\n\n".join(stitch_chunks(head_chunks))[:max_chars]
+
+    for chunk_text in _stream_unordered_chunk_texts(request_doc_id):
+        head_chunks.append(chunk_text)
+        head_length += len(chunk_text) + 2
+        if head_length >= max_chars:
+            break
+    if not head_chunks:
+        print(f"❌ No text chunks found for doc ID: {request_doc_id}")
+        return None
+    return "\n\n".join(head_chunks)[:max_chars]
+    
+def update_conversation_history(request_doc_id: str, user_query: str, model_response: str):
+    """Appends a user query and a model response to the chat history array in Firestore."""
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    
+    # Structure the conversation turn as objects in an array
+    user_message = {"role": "user", "content": user_query, "timestamp": firestore.SERVER_TIMESTAMP}
+    model_message = {"role": "model", "content": model_response, "timestamp": firestore.SERVER_TIMESTAMP}
+    
+    # Use ArrayUnion to append the new messages
+    doc_ref.update({
+        "chat_history": firestore.ArrayUnion([user_message, model_message])
+    })
+    print(f"✅ Appended conversation turn to Firestore for doc ID: {request_doc_id}")
+
+def save_analysis_checkpoint(request_doc_id: str, step: str, output: str):
+    """
+    Persists one completed step of the initial analysis (e.g. 'research_findings')
+    on the request document, so an interrupted analysis can resume from it.
+    """
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    doc_ref.update({
+        f"analysis_checkpoints.{step}": output,
+        "analysis_checkpoint_step": step,
+        "analysis_checkpoint_time": firestore.SERVER_TIMESTAMP
+    })
+    print(f"💾 Checkpointed analysis step '{step}' for doc ID: {request_doc_id}")
+
+def mark_document_indexed(request_doc_id: str, document_fingerprint: str | None = None) -> str:
+    """
+    Records that a document has just been (re-)indexed by giving it a new
+    'index_generation'. Local vector shards built from an older generation are
+    treated as stale (see vector_shards.py).
+
+    Args:
+        request_doc_id (str): The ID of the document in 'analysis_requests'.
+        document_fingerprint (str | None): The fingerprint of the document's text
+                                           (see text_processing.TextFingerprint), if known.
+
+    Returns:
+        str: The new index generation.
+    """
+    index_generation = uuid.uuid4().hex
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    update = {
+        "index_generation": index_generation,
+        "indexed_time": firestore.SERVER_TIMESTAMP
+    }
+    if document_fingerprint:
+        update["document_fingerprint"] = document_fingerprint
+    doc_ref.update(update)
+    print(f"✅ Marked doc ID {request_doc_id} as indexed (generation {index_generation}).")
+    return index_generation
+
+def get_chunks_with_embeddings(request_doc_id: str) -> list[tuple[str, str, bytes | None]]:
+    """
+    Streams every chunk of a document with its stored fallback embedding, if any.
+
+    Returns:
+        list[tuple[str, str, bytes | None]]: (chunk ID, chunk text, encoded 'embedding_q' or None).
+    """
+    chunks_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('chunks')
+
+    chunks = []
+    for doc in chunks_collection_ref.stream():
+        chunk_data = doc.to_dict()
+        if chunk_data.get("text"):
+            chunks.append((doc.id, chunk_data["text"], chunk_data.get("embedding_q")))
+    return chunks
+
+def update_ingestion_status(request_doc_id: str, status: str, **fields):
+    """
+    Records the state of a document's background ingestion job ('queued', 'running',
+    'complete' or 'failed') on its request document, so any service node can report it.
+    Extra keyword arguments (e.g. num_chunks, error) are stored alongside the status.
+    """
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    update = {f"ingestion.{key}": value for key, value in fields.items()}
+    update["ingestion.status"] = status
+    update["ingestion.updated_time"] = firestore.SERVER_TIMESTAMP
+    doc_ref.update(update)
+    print(f"📋 Ingestion status for doc ID {request_doc_id}: {status}")
+
+def acquire_analysis_lease(request_doc_id: str, owner: str, lease_seconds: float) -> tuple[str, dict | None]:
+    """
+    Tries to take the lease that allows one worker to run a document's initial analysis.
+
+    Runs in a Firestore transaction, so only one of several concurrent callers can win.
+    A lease whose holder stopped renewing it (expires_at has passed) is taken over.
+    On success the document's status is set to 'processing'.
+
+    Args:
+        request_doc_id (str): The ID of the document in 'analysis_requests'.
+        owner (str): A unique identifier of the calling worker and attempt.
+        lease_seconds (float): How long the lease stays valid without being renewed.
+
+    Returns:
+        tuple[str, dict | None]: The outcome - 'acquired', 'held' (another worker holds a live
+        lease), 'complete' (the analysis already finished) or 'missing' - and the request
+        document's data as read in the transaction.
+    """
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return "missing", None
+        request_data = snapshot.to_dict()
+        if request_data.get("status") == "complete":
+            return "complete", request_data
+
+        now = time.time()
+        lease = request_data.get("analysis_lease") or {}
+        if lease.get("owner") not in (None, owner) and lease.get("expires_at", 0) > now:
+            return "held", request_data
+        if lease.get("owner") not in (None, owner):
+            print(f"⚠️ Taking over expired analysis lease of {lease['owner']} for doc ID: {request_doc_id}")
+
+        transaction.update(doc_ref, {
+            "analysis_lease": {"owner": owner, "expires_at": now + lease_seconds},
+            "status": "processing"
+        })
+        return "acquired", request_data
+
+    return claim(db.transaction())
+
+def renew_analysis_lease(request_doc_id: str, owner: str, lease_seconds: float) -> bool:
+    """Extends the analysis lease if `owner` still holds it. Returns False if the lease was lost."""
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+
+    @firestore.transactional
+    def renew(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        lease = (snapshot.to_dict() or {}).get("analysis_lease") or {}
+        if lease.get("owner") != owner:
+            return False
+        transaction.update(doc_ref, {"analysis_lease.expires_at": time.time() + lease_seconds})
+        return True
+
+    return renew(db.transaction())
+
+def finish_analysis_lease(request_doc_id: str, owner: str, final_fields: dict) -> bool:
+    """
+    Stores the outcome of an analysis (e.g. status and results) and releases the lease,
+    in one transaction. Nothing is written if another worker has taken the lease over.
+
+    Returns:
+        bool: True if the outcome was stored.
+    """
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+
+    @firestore.transactional
+    def finish(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        lease = (snapshot.to_dict() or {}).get("analysis_lease") or {}
+        if lease.get("owner") not in (None, owner):
+            return False
+        transaction.update(doc_ref, {**final_fields, "analysis_lease": firestore.DELETE_FIELD})
+        return True
+
+    stored = finish(db.transaction())
+    if not stored:
+        print(f"⚠️ Analysis lease for doc ID {request_doc_id} was taken over; not storing this run's outcome.")
+    return stored
+
+def save_clause_index(request_doc_id: str, clause_entries: list[dict]):
+    """
+    Replaces a document's clause index (see clause_index.py) in its 'clauses'
+    subcollection. Each entry is stored under its clause ID, so a clause can be
+    read directly by ID; entries from a previous indexing of the document that
+    no longer exist are deleted.
+    """
+    clauses_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('clauses')
+    new_ids = {entry["clause_id"] for entry in clause_entries}
+    stale_refs = [doc.reference for doc in clauses_collection_ref.stream() if doc.id not in new_ids]
+
+    batch = db.batch()
+    pending_writes = 0
+    writes = [(stale_ref, None) for stale_ref in stale_refs]
+    writes += [(clauses_collection_ref.document(entry["clause_id"]), entry) for entry in clause_entries]
+    for doc_ref, entry in writes:
+        if entry is None:
+            batch.delete(doc_ref)
+        else:
+            batch.set(doc_ref, entry)
+        pending_writes += 1
+
+        # Firestore rejects batches with more than 500 writes
+        if pending_writes == FIRESTORE_MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+
+    if pending_writes:
+        batch.commit()
+    print(f"✅ Saved clause index with {len(clause_entries)} entries for doc ID: {request_doc_id}")
+
+def get_clauses(request_doc_id: str, clause_ids: list[str]) -> dict[str, dict]:
+    """
+    Reads clause index entries by clause ID in one batched read.
+
+    Returns:
+        dict[str, dict]: A mapping of clause ID to entry, for the IDs that exist.
+    """
+    clauses_collection_ref = db.collection('analysis_requests').document(request_doc_id).collection('clauses')
+    doc_refs = [clauses_collection_ref.document(clause_id) for clause_id in dict.fromkeys(clause_ids)]
+    if not doc_refs:
+        return {}
+    return {doc.id: doc.to_dict() for doc in db.get_all(doc_refs) if doc.exists}
+
+def record_usage(request_doc_id: str, kind: str, usage_summary: dict):
+    """
+    Adds a request's model usage (a UsageLedger summary) to its running totals
+    ('usage_totals.<kind>' on the request document) and to the day's totals by step
+    in the 'usage_counters' collection, for cost reporting.
+
+    Args:
+        request_doc_id (str): The ID of the document in 'analysis_requests'.
+        kind (str): The kind of request, e.g. 'analysis' or 'conversation'.
+        usage_summary (dict): The output of UsageLedger.summary().
+    """
+    numeric_fields = ("calls", "errors", "input_tokens", "output_tokens", "total_tokens", "seconds")
+    totals = usage_summary["totals"]
+    doc_ref = db.collection('analysis_requests').document(request_doc_id)
+    doc_ref.update({
+        f"usage_totals.{kind}.{field}": firestore.Increment(totals[field]) for field in numeric_fields
+    })
+
+    day = datetime.utcnow().strftime("%Y-%m-%d")
+    daily_counts = {
+        kind: {
+            step: {field: firestore.Increment(step_totals[field]) for field in numeric_fields}
+            for step, step_totals in usage_summary["by_step"].items()
+        },
+        "updated_time": firestore.SERVER_TIMESTAMP
+    }
+    db.collection('usage_counters').document(day).set(daily_counts, merge=True)
+    print(f"📊 Recorded {totals['total_tokens']} tokens of {kind} usage for doc ID: {request_doc_id}")
\ No newline at end of file
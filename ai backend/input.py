@@ -1,106 +1,139 @@
-import os
-import tempfile
-from gcp_handler import upload_to_storage, save_prompt_to_firestore
-
-
-def process_legal_document(file_name: str, file_content: bytes, prompt: str) -> dict:
-    """
-    Processes an uploaded document and prompt, simulating a backend endpoint.
-
-    This function takes in-memory file content (as bytes), saves it to a 
-    temporary file, uploads it to Google Cloud Storage, saves the prompt
-    to Firestore, and then cleans up the temporary file.
-
-    Args:
-        file_name (str): The original name of the uploaded file (e.g., "contract.pdf").
-        file_content (bytes): The raw content of the file.
-        prompt (str): The user's text prompt.
-
-    Returns:
-        dict: A dictionary containing the status and results of the operation.
-    """
-
-    temp_file_path = None
-    try:
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file_name)[1]) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-
-        print(f"Temporarily saved uploaded content to: {temp_file_path}")
-
-        # 1. Call the handler function to upload the document to GCS
-        print("\nProcessing your request...")
-        document_gcs_uri = upload_to_storage(temp_file_path)
-        
-        # 2. If upload was successful, save the prompt to Firestore
-        if document_gcs_uri:
-            firestore_doc_id = save_prompt_to_firestore(prompt, document_gcs_uri)
-            if firestore_doc_id:
-                print("\n--- 🚀 All Done! ---")
-                print("Your request has been submitted successfully.")
-                # Return a success response
-                return {
-                    "status": "success",
-                    "gcs_uri": document_gcs_uri,
-                    "firestore_id": firestore_doc_id
-                }
-            else:
-                return {"status": "error", "message": "Failed to save prompt to Firestore."}
-        else:
-            return {"status": "error", "message": "Failed to upload document to Cloud Storage."}
-
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return {"status": "error", "message": str(e)}
-    
-    finally:
-        # 3. Clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            print(f"Cleaned up temporary file: {temp_file_path}")
-
-
-# ==============================================================================
-# --- EXAMPLE USAGE ---
-# This block simulates a call from a UI to test the function above.
-# In a real web application (e.g., using Flask or FastAPI), you would get the
-# file and prompt from an HTTP request instead of defining them here.
-# ==============================================================================
-if __name__ == "__main__":
-    TEST_FILE_PATH = f"fake_rent_agreement_filled_expanded.pdf"
-    
-    TEST_PROMPT = "Summarize this sample contract and highlight any clauses related to termination."
-
-    print("--- Running Test Simulation ---")
-
-    # Simulate upload
-    try:
-        # Get the file's name and content
-        original_filename = os.path.basename(TEST_FILE_PATH)
-        with open(TEST_FILE_PATH, "rb") as f:
-            file_bytes = f.read()
-
-        print(f"Simulating upload of file: '{original_filename}'")
-        
-        # CALL THE MAIN FUNCTION
-        result = process_legal_document(
-            file_name=original_filename, 
-            file_content=file_bytes, 
-            prompt=TEST_PROMPT
-        )
-        
-        # PRINT THE RESULT
-        print("\n--- Simulation Result ---")
-        if result.get("status") == "success":
-            print(f"✅ Success!")
-            print(f"   Document stored at: {result.get('gcs_uri')}")
-            print(f"   Request stored with ID: {result.get('firestore_id')}")
-        else:
-            print(f"❌ Error: {result.get('message')}")
-
-    except FileNotFoundError:
-        print(f"❌ TEST ERROR: The file was not found at '{TEST_FILE_PATH}'.")
-        print("Please update the TEST_FILE_PATH variable in the script.")
-    except Exception as e:
+import io
+import os
+import uuid
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from gcp_handler import upload_stream_to_storage, save_prompt_to_firestore
+from text_processing import extract_text_from_pdf
+
+
+def process_legal_document(file_name: str, file_content, prompt: str, extract_text: bool = False,
+                           use_analysis_cache: bool = True) -> dict:
+    """
+    Processes an uploaded document and prompt, simulating a backend endpoint.
+
+    This function streams the uploaded content straight from memory to Google
+    Cloud Storage (no temporary file) and saves the prompt to Firestore. When
+    extract_text is set, the PDF's text is extracted from the same in-memory
+    buffer while the upload is still running, so indexing can start without
+    downloading the file back from GCS.
+
+    Args:
+        file_name (str): The original name of the uploaded file (e.g., "contract.pdf").
+        file_content (bytes | BinaryIO): The raw content of the file, or a readable binary file-like object.
+        prompt (str): The user's text prompt.
+        extract_text (bool): Whether to extract the document's text during the upload.
+        use_analysis_cache (bool): Whether the initial analysis may reuse a cached analysis
+                                   of an identical document (see analysis_cache.py).
+
+    Returns:
+        dict: A dictionary containing the status and results of the operation. On success
+              with extract_text set, 'full_text' holds the extracted text (None if extraction failed).
+    """
+
+    try:
+        extension = os.path.splitext(file_name)[1]
+        extract_text = extract_text and extension.lower() == ".pdf"
+
+        # Text extraction needs its own reader over the content. A plain file-like object
+        # can only be consumed once, so read it into memory; bytes are shared, not copied.
+        if extract_text and not isinstance(file_content, (bytes, bytearray, memoryview)):
+            file_content = file_content.read()
+
+        if isinstance(file_content, (bytes, bytearray, memoryview)):
+            upload_stream = io.BytesIO(file_content)
+            upload_size = len(file_content)
+        else:
+            upload_stream = file_content
+            upload_size = None
+
+        # Keep object names unique, as the temp-file names used to guarantee
+        object_name = f"{uuid.uuid4().hex}{extension}"
+        content_type = mimetypes.guess_type(file_name)[0]
+
+        # 1. Stream the document to GCS, extracting its text in parallel
+        print("\nProcessing your request...")
+        full_text = None
+        with ThreadPoolExecutor(max_workers=1) as upload_executor:
+            upload_future = upload_executor.submit(
+                upload_stream_to_storage, upload_stream, object_name, upload_size, content_type
+            )
+            if extract_text:
+                try:
+                    full_text = extract_text_from_pdf(io.BytesIO(file_content))
+                    print(f"Extracted {len(full_text)} characters of text during upload.")
+                except Exception as e:
+                    print(f"❌ Error extracting text during upload: {e}")
+            document_gcs_uri = upload_future.result()
+        
+        # 2. If upload was successful, save the prompt to Firestore
+        if document_gcs_uri:
+            firestore_doc_id = save_prompt_to_firestore(prompt, document_gcs_uri, use_analysis_cache)
+            if firestore_doc_id:
+                print("\n--- 🚀 All Done! ---")
+                print("Your request has been submitted successfully.")
+                # Return a success response
+                result = {
+                    "status": "success",
+                    "gcs_uri": document_gcs_uri,
+                    "firestore_id": firestore_doc_id
+                }
+                if extract_text:
+                    result["full_text"] = full_text
+                return result
+            else:
+                return {"status": "error", "message": "Failed to save prompt to Firestore."}
+        else:
+            return {"status": "error", "message": "Failed to upload document to Cloud Storage."}
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+# ==============================================================================
+# --- EXAMPLE USAGE ---
+# This block simulates a call from a UI to test the function above.
+# In a real web application (e.g., using Flask or FastAPI), you would get the
+# file and prompt from an HTTP request instead of defining them here.
+# ==============================================================================
+if __name__ == "__main__":
+    TEST_FILE_PATH = f"fake_rent_agreement_filled_expanded.pdf"
+    
+    TEST_PROMPT = "Summarize this sample contract and highlight any clauses related to termination."
+
+    print("--- Running Test Simulation ---")
+
+    # Simulate upload
+    try:
+        # Get the file's name and content
+        original_filename = os.path.basename(TEST_FILE_PATH)
+        with open(TEST_FILE_PATH, "rb") as f:
+            file_bytes = f.read()
+
+        print(f"Simulating upload of file: '{original_filename}'")
+        
+        # CALL THE MAIN FUNCTION
+        result = process_legal_document(
+            file_name=original_filename, 
+            file_content=file_bytes, 
+            prompt=TEST_PROMPT,
+            extract_text=True
+        )
+        
+        # PRINT THE RESULT
+        print("\n--- Simulation Result ---")
+        if result.get("status") == "success":
+            print(f"✅ Success!")
+            print(f"   Document stored at: {result.get('gcs_uri')}")
+            print(f"   Request stored with ID: {result.get('firestore_id')}")
+            if result.get("full_text"):
+                print(f"   Extracted {len(result['full_text'])} characters for indexing.")
+        else:
+            print(f"❌ Error: {result.get('message')}")
+
+    except FileNotFoundError:
+        print(f"❌ TEST ERROR: The file was not found at '{TEST_FILE_PATH}'.")
+        print("Please update the TEST_FILE_PATH variable in the script.")
+    except Exception as e:
         print(f"❌ An unexpected error occurred during the test: {e}")
\ No newline at end of file
@@ -1,318 +1,577 @@
-import os
-from dotenv import load_dotenv
-from tavily import TavilyClient
-import vertexai
-from vertexai.generative_models import GenerativeModel, Tool, Part
-from gcp_handler import get_request_details, get_all_chunks_for_document
-
-# Load environment variables
-load_dotenv()
-
-# Configuration
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-GCP_REGION = "asia-south1"
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-
-try:
-    # Initialize Vertex AI
-    vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-
-    # Initialize Gemini Models
-    flash_model = GenerativeModel("gemini-1.5-flash-002")
-    pro_model = GenerativeModel("gemini-1.5-pro-002")
-
-    # Initialize Tavily Client
-    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-
-    print("✅ LLM-orch Initialization Successful!")
-except Exception as initialization_error:
-    print(f"❌ An error occurred! (LLM-orch) : {initialization_error}")
-
-
-def run_research_agent(document_context: str) -> str:
-    """
-    Agent 1: Uses Tavily web search to find relevant legal laws, judgments, and commentaries.
-    Extracts key legal concepts from document context and performs targeted web searches.
-    """
-    print("--- Running Agent 1: Research Agent with Tavily Web Search ---")
-    
-    # Extract key legal concepts and entities for targeted search
-    extraction_prompt = f"""
-    Based on the following legal document context, identify and extract:
-    1. Key legal concepts, laws, or statutes mentioned
-    2. Jurisdictions (courts, states, countries)
-    3. Named entities (parties, judges, case names)
-    4. Legal areas/domains (contract law, criminal law, etc.)
-    
-    Return 3-5 focused search queries that would help find relevant legal precedents, 
-    laws, judgments, or commentaries. Format as a simple list.
-    
-    Document Context:
-    ---
-    {document_context[:2000]}
-    ---
-    """
-    
-    try:
-        # Get search queries from Gemini
-        response = flash_model.generate_content(extraction_prompt)
-        search_queries = response.text.strip().split('\n')
-        search_queries = [q.strip('- ').strip() for q in search_queries if q.strip()][:5]
-        
-        print(f"Generated search queries: {search_queries}")
-        
-        # Perform Tavily searches
-        all_research_results = []
-        
-        for query in search_queries:
-            if not query:
-                continue
-                
-            try:
-                search_response = tavily_client.search(
-                    query=f"legal {query} law judgment precedent",
-                    max_results=5,
-                    search_depth="basic",
-                    topic="general",
-                    include_answer=True,
-                    include_raw_content=False
-                )
-                
-                # Format each search result
-                for result in search_response.get("results", []):
-                    formatted_result = f"""
-                    **Source**: {result.get('title', 'N/A')}
-                    **URL**: {result.get('url', 'N/A')}
-                    **Content**: {result.get('content', 'N/A')[:500]}...
-                    **Query Context**: {query}
-                    ---
-                    """
-                    all_research_results.append(formatted_result)
-                    
-            except Exception as search_error:
-                print(f"Error searching for '{query}': {search_error}")
-                continue
-        
-        # Combine all research findings
-        research_summary = "\n".join(all_research_results[:10])  # Limit to top 10 results
-        
-        print("Agent 1 finished research using Tavily.")
-        return research_summary if research_summary.strip() else "No relevant external research found."
-        
-    except Exception as e:
-        print(f"Error in Agent 1: {e}")
-        return "Research failed due to technical issues."
-
-def run_analysis_agent(original_context: str, research_findings: str) -> str:
-    """
-    Agent 2: Combines original document context with Tavily research to create comprehensive analysis.
-    Prioritizes document context but uses research findings as supplementary reference.
-    """
-    print("--- Running Agent 2: Analysis Agent ---")
-    
-    # Step 2a: Generate initial analysis
-    print("- Step 2a: Generating initial analysis...")
-    analysis_prompt = f"""
-    You are a comprehensive legal analyst. Create an authoritative legal analysis that:
-
-    1. **Identifies Applicable Legal Framework**: Based on the external research, specify exactly which laws, acts, and regulations apply (e.g., specific state rent control acts, Indian Contract Act provisions, etc.)
-
-    2. **Explains Legal Requirements**: Use the research findings to explain mandatory clauses, notice periods, deposit limits, and other legal requirements
-
-    3. **Provides Legal Context**: Reference specific legal precedents, judgments, or statutory provisions found in the research
-
-    4. **Addresses Compliance Issues**: Identify any gaps between the document and legal requirements
-
-    **PRIMARY SOURCE** (Document Context):
-    {original_context}
-
-    **LEGAL RESEARCH FINDINGS** (Use this to provide authoritative legal guidance):
-    {research_findings[:4000]}
-
-    Instructions:
-    - Be definitive about legal requirements based on research
-    - Quote specific laws, sections, or precedents when available  
-    - Explain exactly what the law requires vs. what the document provides
-    - Identify jurisdiction-specific requirements (state/local laws)
-    """
-    
-    try:
-        initial_analysis = pro_model.generate_content(analysis_prompt).text
-    except Exception as e:
-        print(f"Error in Agent 2a: {e}")
-        return "Initial analysis failed."
-    
-    # Step 2b: Verification
-    print("- Step 2b: Verifying the analysis...")
-    verifier_prompt = f"""
-    Review the following legal analysis for accuracy, completeness, and consistency.
-    Focus on verifying that:
-    1. Information from the original document is accurate
-    2. External research is properly attributed and relevant
-    3. No contradictions exist between sources
-    4. All key legal issues are addressed
-    
-    Original Document Context:
-    ---
-    {original_context[:1500]}
-    ---
-    
-    External Research Findings:
-    ---
-    {research_findings[:1500]}
-    ---
-    
-    Initial Analysis to Verify:
-    ---
-    {initial_analysis}
-    ---
-    
-    Provide bulleted feedback on corrections or improvements needed.
-    """
-    
-    try:
-        verifier_feedback = flash_model.generate_content(verifier_prompt).text
-        print("- Step 2b: Verification feedback received.")
-    except Exception as e:
-        print(f"Error in Agent 2b: {e}")
-        verifier_feedback = "No feedback available."
-    
-    # Step 2c: Refinement
-    print("- Step 2c: Refining analysis based on feedback...")
-    refinement_prompt = f"""
-    Refine the initial analysis by incorporating the verifier feedback.
-    Produce a final, accurate, and comprehensive legal analysis.
-    
-    Initial Analysis:
-    ---
-    {initial_analysis}
-    ---
-    
-    Verifier Feedback:
-    ---
-    {verifier_feedback}
-    ---
-    
-    Provide only the final, refined analysis.
-    """
-    
-    try:
-        final_analysis = pro_model.generate_content(refinement_prompt).text
-        print("Agent 2 finished analysis and verification.")
-        return final_analysis
-    except Exception as e:
-        print(f"Error in Agent 2c: {e}")
-        return initial_analysis  # Fallback to initial analysis
-
-def run_presentation_agent(case_analysis: str, user_prompt: str) -> str:
-    """
-    Agent 3: Formats the detailed analysis into a clear, user-friendly response.
-    """
-    print("--- Running Agent 3: Presentation Agent ---")
-    
-    system_prompt = """
-    You are an AI legal assistant that provides comprehensive, actionable legal guidance. 
-    Your role is to be proactive and informative, not to delegate research to users.
-
-    CRITICAL INSTRUCTIONS:
-    - Use the research findings already gathered to provide direct legal information
-    - DO NOT ask users to "research" or "consult" - YOU provide the answers
-    - Include specific legal frameworks, acts, and requirements that apply
-    - Be authoritative and comprehensive in explaining applicable laws
-    - Provide concrete next steps that users can immediately act upon
-
-    FORMAT REQUIREMENTS:
-    1. **Executive Summary** - Direct, actionable summary of the legal situation
-    2. **Legal Framework Analysis** - Explain applicable laws, acts, and regulations based on research
-    3. **Key Clauses & Rights Analysis** - Detail specific provisions and what they mean legally  
-    4. **Direct Legal Guidance** - Address the user's question with specific legal advice based on research
-    5. **Immediate Action Items** - Concrete steps the user should take (NOT research tasks)
-
-    TONE: Be confident, informative, and definitive. You are the legal expert providing guidance.
-    """
-    
-    prompt = f"""
-    Based on the detailed legal analysis and user question below, generate a 
-    user-friendly summary following the format specified in the system prompt.
-    
-    Detailed Legal Analysis:
-    ---
-    {case_analysis}
-    ---
-    
-    User's Question:
-    ---
-    {user_prompt}
-    ---
-    """
-    
-    try:
-        model_with_system_prompt = GenerativeModel(
-            "gemini-1.5-flash-002", 
-            system_instruction=system_prompt
-        )
-        final_response = model_with_system_prompt.generate_content(prompt).text
-        print("Agent 3 finished generating the final response.")
-        return final_response
-    except Exception as e:
-        print(f"Error in Agent 3: {e}")
-        return "Failed to generate the final presentation."
-
-def orchestrate_legal_analysis(firestore_doc_id: str):
-    """
-    Main orchestration function - runs the full three-agent workflow.
-    """
-    print(f"--- Starting Orchestration for Firestore Doc ID: {firestore_doc_id} ---")
-    
-    # 1. Fetch data from Firestore
-    request_data = get_request_details(firestore_doc_id)
-    if not request_data:
-        return "Error: Could not find the request details in Firestore."
-    
-    user_prompt = request_data.get("prompt", "Please provide a general summary.")
-    full_document_context = get_all_chunks_for_document(firestore_doc_id)
-    
-    if not full_document_context:
-        return "Error: Could not find the document's text chunks in Firestore."
-    
-    # 2. Run the multi-agent workflow
-    research_findings = run_research_agent(full_document_context)
-    case_analysis = run_analysis_agent(full_document_context, research_findings)
-    final_user_response = run_presentation_agent(case_analysis, user_prompt)
-    
-    return final_user_response
-
-# Configuration validation
-def validate_configuration():
-    """Validate that all required configurations are present."""
-    issues = []
-    
-    if not GCP_PROJECT_ID:
-        issues.append("GCP_PROJECT_ID not configured")
-    
-    if not TAVILY_API_KEY:
-        issues.append("TAVILY_API_KEY not configured")
-    
-    if issues:
-        print("Configuration issues found:")
-        for issue in issues:
-            print(f"  ✗ {issue}")
-        return False
-    
-    print("✓ Configuration validated successfully")
-    return True
-
-if __name__ == "__main__":
-    if not validate_configuration():
-        exit(1)
-        
-    # Example usage
-    TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
-    if "replace-with" in TEST_FIRESTORE_ID:
-        print("Please update the TEST_FIRESTORE_ID variable with a real ID from your database.")
-    else:
-        final_output = orchestrate_legal_analysis(TEST_FIRESTORE_ID)
-        print("\n" + "="*50)
-        print("FINAL USER-FACING RESPONSE")
-        print("="*50)
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from tavily import TavilyClient
+import vertexai
+from vertexai.generative_models import Tool, Part
+from gcp_handler import get_request_details, get_all_chunks_for_document, get_document_head, save_analysis_checkpoint
+from task_graph import TaskGraph
+from analysis_cache import get_cached_analysis, save_cached_analysis
+from model_router import choose_model, get_model, routing_policy_version
+from usage_ledger import (
+    UsageLedger, generate_with_usage, ANALYSIS_TOKEN_BUDGET, ANALYSIS_TIME_BUDGET_SECONDS
+)
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
+GCP_REGION = "asia-south1"
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+# Bump when the Agent 1 or Agent 2 prompts change, so cached analyses made with the old ones aren't reused
+ANALYSIS_PROMPT_VERSION = "1"
+
+NO_RESEARCH_FOUND_MESSAGE = "No relevant external research found."
+RESEARCH_FAILED_MESSAGE = "Research failed due to technical issues."
+
+try:
+    # Initialize Vertex AI
+    vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+
+    # Gemini models are chosen per step and input by model_router
+
+    # Initialize Tavily Client
+    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+
+    print("✅ LLM-orch Initialization Successful!")
+except Exception as initialization_error:
+    print(f"❌ An error occurred! (LLM-orch) : {initialization_error}")
+
+
+def _generate(step: str, prompt: str, ledger: UsageLedger | None = None, system_instruction: str | None = None,
+              complexity_text: str | None = None) -> str:
+    """
+    Runs one model call for an analysis step on the model chosen by model_router,
+    recording its usage in the ledger. With a time budget, the ledger's remaining
+    time is the router's latency budget, so a step that would overrun it is downgraded.
+    complexity_text is the text the router scores for complexity (the document, so the
+    prompt's own instructions don't count); the whole prompt is scored if omitted.
+    """
+    model_name, reason = choose_model(step, prompt, ledger.step_time_budget() if ledger else None, complexity_text)
+    if ledger and reason.startswith("latency budget"):
+        ledger.note(step, f"downgraded to {model_name} ({reason})")
+    return generate_with_usage(get_model(model_name, system_instruction), prompt, step, ledger).text
+
+def extract_search_queries(document_context: str, ledger: UsageLedger | None = None) -> list[str]:
+    """
+    Agent 1, part 1: Asks Gemini for 3-5 focused legal search queries based on the
+    start of the document. Only the first 2000 characters are used. Raises on failure.
+    """
+    # Extract key legal concepts and entities for targeted search
+    extraction_prompt = f"""
+    Based on the following legal document context, identify and extract:
+    1. Key legal concepts, laws, or statutes mentioned
+    2. Jurisdictions (courts, states, countries)
+    3. Named entities (parties, judges, case names)
+    4. Legal areas/domains (contract law, criminal law, etc.)
+    
+    Return 3-5 focused search queries that would help find relevant legal precedents, 
+    laws, judgments, or commentaries. Format as a simple list.
+    
+    Document Context:
+    ---
+    {document_context[:2000]}
+    ---
+    """
+    
+    # Get search queries from Gemini
+    response_text = _generate("search_queries", extraction_prompt, ledger)
+    search_queries = response_text.strip().split('\n')
+    search_queries = [q.strip('- ').strip() for q in search_queries if q.strip()][:5]
+    
+    print(f"Generated search queries: {search_queries}")
+    return search_queries
+
+def _search_tavily(query: str) -> list[str] | None:
+    """Runs one Tavily search and returns its formatted results, or None if the search failed."""
+    try:
+        search_response = tavily_client.search(
+            query=f"legal {query} law judgment precedent",
+            max_results=5,
+            search_depth="basic",
+            topic="general",
+            include_answer=True,
+            include_raw_content=False
+        )
+    except Exception as search_error:
+        print(f"Error searching for '{query}': {search_error}")
+        return None
+
+    # Format each search result
+    formatted_results = []
+    for result in search_response.get("results", []):
+        formatted_result = f"""
+                    **Source**: {result.get('title', 'N/A')}
+                    **URL**: {result.get('url', 'N/A')}
+                    **Content**: {result.get('content', 'N/A')[:500]}...
+                    **Query Context**: {query}
+                    ---
+                    """
+        formatted_results.append(formatted_result)
+    return formatted_results
+
+def run_web_research(search_queries: list[str], ledger: UsageLedger | None = None) -> str:
+    """
+    Agent 1, part 2: Runs the Tavily searches concurrently and combines the findings.
+    Results keep the order of the queries, as when they were searched one by one.
+    The searches' wall time is recorded in the ledger as a 'tavily' call.
+
+    Raises:
+        RuntimeError: If every search failed, so the outage isn't mistaken for
+                      (and checkpointed or cached as) a search with no results.
+    """
+    search_queries = [query for query in search_queries if query]
+    if not search_queries:
+        return NO_RESEARCH_FOUND_MESSAGE
+
+    search_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(search_queries)) as search_executor:
+        results_per_query = list(search_executor.map(_search_tavily, search_queries))
+    if ledger:
+        ledger.record("web_research", "tavily", time.perf_counter() - search_started)
+    failed_searches = sum(results is None for results in results_per_query)
+    if failed_searches == len(search_queries):
+        raise RuntimeError(f"All {failed_searches} Tavily searches failed.")
+    if failed_searches:
+        print(f"⚠️ {failed_searches} of {len(search_queries)} Tavily searches failed; using the rest.")
+    all_research_results = [result for results in results_per_query if results for result in results]
+
+    # Combine all research findings
+    research_summary = "\n".join(all_research_results[:10])  # Limit to top 10 results
+    
+    print("Agent 1 finished research using Tavily.")
+    return research_summary if research_summary.strip() else NO_RESEARCH_FOUND_MESSAGE
+
+def run_research_agent(document_context: str, ledger: UsageLedger | None = None) -> str:
+    """
+    Agent 1: Uses Tavily web search to find relevant legal laws, judgments, and commentaries.
+    Extracts key legal concepts from document context and performs targeted web searches.
+    """
+    print("--- Running Agent 1: Research Agent with Tavily Web Search ---")
+    
+    try:
+        return run_web_research(extract_search_queries(document_context, ledger), ledger)
+    except Exception as e:
+        print(f"Error in Agent 1: {e}")
+        return RESEARCH_FAILED_MESSAGE
+
+def generate_initial_analysis(original_context: str, research_findings: str, ledger: UsageLedger | None = None) -> str:
+    """
+    Step 2a: Drafts the legal analysis from the document and research. Raises on failure.
+    The document is truncated if it doesn't fit the ledger's token budget.
+    """
+    print("- Step 2a: Generating initial analysis...")
+    if ledger:
+        original_context = ledger.truncate_to_budget("initial_analysis", original_context, other_chars=len(research_findings[:4000]) + 2000)
+    analysis_prompt = f"""
+    You are a comprehensive legal analyst. Create an authoritative legal analysis that:
+
+    1. **Identifies Applicable Legal Framework**: Based on the external research, specify exactly which laws, acts, and regulations apply (e.g., specific state rent control acts, Indian Contract Act provisions, etc.)
+
+    2. **Explains Legal Requirements**: Use the research findings to explain mandatory clauses, notice periods, deposit limits, and other legal requirements
+
+    3. **Provides Legal Context**: Reference specific legal precedents, judgments, or statutory provisions found in the research
+
+    4. **Addresses Compliance Issues**: Identify any gaps between the document and legal requirements
+
+    **PRIMARY SOURCE** (Document Context):
+    {original_context}
+
+    **LEGAL RESEARCH FINDINGS** (Use this to provide authoritative legal guidance):
+    {research_findings[:4000]}
+
+    Instructions:
+    - Be definitive about legal requirements based on research
+    - Quote specific laws, sections, or precedents when available  
+    - Explain exactly what the law requires vs. what the document provides
+    - Identify jurisdiction-specific requirements (state/local laws)
+    """
+    
+    return _generate("initial_analysis", analysis_prompt, ledger, complexity_text=original_context)
+
+def verify_analysis(original_context: str, research_findings: str, initial_analysis: str, ledger: UsageLedger | None = None) -> str:
+    """Step 2b: Reviews the draft analysis and returns bulleted feedback. Raises on failure."""
+    print("- Step 2b: Verifying the analysis...")
+    verifier_prompt = f"""
+    Review the following legal analysis for accuracy, completeness, and consistency.
+    Focus on verifying that:
+    1. Information from the original document is accurate
+    2. External research is properly attributed and relevant
+    3. No contradictions exist between sources
+    4. All key legal issues are addressed
+    
+    Original Document Context:
+    ---
+    {original_context[:1500]}
+    ---
+    
+    External Research Findings:
+    ---
+    {research_findings[:1500]}
+    ---
+    
+    Initial Analysis to Verify:
+    ---
+    {initial_analysis}
+    ---
+    
+    Provide bulleted feedback on corrections or improvements needed.
+    """
+    
+    verifier_feedback = _generate("verification", verifier_prompt, ledger)
+    print("- Step 2b: Verification feedback received.")
+    return verifier_feedback
+
+def refine_analysis(initial_analysis: str, verifier_feedback: str, ledger: UsageLedger | None = None,
+                    original_context: str | None = None) -> str:
+    """
+    Step 2c: Refines the draft analysis using the verifier's feedback. Raises on failure.
+    The document (original_context), if given, is what the model router scores for complexity.
+    """
+    print("- Step 2c: Refining analysis based on feedback...")
+    refinement_prompt = f"""
+    Refine the initial analysis by incorporating the verifier feedback.
+    Produce a final, accurate, and comprehensive legal analysis.
+    
+    Initial Analysis:
+    ---
+    {initial_analysis}
+    ---
+    
+    Verifier Feedback:
+    ---
+    {verifier_feedback}
+    ---
+    
+    Provide only the final, refined analysis.
+    """
+    
+    return _generate("refinement", refinement_prompt, ledger, complexity_text=original_context)
+
+def run_analysis_agent(original_context: str, research_findings: str, ledger: UsageLedger | None = None) -> str:
+    """
+    Agent 2: Combines original document context with Tavily research to create comprehensive analysis.
+    Prioritizes document context but uses research findings as supplementary reference.
+    """
+    print("--- Running Agent 2: Analysis Agent ---")
+    
+    try:
+        initial_analysis = generate_initial_analysis(original_context, research_findings, ledger)
+    except Exception as e:
+        print(f"Error in Agent 2a: {e}")
+        return "Initial analysis failed."
+    
+    try:
+        verifier_feedback = verify_analysis(original_context, research_findings, initial_analysis, ledger)
+    except Exception as e:
+        print(f"Error in Agent 2b: {e}")
+        verifier_feedback = "No feedback available."
+    
+    try:
+        final_analysis = refine_analysis(initial_analysis, verifier_feedback, ledger, original_context)
+        print("Agent 2 finished analysis and verification.")
+        return final_analysis
+    except Exception as e:
+        print(f"Error in Agent 2c: {e}")
+        return initial_analysis  # Fallback to initial analysis
+
+PRESENTATION_SYSTEM_PROMPT = """
+    You are an AI legal assistant that provides comprehensive, actionable legal guidance. 
+    Your role is to be proactive and informative, not to delegate research to users.
+
+    CRITICAL INSTRUCTIONS:
+    - Use the research findings already gathered to provide direct legal information
+    - DO NOT ask users to "research" or "consult" - YOU provide the answers
+    - Include specific legal frameworks, acts, and requirements that apply
+    - Be authoritative and comprehensive in explaining applicable laws
+    - Provide concrete next steps that users can immediately act upon
+
+    FORMAT REQUIREMENTS:
+    1. **Executive Summary** - Direct, actionable summary of the legal situation
+    2. **Legal Framework Analysis** - Explain applicable laws, acts, and regulations based on research
+    3. **Key Clauses & Rights Analysis** - Detail specific provisions and what they mean legally  
+    4. **Direct Legal Guidance** - Address the user's question with specific legal advice based on research
+    5. **Immediate Action Items** - Concrete steps the user should take (NOT research tasks)
+
+    TONE: Be confident, informative, and definitive. You are the legal expert providing guidance.
+    """
+
+def generate_presentation(case_analysis: str, user_prompt: str, ledger: UsageLedger | None = None) -> str:
+    """Agent 3's model call: formats the analysis for the user. Raises on failure."""
+    if ledger:
+        case_analysis = ledger.truncate_to_budget("presentation", case_analysis, other_chars=len(user_prompt) + len(PRESENTATION_SYSTEM_PROMPT))
+    prompt = f"""
+    Based on the detailed legal analysis and user question below, generate a 
+    user-friendly summary following the format specified in the system prompt.
+    
+    Detailed Legal Analysis:
+    ---
+    {case_analysis}
+    ---
+    
+    User's Question:
+    ---
+    {user_prompt}
+    ---
+    """
+    
+    return _generate("presentation", prompt, ledger, system_instruction=PRESENTATION_SYSTEM_PROMPT)
+
+def run_presentation_agent(case_analysis: str, user_prompt: str, ledger: UsageLedger | None = None) -> str:
+    """
+    Agent 3: Formats the detailed analysis into a clear, user-friendly response.
+    """
+    print("--- Running Agent 3: Presentation Agent ---")
+    
+    try:
+        final_response = generate_presentation(case_analysis, user_prompt, ledger)
+        print("Agent 3 finished generating the final response.")
+        return final_response
+    except Exception as e:
+        print(f"Error in Agent 3: {e}")
+        return "Failed to generate the final presentation."
+
+class AnalysisStepFailed(Exception):
+    """Raised when a required step of the initial analysis fails. Completed steps stay checkpointed."""
+
+    def __init__(self, step: str, error: Exception):
+        super().__init__(f"Analysis step '{step}' failed: {error}")
+        self.step = step
+
+
+def analysis_cache_version() -> str:
+    """The version under which research and detailed analyses are cached (prompts and model routing policy)."""
+    return f"prompts-{ANALYSIS_PROMPT_VERSION}:routing-{routing_policy_version()}"
+
+def run_checkpointed_analysis(firestore_doc_id: str, user_prompt: str, checkpoints: dict | None = None,
+                              document_fingerprint: str | None = None, use_cache: bool = True,
+                              ledger: UsageLedger | None = None, time_budget_requested: bool = False) -> dict:
+    """
+    Runs the three-agent workflow as a dependency graph (see task_graph.TaskGraph),
+    saving each step's output as a checkpoint on the request document.
+
+    Every step starts as soon as its inputs are ready: Agent 1's query extraction
+    only waits for the head of the document, and the full document is fetched
+    while the web research runs. Steps already present in `checkpoints` (the
+    request's 'analysis_checkpoints' field) are reused instead of rerun, and
+    anything only they depended on is skipped, so a retried or restarted analysis
+    resumes from the last completed step.
+
+    If the document's text fingerprint is given and use_cache is set, an analysis of an
+    identical document from the analysis cache replaces Agents 1 and 2, so only
+    Agent 3 runs. A full analysis that completed without degraded steps is cached.
+    Steps downgraded to a faster model to meet the time budget only keep it out of
+    the cache if the request asked for its own budget (time_budget_requested).
+
+    Every model call is recorded in the usage ledger (by default a new one with the
+    ANALYSIS_TOKEN_BUDGET and ANALYSIS_TIME_BUDGET_SECONDS budgets). Over budget,
+    inputs are truncated, Pro steps are downgraded, and verification and
+    refinement (steps 2b and 2c) are skipped.
+
+    Failed steps are never checkpointed. Research and verification failures are
+    tolerated as before; a missing document or a failure in steps 2a or 3 raises
+    AnalysisStepFailed.
+
+    Returns:
+        dict: research_findings, agent2_detailed_analysis, agent3_initial_summary,
+              analysis_cache_hit, the graph's critical-path timing_report and the
+              ledger's usage report.
+    """
+    if ledger is None:
+        ledger = UsageLedger(f"analysis-{firestore_doc_id}", ANALYSIS_TOKEN_BUDGET, ANALYSIS_TIME_BUDGET_SECONDS)
+    checkpoints = dict(checkpoints or {})
+    if checkpoints:
+        print(f"Resuming initial analysis from checkpoints: {', '.join(checkpoints)}")
+
+    # Steps that fell back to a degraded output; such an analysis isn't cached
+    degraded_steps = set()
+    cached_analysis = None
+    if use_cache and "agent2_detailed_analysis" not in checkpoints:
+        cached_analysis = get_cached_analysis(document_fingerprint, analysis_cache_version())
+        if cached_analysis:
+            # Cached outputs enter the graph like checkpoints, so nothing upstream of them runs
+            checkpoints.update(cached_analysis)
+
+    def checkpoint(step: str, output: str) -> str:
+        save_analysis_checkpoint(firestore_doc_id, step, output)
+        return output
+
+    def fetch_document(fetch, step):
+        text = fetch(firestore_doc_id)
+        if not text:
+            raise AnalysisStepFailed(step, ValueError("Could not find the document's text chunks."))
+        return text
+
+    def search_queries_step(document_head):
+        print("--- Running Agent 1: Research Agent with Tavily Web Search ---")
+        try:
+            return extract_search_queries(document_head, ledger)
+        except Exception as e:
+            print(f"Error in Agent 1: {e}")
+            return None
+
+    def research_step(search_queries):
+        if search_queries is None:
+            degraded_steps.add("research_findings")
+            return RESEARCH_FAILED_MESSAGE
+        try:
+            return checkpoint("research_findings", run_web_research(search_queries, ledger))
+        except Exception as e:
+            print(f"Error in Agent 1: {e}")
+            degraded_steps.add("research_findings")
+            return RESEARCH_FAILED_MESSAGE
+
+    def initial_analysis_step(document, research_findings):
+        print("--- Running Agent 2: Analysis Agent ---")
+        try:
+            return checkpoint("agent2_initial_analysis", generate_initial_analysis(document, research_findings, ledger))
+        except Exception as e:
+            print(f"Error in Agent 2a: {e}")
+            raise AnalysisStepFailed("agent2_initial_analysis", e)
+
+    def verification_step(document, research_findings, initial_analysis):
+        if ledger.exhausted():
+            ledger.note("verification", "skipped, budget exhausted")
+            degraded_steps.add("agent2_verifier_feedback")
+            return "No feedback available."
+        try:
+            return checkpoint("agent2_verifier_feedback", verify_analysis(document, research_findings, initial_analysis, ledger))
+        except Exception as e:
+            print(f"Error in Agent 2b: {e}")
+            degraded_steps.add("agent2_verifier_feedback")
+            return "No feedback available."
+
+    def refinement_step(document, initial_analysis, verifier_feedback):
+        if ledger.exhausted():
+            ledger.note("refinement", "skipped, budget exhausted; using the initial analysis")
+            degraded_steps.add("agent2_detailed_analysis")
+            return initial_analysis
+        try:
+            final_analysis = checkpoint("agent2_detailed_analysis", refine_analysis(initial_analysis, verifier_feedback, ledger, document))
+            print("Agent 2 finished analysis and verification.")
+            return final_analysis
+        except Exception as e:
+            print(f"Error in Agent 2c: {e}")
+            degraded_steps.add("agent2_detailed_analysis")
+            return initial_analysis  # Fallback to initial analysis
+
+    def presentation_step(final_analysis):
+        print("--- Running Agent 3: Presentation Agent ---")
+        try:
+            final_user_response = generate_presentation(final_analysis, user_prompt, ledger)
+            print("Agent 3 finished generating the final response.")
+            return final_user_response
+        except Exception as e:
+            print(f"Error in Agent 3: {e}")
+            raise AnalysisStepFailed("agent3_initial_summary", e)
+
+    graph = TaskGraph(f"analysis-{firestore_doc_id}")
+    graph.add_step("document_head", lambda: fetch_document(get_document_head, "document_head"))
+    graph.add_step("document", lambda: fetch_document(get_all_chunks_for_document, "document"))
+    graph.add_step("search_queries", search_queries_step, deps=["document_head"])
+
+    steps = {
+        "research_findings": (research_step, ["search_queries"]),
+        "agent2_initial_analysis": (initial_analysis_step, ["document", "research_findings"]),
+        "agent2_verifier_feedback": (verification_step, ["document", "research_findings", "agent2_initial_analysis"]),
+        "agent2_detailed_analysis": (refinement_step, ["document", "agent2_initial_analysis", "agent2_verifier_feedback"]),
+    }
+    for step, (fn, deps) in steps.items():
+        if step in checkpoints:
+            # A checkpointed step has no dependencies, so nothing upstream of it reruns
+            graph.add_step(step, lambda output=checkpoints[step]: output)
+        else:
+            graph.add_step(step, fn, deps=deps)
+    graph.add_step("agent3_initial_summary", presentation_step, deps=["agent2_detailed_analysis"])
+
+    # Research is needed alongside the final summary, so it's a target too (a no-op once checkpointed)
+    results = graph.run(targets=["research_findings", "agent3_initial_summary"])
+    print(graph.format_timing_report())
+    print(ledger.format_report())
+
+    # Analyses cut short by the budget (truncated or skipped steps, or steps downgraded to meet
+    # a time budget the request asked for) aren't cached
+    budget_adjusted = any(
+        adjustment["step"] != "presentation"
+        and (time_budget_requested or not adjustment["action"].startswith("downgraded"))
+        for adjustment in ledger.summary()["adjustments"]
+    )
+    if use_cache and not cached_analysis and not degraded_steps and not budget_adjusted:
+        save_cached_analysis(
+            document_fingerprint, analysis_cache_version(),
+            results["research_findings"], results["agent2_detailed_analysis"], firestore_doc_id
+        )
+
+    return {
+        "research_findings": results["research_findings"],
+        "agent2_detailed_analysis": results["agent2_detailed_analysis"],
+        "agent3_initial_summary": results["agent3_initial_summary"],
+        "analysis_cache_hit": bool(cached_analysis),
+        "timing_report": graph.timing_report(),
+        "usage": ledger.to_dict()
+    }
+
+def orchestrate_legal_analysis(firestore_doc_id: str):
+    """
+    Main orchestration function - runs the full three-agent workflow.
+    """
+    print(f"--- Starting Orchestration for Firestore Doc ID: {firestore_doc_id} ---")
+    
+    # 1. Fetch data from Firestore
+    request_data = get_request_details(firestore_doc_id)
+    if not request_data:
+        return "Error: Could not find the request details in Firestore."
+    
+    user_prompt = request_data.get("prompt", "Please provide a general summary.")
+    
+    # 2. Run the multi-agent workflow, resuming from any saved checkpoints
+    try:
+        results = run_checkpointed_analysis(
+            firestore_doc_id, user_prompt, request_data.get("analysis_checkpoints"),
+            document_fingerprint=request_data.get("document_fingerprint"),
+            use_cache=request_data.get("use_analysis_cache", True)
+        )
+    except AnalysisStepFailed as e:
+        if e.step in ("document", "document_head"):
+            return "Error: Could not find the document's text chunks in Firestore."
+        return f"Error: {e}"
+    
+    return results["agent3_initial_summary"]
+
+# Configuration validation
+def validate_configuration():
+    """Validate that all required configurations are present."""
+    issues = []
+    
+    if not GCP_PROJECT_ID:
+        issues.append("GCP_PROJECT_ID not configured")
+    
+    if not TAVILY_API_KEY:
+        issues.append("TAVILY_API_KEY not configured")
+    
+    if issues:
+        print("Configuration issues found:")
+        for issue in issues:
+            print(f"  ✗ {issue}")
+        return False
+    
+    print("✓ Configuration validated successfully")
+    return True
+
+if __name__ == "__main__":
+    if not validate_configuration():
+        exit(1)
+        
+    # Example usage
+    TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
+    if "replace-with" in TEST_FIRESTORE_ID:
+        print("Please update the TEST_FIRESTORE_ID variable with a real ID from your database.")
+    else:
+        final_output = orchestrate_legal_analysis(TEST_FIRESTORE_ID)
+        print("\n" + "="*50)
+        print("FINAL USER-FACING RESPONSE")
+        print("="*50)
         print(final_output)
\ No newline at end of file
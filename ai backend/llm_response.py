@@ -1,65 +1,133 @@
-import os
-from dotenv import load_dotenv
-import vertexai
-from vertexai.generative_models import GenerativeModel, Tool, Part
-
-# Load environment variables
-load_dotenv()
-
-# Configuration & Initialization
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-GCP_REGION = "asia-south1"
-vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-model = GenerativeModel("gemini-1.5-flash-002")
-
-# Master Prompt for Conversational Responses
-CONVERSATIONAL_PROMPT = """
-You are an advanced AI legal assistant. Your goal is to provide helpful, accurate, and context-aware answers to the user's questions.
-
-You have been provided with several sources of information:
-1.  **Initial Analysis**: A comprehensive summary and a detailed breakdown of the user's legal document. Use this for broad, foundational knowledge about the case.
-2.  **Conversation History**: The ongoing dialogue with the user. Use this to understand the immediate context and what has already been discussed.
-3.  **Document Context for Current Query**: Specific text snippets from the original document that are highly relevant to the user's latest question. This is your most important source for grounding your answer.
-
-Follow these rules to construct your response:
-- **Prioritize Document Context**: Base your answer on the "Document Context for Current Query" first and foremost.
-- **Use Other Context**: Refer to the "Initial Analysis" and "Conversation History" to provide more complete answers and avoid repeating information.
-- **Cite Your Sources**: You MUST cite your sources. For information from the document, quote the text.
-- **Be Conversational**: Address the user directly and maintain a helpful tone.
-"""
-
-def generate_conversational_response(
-    query: str,
-    doc_context_for_query: str,
-    chat_history: list,
-    agent_2_analysis: str = None,
-    agent_3_summary: str = None
-) -> str:
-    """
-    Generates a conversational response using the full context of the interaction.
-    """
-        
-    # Format the chat history and initial analysis for the prompt
-    formatted_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
-    initial_context = ""
-    if agent_2_analysis and agent_3_summary:
-        initial_context = f"Initial Summary:\n{agent_3_summary}\n\nInitial Detailed Analysis:\n{agent_2_analysis}"
-
-    prompt_parts = [
-        CONVERSATIONAL_PROMPT,
-        "\n--- Initial Analysis ---\n",
-        Part.from_text(initial_context if initial_context else "Not available for this turn."),
-        "\n--- Conversation History ---\n",
-        Part.from_text(formatted_history if formatted_history else "This is the first question."),
-        "\n--- Document Context for Current Query ---\n",
-        Part.from_text(doc_context_for_query if doc_context_for_query else "No specific context was retrieved for this query."),
-        "\n--- User's Current Question ---\n",
-        Part.from_text(query)
-    ]
-    
-    try:
-        response = model.generate_content(prompt_parts)
-        return response.text
-    except Exception as e:
-        print(f"❌ Error during Gemini call in llm_response.py: {e}")
-        return "Sorry, I encountered an error while generating a response."
\ No newline at end of file
+import os
+from dotenv import load_dotenv
+import vertexai
+from vertexai.generative_models import GenerativeModel, Tool, Part
+from usage_ledger import UsageLedger, generate_with_usage, stream_with_usage, CHARS_PER_TOKEN, OUTPUT_TOKEN_RESERVE
+
+# Load environment variables
+load_dotenv()
+
+# Configuration & Initialization
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
+GCP_REGION = "asia-south1"
+vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+model = GenerativeModel("gemini-1.5-flash-002")
+
+# Master Prompt for Conversational Responses
+CONVERSATIONAL_PROMPT = """
+You are an advanced AI legal assistant. Your goal is to provide helpful, accurate, and context-aware answers to the user's questions.
+
+You have been provided with several sources of information:
+1.  **Initial Analysis**: A comprehensive summary and a detailed breakdown of the user's legal document. Use this for broad, foundational knowledge about the case.
+2.  **Conversation History**: The ongoing dialogue with the user. Use this to understand the immediate context and what has already been discussed.
+3.  **Document Context for Current Query**: Specific text snippets from the original document that are highly relevant to the user's latest question. This is your most important source for grounding your answer.
+
+Follow these rules to construct your response:
+- **Prioritize Document Context**: Base your answer on the "Document Context for Current Query" first and foremost.
+- **Use Other Context**: Refer to the "Initial Analysis" and "Conversation History" to provide more complete answers and avoid repeating information.
+- **Cite Your Sources**: You MUST cite your sources. For information from the document, quote the text.
+- **Be Conversational**: Address the user directly and maintain a helpful tone.
+"""
+
+def _fit_to_budget(query: str, doc_context_for_query: str, chat_history: list, agent_2_analysis: str,
+                   agent_3_summary: str, ledger: UsageLedger | None) -> tuple[list, str]:
+    """
+    Shrinks the optional context so the prompt fits the ledger's remaining tokens:
+    the oldest conversation turns are dropped first, then the detailed analysis is
+    truncated. The query and the retrieved document context are always kept.
+    """
+    remaining = ledger.remaining_tokens() if ledger else None
+    if remaining is None:
+        return chat_history, agent_2_analysis
+
+    allowed_chars = max((remaining - OUTPUT_TOKEN_RESERVE) * CHARS_PER_TOKEN, 0)
+    fixed_chars = len(CONVERSATIONAL_PROMPT) + len(query) + len(doc_context_for_query or "") + len(agent_3_summary or "")
+    history_chars = [len(msg['role']) + len(msg['content']) + 3 for msg in chat_history]
+    analysis_chars = len(agent_2_analysis or "")
+
+    dropped = 0
+    while dropped < len(chat_history) and fixed_chars + sum(history_chars[dropped:]) + analysis_chars > allowed_chars:
+        dropped += 1
+    if dropped:
+        ledger.note("conversation", f"dropped the {dropped} oldest of {len(chat_history)} history messages")
+        chat_history = chat_history[dropped:]
+
+    if agent_2_analysis and fixed_chars + analysis_chars > allowed_chars:
+        keep_chars = max(allowed_chars - fixed_chars, 0)
+        ledger.note("conversation", f"analysis truncated from {analysis_chars} to {keep_chars} chars")
+        agent_2_analysis = agent_2_analysis[:keep_chars]
+    return chat_history, agent_2_analysis
+
+def _build_prompt_parts(
+    query: str,
+    doc_context_for_query: str,
+    chat_history: list,
+    agent_2_analysis: str = None,
+    agent_3_summary: str = None,
+    ledger: UsageLedger | None = None
+) -> list:
+    """Builds the Gemini prompt for a conversational turn, within the ledger's token budget."""
+    chat_history, agent_2_analysis = _fit_to_budget(
+        query, doc_context_for_query, chat_history, agent_2_analysis, agent_3_summary, ledger
+    )
+    # Format the chat history and initial analysis for the prompt
+    formatted_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
+    initial_context = ""
+    if agent_2_analysis and agent_3_summary:
+        initial_context = f"Initial Summary:\n{agent_3_summary}\n\nInitial Detailed Analysis:\n{agent_2_analysis}"
+
+    return [
+        CONVERSATIONAL_PROMPT,
+        "\n--- Initial Analysis ---\n",
+        Part.from_text(initial_context if initial_context else "Not available for this turn."),
+        "\n--- Conversation History ---\n",
+        Part.from_text(formatted_history if formatted_history else "This is the first question."),
+        "\n--- Document Context for Current Query ---\n",
+        Part.from_text(doc_context_for_query if doc_context_for_query else "No specific context was retrieved for this query."),
+        "\n--- User's Current Question ---\n",
+        Part.from_text(query)
+    ]
+
+def generate_conversational_response(
+    query: str,
+    doc_context_for_query: str,
+    chat_history: list,
+    agent_2_analysis: str = None,
+    agent_3_summary: str = None,
+    ledger: UsageLedger | None = None
+) -> str:
+    """
+    Generates a conversational response using the full context of the interaction.
+    The call's token usage is recorded in the ledger, if one is given.
+    """
+    prompt_parts = _build_prompt_parts(query, doc_context_for_query, chat_history, agent_2_analysis, agent_3_summary, ledger)
+    
+    try:
+        response = generate_with_usage(model, prompt_parts, "conversation", ledger)
+        return response.text
+    except Exception as e:
+        print(f"❌ Error during Gemini call in llm_response.py: {e}")
+        return "Sorry, I encountered an error while generating a response."
+
+def stream_conversational_response(
+    query: str,
+    doc_context_for_query: str,
+    chat_history: list,
+    agent_2_analysis: str = None,
+    agent_3_summary: str = None,
+    ledger: UsageLedger | None = None
+):
+    """
+    Same as generate_conversational_response, but yields the response text in pieces
+    as Gemini generates it. If the call fails part-way, the error is raised, so the
+    caller doesn't mistake a partial response for a complete one.
+    """
+    prompt_parts = _build_prompt_parts(query, doc_context_for_query, chat_history, agent_2_analysis, agent_3_summary, ledger)
+
+    try:
+        for response in stream_with_usage(model, prompt_parts, "conversation", ledger):
+            if response.text:
+                yield response.text
+    except Exception as e:
+        print(f"❌ Error during streaming Gemini call in llm_response.py: {e}")
+        raise
\ No newline at end of file
@@ -0,0 +1,341 @@
+import os
+import io
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import local_fakes
+
+# Load generator for the conversation and ingestion paths, run against local_fakes.
+#
+# Simulated users arrive as a Poisson process at each of several rates (open loop, so
+# a slow system keeps receiving work, like in production). Each arrival is a first
+# interaction (the full initial analysis), a follow-up question, or an upload
+# (upload + ingestion), picked by the configured mix, and runs on a pool of
+# --workers threads standing in for the service's request pool. Latency is measured
+# from arrival, so it includes time spent queued for a worker.
+#
+# Every document is a copy of the same sample contract, so by default the analysis
+# cache is disabled for them and each first interaction runs the full analysis.
+# --duplicate-share enables it for that share of the documents; first interactions
+# are then reported separately as cache hits and misses.
+#
+# Example:
+#   python load_test.py --rates 0.5,1,2,4 --step-seconds 60 --workers 8 --time-scale 0.1
+
+DEFAULT_MIX = "first=0.1,follow_up=0.8,upload=0.1"
+SAMPLE_DOCUMENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_rent_agreement_filled_expanded.pdf")
+SAMPLE_QUESTIONS = [
+    "What happens if the rent is paid late?",
+    "How much is the security deposit and when is it refunded?",
+    "What notice period applies to terminating the agreement?",
+    "Who is responsible for repairs and maintenance?",
+    "Can the tenant sublet the premises?",
+    "Which law governs this agreement?",
+]
+# A step is saturated when requests queue for a free worker (p95 wait above this, in seconds)...
+SATURATION_QUEUE_WAIT_SECONDS = 1.0
+# ...or an endpoint's p95 latency grows past this multiple of its p95 at the lowest rate
+SATURATION_LATENCY_FACTOR = 3.0
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parses 'first=0.1,follow_up=0.8,upload=0.1' into normalized weights."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ("first", "follow_up", "upload"):
+            raise ValueError(f"Unknown operation '{name}' in mix. Use first, follow_up and upload.")
+        weights[name.strip()] = float(weight)
+    total = sum(weights.values())
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+def latency_summary(latencies: list[float], scale: float = 1.0) -> dict:
+    """Count and p50/p95/p99/max of a list of latencies, divided by `scale`."""
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies) / scale
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50": round(float(p50), 3), "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3), "max": round(float(values.max()), 3)}
+
+
+class LoadTestCorpus:
+    """
+    The documents the simulated users work on: fresh ones (ingested, not yet analyzed)
+    for first interactions, and analyzed ones for follow-ups.
+    """
+
+    def __init__(self, pipeline, document_bytes: bytes, document_text: str, duplicate_share: float = 0.0):
+        self.pipeline = pipeline
+        self.document_bytes = document_bytes
+        self.document_text = document_text
+        self.duplicate_share = duplicate_share
+        self.fresh = deque()
+        self.analyzed = []
+        self._lock = threading.Lock()
+
+    def use_analysis_cache(self) -> bool:
+        """Whether a new document counts as a duplicate that may use the analysis cache."""
+        return random.random() < self.duplicate_share
+
+    def ingest_text(self) -> str:
+        """Registers and indexes a copy of the sample document. Returns its request ID."""
+        gcs_uri = f"gs://load-test/{random.getrandbits(64):016x}.pdf"
+        firestore_doc_id = self.pipeline["save_prompt_to_firestore"]("Summarize this contract.", gcs_uri, self.use_analysis_cache())
+        self.pipeline["process_and_index_document"](gcs_uri, firestore_doc_id, full_text=self.document_text)
+        return firestore_doc_id
+
+    def seed(self, num_fresh: int, num_analyzed: int):
+        for _ in range(num_fresh):
+            self.add_fresh(self.ingest_text())
+        for _ in range(num_analyzed):
+            firestore_doc_id = self.ingest_text()
+            self.pipeline["handle_conversation_turn"](firestore_doc_id, "Summarize this contract.")
+            self.analyzed.append(firestore_doc_id)
+
+    def add_fresh(self, firestore_doc_id: str):
+        with self._lock:
+            self.fresh.append(firestore_doc_id)
+
+    def take_fresh(self) -> str | None:
+        with self._lock:
+            return self.fresh.popleft() if self.fresh else None
+
+    def add_analyzed(self, firestore_doc_id: str):
+        with self._lock:
+            self.analyzed.append(firestore_doc_id)
+
+    def pick_analyzed(self) -> str:
+        with self._lock:
+            return random.choice(self.analyzed)
+
+
+def _is_error_response(response) -> bool:
+    return not response or str(response).startswith(("Error", "Sorry"))
+
+def run_first_interaction(corpus: LoadTestCorpus) -> str | bool:
+    """Returns 'first_cache_hit' or 'first_cache_miss' on success, so the two are reported apart."""
+    firestore_doc_id = corpus.take_fresh()
+    if firestore_doc_id is None:
+        raise RuntimeError("No fresh document left; increase --seed-fresh.")
+    response = corpus.pipeline["handle_conversation_turn"](firestore_doc_id, random.choice(SAMPLE_QUESTIONS))
+    if _is_error_response(response):
+        return False
+    corpus.add_analyzed(firestore_doc_id)
+    request_data = local_fakes.peek_document(f"analysis_requests/{firestore_doc_id}") or {}
+    return "first_cache_hit" if request_data.get("analysis_cache_hit") else "first_cache_miss"
+
+def run_follow_up(corpus: LoadTestCorpus) -> bool:
+    response = corpus.pipeline["handle_conversation_turn"](corpus.pick_analyzed(), random.choice(SAMPLE_QUESTIONS))
+    return not _is_error_response(response)
+
+def run_upload(corpus: LoadTestCorpus) -> bool:
+    result = corpus.pipeline["process_legal_document"](
+        "lease.pdf", corpus.document_bytes, "Summarize this contract.", extract_text=True,
+        use_analysis_cache=corpus.use_analysis_cache()
+    )
+    if result.get("status") != "success":
+        return False
+    stats = corpus.pipeline["process_and_index_document"](result["gcs_uri"], result["firestore_id"], full_text=result.get("full_text"))
+    if not stats:
+        return False
+    corpus.add_fresh(result["firestore_id"])
+    return True
+
+OPERATIONS = {"first": run_first_interaction, "follow_up": run_follow_up, "upload": run_upload}
+
+
+def run_step(corpus: LoadTestCorpus, rate: float, step_seconds: float, mix: dict, workers: int, time_scale: float) -> dict:
+    """
+    Offers `rate` operations per second for `step_seconds` (both in unscaled time),
+    waits for every operation to finish, and returns the step's report.
+    """
+    arrivals_per_second = rate / time_scale
+    arrival_window = step_seconds * time_scale
+    names, weights = list(mix), list(mix.values())
+    results = {}
+    results_lock = threading.Lock()
+
+    def timed(name, arrived_at):
+        started_at = time.perf_counter()
+        try:
+            outcome = OPERATIONS[name](corpus)
+        except Exception as e:
+            print(f"❌ {name} failed: {e}")
+            outcome = False
+        finished_at = time.perf_counter()
+        # An operation may name the endpoint variant it ran as (e.g. a cache hit)
+        endpoint = outcome if isinstance(outcome, str) else name
+        with results_lock:
+            result = results.setdefault(endpoint, {"latencies": [], "queue_waits": [], "errors": 0})
+            result["latencies"].append(finished_at - arrived_at)
+            result["queue_waits"].append(started_at - arrived_at)
+            result["errors"] += 0 if outcome else 1
+
+    local_fakes.recorder.reset()
+    futures = []
+    step_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load") as executor:
+        next_arrival = step_started
+        while True:
+            next_arrival += random.expovariate(arrivals_per_second)
+            if next_arrival - step_started > arrival_window:
+                break
+            time.sleep(max(0.0, next_arrival - time.perf_counter()))
+            name = random.choices(names, weights)[0]
+            futures.append(executor.submit(timed, name, time.perf_counter()))
+        wait(futures)
+    elapsed = (time.perf_counter() - step_started) / time_scale
+
+    completed = sum(len(result["latencies"]) for result in results.values())
+    errors = sum(result["errors"] for result in results.values())
+    return {
+        "offered_rate": rate,
+        "arrival_rate": round(completed / step_seconds, 3),
+        "operations": completed,
+        "throughput": round((completed - errors) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(errors / completed, 4) if completed else 0.0,
+        "elapsed_seconds": round(elapsed, 1),
+        "endpoints": {
+            name: {
+                **latency_summary(result["latencies"], time_scale),
+                "errors": result["errors"],
+                "queue_wait_p95": latency_summary(result["queue_waits"], time_scale).get("p95"),
+            }
+            for name, result in sorted(results.items())
+        },
+        "stages": {
+            stage: {**latency_summary(samples["latencies"], time_scale), "errors": samples["errors"]}
+            for stage, samples in sorted(local_fakes.recorder.snapshot().items())
+        },
+    }
+
+def find_saturation_point(steps: list[dict]) -> dict | None:
+    """Returns the first step whose throughput or tail latency shows saturation (see the thresholds above)."""
+    if not steps:
+        return None
+    baseline = steps[0]["endpoints"]
+    for step in steps:
+        reasons = []
+        for name, endpoint in step["endpoints"].items():
+            if not endpoint["count"]:
+                continue
+            if endpoint["queue_wait_p95"] > SATURATION_QUEUE_WAIT_SECONDS:
+                reasons.append(f"{name} p95 queue wait {endpoint['queue_wait_p95']:.2f}s")
+            base_p95 = baseline.get(name, {}).get("p95")
+            if base_p95 and endpoint["p95"] > SATURATION_LATENCY_FACTOR * base_p95:
+                reasons.append(f"{name} p95 {endpoint['p95']:.2f}s > {SATURATION_LATENCY_FACTOR:g}x baseline {base_p95:.2f}s")
+        if reasons:
+            return {"offered_rate": step["offered_rate"], "reasons": reasons}
+    return None
+
+def format_report(report: dict) -> str:
+    lines = [f"Load test: {report['workers']} workers, mix {report['mix']}, profile '{report['profile']}' (latencies in seconds, unscaled)"]
+    for step in report["steps"]:
+        lines.append(
+            f"\n== {step['offered_rate']:g} ops/s offered ({step['arrival_rate']:.2f} arrived): {step['operations']} ops in {step['elapsed_seconds']:.1f}s, "
+            f"{step['throughput']:.2f} ok ops/s, {step['error_rate']:.1%} errors"
+        )
+        lines.append(f"  {'endpoint':<24}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'queue p95':>11}{'errors':>8}")
+        for name, endpoint in step["endpoints"].items():
+            if endpoint["count"]:
+                lines.append(
+                    f"  {name:<24}{endpoint['count']:>7}{endpoint['p50']:>9.2f}{endpoint['p95']:>9.2f}"
+                    f"{endpoint['p99']:>9.2f}{endpoint['queue_wait_p95']:>11.2f}{endpoint['errors']:>8}"
+                )
+        lines.append(f"  {'stage':<24}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'':>11}{'errors':>8}")
+        for stage, summary in step["stages"].items():
+            lines.append(
+                f"  {stage:<24}{summary['count']:>7}{summary['p50']:>9.3f}{summary['p95']:>9.3f}"
+                f"{summary['p99']:>9.3f}{'':>11}{summary['errors']:>8}"
+            )
+    saturation = report["saturation"]
+    if saturation:
+        lines.append(f"\nSaturation point: {saturation['offered_rate']:g} ops/s ({'; '.join(saturation['reasons'])})")
+    else:
+        lines.append("\nSaturation point: not reached at the tested rates.")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay concurrent conversation and upload traffic against local fakes.")
+    parser.add_argument("--rates", default="0.5,1,2,4", help="Comma-separated arrival rates (operations/second) to test in turn.")
+    parser.add_argument("--step-seconds", type=float, default=60, help="How long each rate is offered.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Share of first interactions, follow-ups and uploads.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVICE_WORKERS", "8")), help="Concurrent requests served (the service's pool size).")
+    parser.add_argument("--profile", default="realistic", choices=sorted(local_fakes.PROFILES), help="Latency and error profile of the fakes.")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Run faster by scaling every latency and interval (e.g. 0.1); results are reported unscaled. "
+                             "CPU work isn't scaled, so very small values skew the results.")
+    parser.add_argument("--seed-analyzed", type=int, default=20, help="Analyzed documents to create for follow-ups.")
+    parser.add_argument("--seed-fresh", type=int, default=None, help="Unanalyzed documents to create for first interactions (default: enough for the run).")
+    parser.add_argument("--duplicate-share", type=float, default=0.0,
+                        help="Share of documents that may reuse a cached analysis of the (identical) sample document. "
+                             "The rest always run the full analysis.")
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument("--json-out", help="Also write the report as JSON to this path.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own logging.")
+    args = parser.parse_args()
+
+    rates = [float(rate) for rate in args.rates.split(",")]
+    mix = parse_mix(args.mix)
+    random.seed(args.random_seed)
+    os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="load-test-shards-"))
+
+    # The fakes must be in place before the pipeline modules import the cloud SDKs
+    local_fakes.install_fakes(profile="fast", seed=args.random_seed)
+    from gcp_handler import save_prompt_to_firestore
+    from text_processing import extract_text_from_pdf
+    from input import process_legal_document
+    from doc_processor import process_and_index_document
+    from main import handle_conversation_turn
+
+    pipeline = {
+        "save_prompt_to_firestore": save_prompt_to_firestore,
+        "process_legal_document": process_legal_document,
+        "process_and_index_document": process_and_index_document,
+        "handle_conversation_turn": handle_conversation_turn,
+    }
+    with open(SAMPLE_DOCUMENT_PATH, "rb") as document_file:
+        document_bytes = document_file.read()
+    corpus = LoadTestCorpus(pipeline, document_bytes, extract_text_from_pdf(io.BytesIO(document_bytes)), args.duplicate_share)
+
+    num_fresh = args.seed_fresh
+    if num_fresh is None:
+        num_fresh = int(sum(rates) * args.step_seconds * mix.get("first", 0) * 1.5) + 5
+    log_target = None if args.verbose else io.StringIO()
+
+    print(f"Seeding {num_fresh} fresh and {args.seed_analyzed} analyzed documents...")
+    with contextlib.redirect_stdout(log_target) if log_target else contextlib.nullcontext():
+        corpus.seed(num_fresh, args.seed_analyzed)
+
+    local_fakes.set_profile(args.profile, args.time_scale)
+    steps = []
+    for rate in rates:
+        print(f"Offering {rate:g} ops/s for {args.step_seconds:g}s...")
+        with contextlib.redirect_stdout(io.StringIO()) if log_target else contextlib.nullcontext():
+            steps.append(run_step(corpus, rate, args.step_seconds, mix, args.workers, args.time_scale))
+
+    report = {
+        "workers": args.workers,
+        "mix": mix,
+        "profile": args.profile,
+        "steps": steps,
+        "saturation": find_saturation_point(steps),
+    }
+    print(format_report(report))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Report written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,775 @@
+import io
+import sys
+import math
+import time
+import uuid
+import types
+import random
+import hashlib
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+# In-memory stand-ins for Firestore, Cloud Storage, Vertex AI (embeddings, Vector Search,
+# Gemini) and Tavily, for load tests and local runs without cloud credentials.
+#
+# Every fake call sleeps for a latency drawn from a per-service profile (log-normal,
+# given as median and p99) and fails with the profile's error rate, and its latency is
+# recorded per stage in `recorder`. The fakes are injected by replacing the SDK modules
+# in sys.modules, so install_fakes() must run before any pipeline module is imported:
+#
+#     import local_fakes
+#     local_fakes.install_fakes(profile="realistic")
+#     from main import handle_conversation_turn   # now talks to the fakes
+
+EMBEDDING_DIMENSIONS = 768
+MAX_EMBEDDING_TEXTS = 250
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+
+class ServiceProfile:
+    """Latency (log-normal from its median and p99, in seconds) and error rate of one fake service."""
+
+    def __init__(self, median: float, p99: float, error_rate: float = 0.0):
+        self.median = median
+        self.p99 = max(p99, median)
+        self.error_rate = error_rate
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        sigma = math.log(self.p99 / self.median) / 2.326
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+
+PROFILES = {
+    # Typical latencies seen from a GCP region close to the services
+    "realistic": {
+        "firestore.read": ServiceProfile(0.015, 0.08),
+        "firestore.query": ServiceProfile(0.03, 0.15),
+        "firestore.write": ServiceProfile(0.025, 0.12),
+        "firestore.transaction": ServiceProfile(0.04, 0.2, 0.002),
+        "gcs.upload": ServiceProfile(0.15, 0.6, 0.002),
+        "gcs.download": ServiceProfile(0.08, 0.4),
+        "embedding": ServiceProfile(0.12, 0.5, 0.005),
+        "vector_search.upsert": ServiceProfile(0.3, 1.2, 0.005),
+        "vector_search.query": ServiceProfile(0.06, 0.25, 0.002),
+        "gemini.flash": ServiceProfile(1.5, 5.0, 0.01),
+        "gemini.pro": ServiceProfile(6.0, 18.0, 0.01),
+        "tavily.search": ServiceProfile(1.2, 4.0, 0.02),
+    },
+    # No latency and no errors; for seeding data and functional checks
+    "fast": {},
+}
+
+
+class FakeServiceError(Exception):
+    """An injected failure of a fake service call."""
+
+
+class NotFound(Exception):
+    """Raised when updating a Firestore document that doesn't exist."""
+
+
+class LatencyRecorder:
+    """Thread-safe collection of call latencies, grouped by stage name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._errors = {}
+
+    def record(self, stage: str, seconds: float, ok: bool = True):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+            if not ok:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def snapshot(self) -> dict:
+        """Returns {stage: {"latencies": [...], "errors": n}} and leaves the recorder unchanged."""
+        with self._lock:
+            return {
+                stage: {"latencies": list(samples), "errors": self._errors.get(stage, 0)}
+                for stage, samples in self._samples.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+            self._errors = {}
+
+
+recorder = LatencyRecorder()
+_settings = {"profile": PROFILES["fast"], "time_scale": 1.0}
+_rng = random.Random()
+_rng_lock = threading.Lock()
+
+
+def set_profile(profile="realistic", time_scale: float = 1.0, seed: int | None = None):
+    """
+    Selects the latency/error profile of the fakes.
+
+    Args:
+        profile (str | dict): A name from PROFILES, or a {stage: ServiceProfile} dict.
+                              Stages missing from the dict have no latency and no errors.
+        time_scale (float): Multiplier applied to every sampled latency.
+        seed (int | None): Seeds the latency and error sampling, for repeatable runs.
+    """
+    _settings["profile"] = PROFILES[profile] if isinstance(profile, str) else profile
+    _settings["time_scale"] = time_scale
+    if seed is not None:
+        with _rng_lock:
+            _rng.seed(seed)
+
+def _call(stage: str):
+    """Simulates the network part of one service call: sleeps, records, maybe fails."""
+    service = _settings["profile"].get(stage)
+    if service is None:
+        recorder.record(stage, 0.0)
+        return
+    with _rng_lock:
+        delay = service.sample(_rng) * _settings["time_scale"]
+        failed = _rng.random() < service.error_rate
+    time.sleep(delay)
+    recorder.record(stage, delay, ok=not failed)
+    if failed:
+        raise FakeServiceError(f"Injected {stage} failure")
+
+
+# ---------------- Firestore ----------------
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class _FirestoreStore:
+    """All documents, keyed by path, plus the document IDs in each collection."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.documents = {}
+        self.collections = {}
+
+    def put(self, path: str, data: dict):
+        collection_path, doc_id = path.rsplit("/", 1)
+        self.documents[path] = data
+        self.collections.setdefault(collection_path, set()).add(doc_id)
+
+    def remove(self, path: str):
+        collection_path, doc_id = path.rsplit("/", 1)
+        self.documents.pop(path, None)
+        self.collections.get(collection_path, set()).discard(doc_id)
+
+_store = _FirestoreStore()
+
+
+def peek_document(path: str) -> dict | None:
+    """Reads a stored document directly, without latency or recording (for test harnesses)."""
+    with _store.lock:
+        data = _store.documents.get(path)
+        return _copy(data) if data is not None else None
+
+
+def _resolve_value(value):
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        return {key: _resolve_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_value(item) for item in value]
+    return value
+
+def _apply_update(document: dict, data: dict, dotted: bool):
+    """Applies an update's fields to document in place, resolving the special values."""
+    for key, value in data.items():
+        parts = key.split(".") if dotted else [key]
+        target = document
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        field = parts[-1]
+        if value is DELETE_FIELD:
+            target.pop(field, None)
+        elif isinstance(value, ArrayUnion):
+            current = target.get(field, [])
+            for item in _resolve_value(value.values):
+                if item not in current:
+                    current.append(item)
+            target[field] = current
+        elif isinstance(value, Increment):
+            target[field] = target.get(field, 0) + value.value
+        else:
+            target[field] = _resolve_value(value)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return _copy(self._data)
+
+    def get(self, field_path: str):
+        value = self._data or {}
+        for part in field_path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return _copy(value)
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+class DocumentReference:
+    def __init__(self, path: str):
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str):
+        return CollectionReference(f"{self.path}/{name}")
+
+    def _snapshot(self):
+        return DocumentSnapshot(self, _copy(_store.documents.get(self.path)))
+
+    def get(self, transaction=None, **kwargs):
+        if transaction is None:
+            _call("firestore.read")
+        with _store.lock:
+            return self._snapshot()
+
+    def _set(self, data: dict, merge: bool = False):
+        document = _copy(_store.documents.get(self.path, {})) if merge else {}
+        _apply_update(document, data, dotted=False)
+        _store.put(self.path, document)
+
+    def _update(self, data: dict):
+        if self.path not in _store.documents:
+            raise NotFound(f"No document to update: {self.path}")
+        document = _copy(_store.documents[self.path])
+        _apply_update(document, data, dotted=True)
+        _store.put(self.path, document)
+
+    def set(self, data: dict, merge: bool = False):
+        _call("firestore.write")
+        with _store.lock:
+            self._set(data, merge)
+
+    def update(self, data: dict):
+        _call("firestore.write")
+        with _store.lock:
+            self._update(data)
+
+    def delete(self):
+        _call("firestore.write")
+        with _store.lock:
+            _store.remove(self.path)
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+    _OPERATORS = {
+        "==": lambda value, target: value == target,
+        "!=": lambda value, target: value != target,
+        "<": lambda value, target: value is not None and value < target,
+        "<=": lambda value, target: value is not None and value <= target,
+        ">": lambda value, target: value is not None and value > target,
+        ">=": lambda value, target: value is not None and value >= target,
+        "in": lambda value, target: value in target,
+    }
+
+    def __init__(self, path: str, filters=(), order=None, limit_count=None):
+        self.path = path
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit_count
+
+    def _with(self, **changes):
+        query = Query(self.path, self._filters, self._order, self._limit)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._with(_filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path: str, direction: str = ASCENDING):
+        return self._with(_order=(field_path, direction))
+
+    def limit(self, count: int):
+        return self._with(_limit=count)
+
+    def _sort_key(self, item):
+        doc_id, data = item
+        return data.get(self._order[0]) if self._order and self._order[0] != "__name__" else doc_id
+
+    def _matching(self) -> list:
+        with _store.lock:
+            items = [
+                (doc_id, _copy(_store.documents[f"{self.path}/{doc_id}"]))
+                for doc_id in _store.collections.get(self.path, ())
+            ]
+        for field_path, op_string, target in self._filters:
+            items = [(doc_id, data) for doc_id, data in items if self._OPERATORS[op_string](data.get(field_path), target)]
+        if self._order and self._order[0] != "__name__":
+            items = [(doc_id, data) for doc_id, data in items if self._order[0] in data]
+        descending = bool(self._order) and self._order[1] == Query.DESCENDING
+        items.sort(key=self._sort_key, reverse=descending)
+        return items[:self._limit] if self._limit is not None else items
+
+    def stream(self, transaction=None):
+        if transaction is None:
+            _call("firestore.query")
+        for doc_id, data in self._matching():
+            yield DocumentSnapshot(DocumentReference(f"{self.path}/{doc_id}"), data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class CollectionReference(Query):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return DocumentReference(self.path.rsplit("/", 1)[0]) if "/" in self.path else None
+
+    def document(self, document_id: str | None = None):
+        return DocumentReference(f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data: dict):
+        doc_ref = self.document()
+        doc_ref.set(data)
+        return datetime.now(timezone.utc), doc_ref
+
+
+class WriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def _add(self, write):
+        if len(self._writes) >= FIRESTORE_MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can contain at most {FIRESTORE_MAX_BATCH_WRITES} writes.")
+        self._writes.append(write)
+
+    def set(self, reference, data, merge=False): self._add(lambda: reference._set(data, merge))
+    def update(self, reference, data): self._add(lambda: reference._update(data))
+    def delete(self, reference): self._add(lambda: _store.remove(reference.path))
+
+    def _apply(self):
+        with _store.lock:
+            for write in self._writes:
+                write()
+        self._writes = []
+
+    def commit(self):
+        _call("firestore.write")
+        self._apply()
+
+
+class Transaction(WriteBatch):
+    pass
+
+
+def transactional(fn):
+    """Runs fn(transaction, ...) and its writes atomically (the whole store is locked)."""
+    def run_in_transaction(transaction, *args, **kwargs):
+        _call("firestore.transaction")
+        with _store.lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction._apply()
+        return result
+    return run_in_transaction
+
+
+class Client:
+    def __init__(self, project=None, **kwargs):
+        self.project = project
+
+    def collection(self, name: str):
+        return CollectionReference(name)
+
+    def document(self, path: str):
+        return DocumentReference(path)
+
+    def batch(self):
+        return WriteBatch()
+
+    def transaction(self, **kwargs):
+        return Transaction()
+
+    def get_all(self, references, transaction=None):
+        references = list(references)
+        if transaction is None:
+            _call("firestore.read")
+        with _store.lock:
+            snapshots = [reference._snapshot() for reference in references]
+        yield from snapshots
+
+
+# ---------------- Cloud Storage ----------------
+
+_blobs = {}
+
+
+class Blob:
+    def __init__(self, bucket, name: str, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+
+    def upload_from_file(self, file_obj, rewind=False, size=None, content_type=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        data = file_obj.read() if size is None else file_obj.read(size)
+        _call("gcs.upload")
+        _blobs[(self.bucket.name, self.name)] = data
+
+    def upload_from_filename(self, filename: str, content_type=None, **kwargs):
+        with open(filename, "rb") as source:
+            self.upload_from_file(source, content_type=content_type)
+
+    def upload_from_string(self, data, content_type=None):
+        self.upload_from_file(io.BytesIO(data if isinstance(data, bytes) else data.encode()))
+
+    def download_as_bytes(self) -> bytes:
+        _call("gcs.download")
+        return _blobs[(self.bucket.name, self.name)]
+
+    def download_to_filename(self, filename: str):
+        data = self.download_as_bytes()
+        with open(filename, "wb") as target:
+            target.write(data)
+
+    def exists(self) -> bool:
+        return (self.bucket.name, self.name) in _blobs
+
+
+class Bucket:
+    def __init__(self, name: str):
+        self.name = name
+
+    def blob(self, blob_name: str, chunk_size=None):
+        return Blob(self, blob_name, chunk_size)
+
+
+class StorageClient:
+    def __init__(self, project=None, **kwargs):
+        self.project = project
+
+    def bucket(self, bucket_name: str):
+        return Bucket(bucket_name)
+
+
+# ---------------- Vertex AI: embeddings and Vector Search ----------------
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list[float]:
+    """
+    A deterministic bag-of-words embedding: each word adds to a hashed dimension, so
+    texts sharing words are similar, as with a real embedding model.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in text.lower().split():
+        digest = hashlib.md5(word.strip(".,;:()\"'").encode()).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimensions] += 1.0 if digest[4] & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
+
+
+class TextEmbedding:
+    def __init__(self, values):
+        self.values = values
+
+
+class TextEmbeddingInput:
+    def __init__(self, text: str, task_type: str | None = None, title: str | None = None):
+        self.text = text
+        self.task_type = task_type
+        self.title = title
+
+
+class TextEmbeddingModel:
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @classmethod
+    def from_pretrained(cls, model_name: str):
+        return cls(model_name)
+
+    def get_embeddings(self, texts, output_dimensionality: int | None = None, **kwargs):
+        if len(texts) > MAX_EMBEDDING_TEXTS:
+            raise ValueError(f"At most {MAX_EMBEDDING_TEXTS} texts can be embedded per request.")
+        _call("embedding")
+        dimensions = output_dimensionality or EMBEDDING_DIMENSIONS
+        return [
+            TextEmbedding(fake_embedding(text.text if isinstance(text, TextEmbeddingInput) else text, dimensions))
+            for text in texts
+        ]
+
+
+class Restriction:
+    def __init__(self, namespace: str, allow_list=None, deny_list=None):
+        self.namespace = namespace
+        self.allow_list = list(allow_list or [])
+        self.deny_list = list(deny_list or [])
+
+
+class IndexDatapoint:
+    Restriction = Restriction
+
+    def __init__(self, datapoint_id: str, feature_vector, restricts=None, **kwargs):
+        self.datapoint_id = datapoint_id
+        self.feature_vector = list(feature_vector)
+        self.restricts = list(restricts or [])
+
+
+class MatchNeighbor:
+    def __init__(self, id: str, distance: float, feature_vector=None):
+        self.id = id
+        self.distance = distance
+        self.feature_vector = feature_vector
+
+
+# Datapoints by the document ID they're restricted to, so a filtered query scans only that document
+_vector_index = {}
+_vector_index_lock = threading.Lock()
+
+
+class MatchingEngineIndex:
+    def __init__(self, index_name=None, **kwargs):
+        self.index_name = index_name
+
+    def upsert_datapoints(self, datapoints, **kwargs):
+        _call("vector_search.upsert")
+        with _vector_index_lock:
+            for datapoint in datapoints:
+                for restrict in datapoint.restricts or [Restriction("firestore_doc_id", [""])]:
+                    for doc_id in restrict.allow_list:
+                        _vector_index.setdefault(doc_id, {})[datapoint.datapoint_id] = np.asarray(datapoint.feature_vector, dtype=np.float32)
+
+    def remove_datapoints(self, datapoint_ids, **kwargs):
+        _call("vector_search.upsert")
+        with _vector_index_lock:
+            for vectors in _vector_index.values():
+                for datapoint_id in datapoint_ids:
+                    vectors.pop(datapoint_id, None)
+
+    def find_neighbors(self, queries, num_neighbors: int = 10, filter=None, return_full_datapoint: bool = False, **kwargs):
+        _call("vector_search.query")
+        filters = filter if isinstance(filter, list) else [filter] if filter else []
+        allowed = set()
+        for restrict in filters:
+            allowed.update(restrict["allow_list"] if isinstance(restrict, dict) else restrict.allow_tokens)
+        with _vector_index_lock:
+            doc_ids = allowed or set(_vector_index)
+            candidates = {}
+            for doc_id in doc_ids:
+                candidates.update(_vector_index.get(doc_id, {}))
+
+        if not candidates:
+            return [[] for _ in queries]
+        ids = list(candidates)
+        matrix = np.stack([candidates[datapoint_id] for datapoint_id in ids])
+        results = []
+        for query in queries:
+            similarities = matrix @ np.asarray(query, dtype=np.float32)
+            best = np.argsort(-similarities)[:num_neighbors]
+            results.append([
+                MatchNeighbor(ids[row], 1.0 - float(similarities[row]), matrix[row].tolist() if return_full_datapoint else None)
+                for row in best
+            ])
+        return results
+
+
+class MatchingEngineIndexEndpoint:
+    def __init__(self, index_endpoint_name=None, **kwargs):
+        self.index_endpoint_name = index_endpoint_name
+
+
+def _init(**kwargs):
+    pass
+
+
+# ---------------- Vertex AI: Gemini ----------------
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class GenerationResponse:
+    def __init__(self, text: str, prompt_token_count: int, candidates_token_count: int):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt_token_count, candidates_token_count)
+
+
+class Part:
+    def __init__(self, text: str):
+        self.text = text
+
+    @staticmethod
+    def from_text(text: str):
+        return Part(text)
+
+    def __str__(self):
+        return self.text
+
+
+class Tool:
+    pass
+
+
+class GenerationConfig:
+    def __init__(self, **kwargs):
+        self.config = kwargs
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(str(getattr(part, "text", part)) for part in contents)
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str, system_instruction=None, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _answer(self, prompt: str) -> str:
+        if "search queries" in prompt:
+            return "- landlord tenant security deposit refund\n- late payment interest rent\n- notice period for termination of lease"
+        sentence = f"This is a simulated {self.model_name} answer based on the provided legal context. "
+        return sentence * max(8, min(len(prompt) // 400, 60))
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        prompt = _prompt_text(contents)
+        if self.system_instruction:
+            prompt = _prompt_text(self.system_instruction if isinstance(self.system_instruction, list) else [self.system_instruction]) + "\n" + prompt
+        stage = "gemini.pro" if "pro" in self.model_name else "gemini.flash"
+        answer = self._answer(prompt)
+        prompt_tokens = len(prompt) // 4
+
+        if not stream:
+            _call(stage)
+            return GenerationResponse(answer, prompt_tokens, len(answer) // 4)
+
+        def stream_pieces():
+            # The first piece arrives after the whole sampled latency; the rest follow quickly
+            _call(stage)
+            piece_size = 200
+            for start in range(0, len(answer), piece_size):
+                piece = answer[start:start + piece_size]
+                yield GenerationResponse(piece, prompt_tokens if start == 0 else 0, len(piece) // 4)
+        return stream_pieces()
+
+
+# ---------------- Tavily ----------------
+
+class TavilyClient:
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def search(self, query: str, max_results: int = 5, **kwargs) -> dict:
+        _call("tavily.search")
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Commentary {rank + 1} on {query}",
+                    "url": f"https://example.org/search/{rank + 1}",
+                    "content": f"Simulated legal commentary about {query}. " * 10,
+                }
+                for rank in range(max_results)
+            ],
+        }
+
+
+def install_fakes(profile="fast", time_scale: float = 1.0, seed: int | None = None):
+    """
+    Replaces the google.cloud, vertexai and tavily modules with these fakes.
+    Must be called before the pipeline modules are imported. See set_profile for the arguments.
+    """
+    set_profile(profile, time_scale, seed)
+
+    def module(name, **attributes):
+        new_module = types.ModuleType(name)
+        new_module.__dict__.update(attributes)
+        return new_module
+
+    firestore_module = module(
+        "google.cloud.firestore", Client=Client, SERVER_TIMESTAMP=SERVER_TIMESTAMP, DELETE_FIELD=DELETE_FIELD,
+        ArrayUnion=ArrayUnion, Increment=Increment, FieldFilter=FieldFilter, Query=Query,
+        transactional=transactional, Transaction=Transaction
+    )
+    storage_module = module("google.cloud.storage", Client=StorageClient)
+    aiplatform_module = module(
+        "google.cloud.aiplatform", init=_init, MatchingEngineIndex=MatchingEngineIndex,
+        MatchingEngineIndexEndpoint=MatchingEngineIndexEndpoint,
+        gapic=types.SimpleNamespace(IndexDatapoint=IndexDatapoint)
+    )
+    cloud_module = module("google.cloud", __path__=[], firestore=firestore_module, storage=storage_module, aiplatform=aiplatform_module)
+    google_module = module("google", __path__=[], cloud=cloud_module)
+    language_models_module = module("vertexai.language_models", TextEmbeddingModel=TextEmbeddingModel, TextEmbeddingInput=TextEmbeddingInput)
+    generative_models_module = module(
+        "vertexai.generative_models", GenerativeModel=GenerativeModel, Part=Part, Tool=Tool, GenerationConfig=GenerationConfig
+    )
+    vertexai_module = module(
+        "vertexai", __path__=[], init=_init,
+        language_models=language_models_module, generative_models=generative_models_module
+    )
+    tavily_module = module("tavily", TavilyClient=TavilyClient)
+
+    sys.modules.update({
+        "google": google_module,
+        "google.cloud": cloud_module,
+        "google.cloud.firestore": firestore_module,
+        "google.cloud.storage": storage_module,
+        "google.cloud.aiplatform": aiplatform_module,
+        "vertexai": vertexai_module,
+        "vertexai.language_models": language_models_module,
+        "vertexai.generative_models": generative_models_module,
+        "tavily": tavily_module,
+    })
+    print("🧪 Installed local fakes for Firestore, Cloud Storage, Vertex AI and Tavily.")
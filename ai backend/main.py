@@ -1,104 +1,281 @@
-from gcp_handler import get_request_details, get_all_chunks_for_document, update_conversation_history, db
-from llm_orchestration import run_research_agent, run_analysis_agent, run_presentation_agent
-from retrieval_agent import retrieve_context_for_query
-from llm_response import generate_conversational_response
-
-
-def handle_conversation_turn(firestore_doc_id: str, user_query: str):
-    """
-    Acts as the main router for the application. It fetches the state from Firestore
-    and decides whether to run the initial analysis or a follow-up query.
-    """
-    print(f"\n--- Handling request for doc ID: {firestore_doc_id} ---")
-    
-    # 1. Fetch the current state of the document analysis from Firestore
-    request_data = get_request_details(firestore_doc_id)
-    if not request_data:
-        return "Error: Could not find the specified document in Firestore."
-
-    # 2. Decide which workflow to run
-    is_first_interaction = 'status' not in request_data or request_data['status'] != 'complete'
-    doc_ref = db.collection('analysis_requests').document(firestore_doc_id)
-
-    if is_first_interaction:
-        print("This is the first interaction. Running the full initial analysis pipeline...")
-        
-        # A. Set status to 'processing' to inform the UI
-        doc_ref.update({"status": "processing"})
-        
-        # B. Get the full document context from all its chunks in Firestore
-        full_document_context = get_all_chunks_for_document(firestore_doc_id)
-        if not full_document_context:
-            doc_ref.update({"status": "failed", "error_message": "Could not find text chunks."})
-            return "Error: Could not find document's text chunks to analyze."
-
-        # C. Run the three-agent orchestration process
-        research_findings = run_research_agent(full_document_context)
-        agent2_analysis = run_analysis_agent(full_document_context, research_findings)
-        # The first query from the user is used to tailor the initial summary
-        agent3_summary = run_presentation_agent(agent2_analysis, user_query)
-        
-        # D. Store all results and set status to 'complete'
-        doc_ref.update({
-            "status": "complete",
-            "agent2_detailed_analysis": agent2_analysis,
-            "agent3_initial_summary": agent3_summary,
-            "chat_history": []  # Initialize an empty array for the conversation
-        })
-        print(f"✅ Initial analysis complete. Results stored in Firestore.")
-        
-        return agent3_summary
-    else:
-        print("This is a follow-up question. Orchestrating conversational response...")
-        
-        # A. Get the necessary history and analysis from the fetched data
-        chat_history = request_data.get("chat_history", [])
-        agent2_analysis = request_data.get("agent2_detailed_analysis")
-        agent3_summary = request_data.get("agent3_initial_summary")
-        
-        # B. Retrieve specific document context relevant to the new query
-        doc_context_for_query = retrieve_context_for_query(user_query, firestore_doc_id, num_neighbors=5)
-        
-        # C. Call the centralized LLM response generator
-        is_first_follow_up = len(chat_history) == 0
-        new_response = generate_conversational_response(
-            query=user_query,
-            doc_context_for_query=doc_context_for_query,
-            chat_history=chat_history,
-            agent_2_analysis=agent2_analysis if is_first_follow_up else None,
-            agent_3_summary=agent3_summary if is_first_follow_up else None
-        )
-        
-        # D. Save the new conversation turn back to Firestore
-        update_conversation_history(firestore_doc_id, user_query, new_response)
-        
-        return new_response
-
-# --- Example Usage for Testing ---
-if __name__ == "__main__":
-
-    TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
-    
-    if "replace-with" in TEST_FIRESTORE_ID:
-        print("❌ Please update the TEST_FIRESTORE_ID variable with a real ID from your database.")
-    else:
-        # --- Simulate First Interaction ---
-        # To test this, make sure the document in Firestore does NOT have a 'status' of 'complete'
-        # You can manually delete the 'status' field in the Firestore console to reset it for testing.
-        print("\n=============================================")
-        print("      SIMULATING FIRST INTERACTION")
-        print("=============================================")
-        initial_user_prompt = "Can you give me a full breakdown of this contract? I'm mostly worried about payment deadlines and penalties."
-        initial_response = handle_conversation_turn(TEST_FIRESTORE_ID, initial_user_prompt)
-        print("\n--- INITIAL ANALYSIS RESULT ---")
-        print(initial_response)
-        
-        # --- Simulate a Follow-up Question ---
-        # The next call will automatically trigger the "else" block because the status is now 'complete'
-        print("\n\n=============================================")
-        print("      SIMULATING FOLLOW-UP QUESTION")
-        print("=============================================")
-        follow_up_question = "Thanks for the summary. What does 'governing law' mean in the context of California?"
-        follow_up_response = handle_conversation_turn(TEST_FIRESTORE_ID, follow_up_question)
-        print(f"\n--- RESPONSE to '{follow_up_question}' ---")
+import os
+import time
+import uuid
+import socket
+import threading
+from concurrent.futures import Future
+from gcp_handler import (
+    get_request_details, update_conversation_history,
+    acquire_analysis_lease, renew_analysis_lease, finish_analysis_lease, record_usage
+)
+from llm_orchestration import run_checkpointed_analysis, AnalysisStepFailed
+from retrieval_agent import retrieve_context_for_query
+from llm_response import generate_conversational_response, stream_conversational_response
+from usage_ledger import UsageLedger, ANALYSIS_TOKEN_BUDGET, ANALYSIS_TIME_BUDGET_SECONDS, CONVERSATION_TOKEN_BUDGET
+
+# Single-flight for the initial analysis: the lease lets one worker (across all processes)
+# run it; it is renewed every third of its lifetime and taken over once it expires.
+ANALYSIS_LEASE_SECONDS = float(os.getenv("ANALYSIS_LEASE_SECONDS", "120"))
+# How often, and for how long, other callers check for the running analysis's result
+ANALYSIS_WAIT_POLL_SECONDS = float(os.getenv("ANALYSIS_WAIT_POLL_SECONDS", "2"))
+ANALYSIS_WAIT_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_WAIT_TIMEOUT_SECONDS", "900"))
+
+# Initial analyses running in this process, by document ID
+_in_flight_analyses = {}
+_in_flight_lock = threading.Lock()
+
+
+def handle_conversation_turn(firestore_doc_id: str, user_query: str):
+    """
+    Acts as the main router for the application. It fetches the state from Firestore
+    and decides whether to run the initial analysis or a follow-up query.
+    """
+    print(f"\n--- Handling request for doc ID: {firestore_doc_id} ---")
+    
+    # 1. Fetch the current state of the document analysis from Firestore
+    request_data = get_request_details(firestore_doc_id)
+    if not request_data:
+        return "Error: Could not find the specified document in Firestore."
+
+    # 2. Decide which workflow to run
+    is_first_interaction = 'status' not in request_data or request_data['status'] != 'complete'
+
+    if is_first_interaction:
+        print("This is the first interaction. Running the full initial analysis pipeline...")
+        return run_initial_analysis_once(firestore_doc_id, user_query)
+    else:
+        print("This is a follow-up question. Orchestrating conversational response...")
+        response_inputs = _prepare_follow_up(firestore_doc_id, user_query, request_data)
+        ledger = UsageLedger(f"conversation-{firestore_doc_id}", CONVERSATION_TOKEN_BUDGET)
+        
+        # C. Call the centralized LLM response generator
+        new_response = generate_conversational_response(**response_inputs, ledger=ledger)
+        
+        # D. Save the new conversation turn back to Firestore
+        update_conversation_history(firestore_doc_id, user_query, new_response)
+        _record_usage(firestore_doc_id, "conversation", ledger)
+        
+        return new_response
+
+def run_initial_analysis_once(firestore_doc_id: str, user_query: str) -> str:
+    """
+    Runs a document's initial analysis, making sure concurrent requests for the same
+    document (a double-click, a client retry, another service node) share one run.
+
+    Callers in this process wait on the same in-flight future. Across processes, the
+    worker holding the document's Firestore analysis lease runs the analysis and the
+    others wait for its result.
+
+    Returns:
+        str: Agent 3's initial summary, or an error message.
+    """
+    with _in_flight_lock:
+        future = _in_flight_analyses.get(firestore_doc_id)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _in_flight_analyses[firestore_doc_id] = future
+
+    if not is_leader:
+        print(f"⏳ Joining the initial analysis already running in this process for doc ID: {firestore_doc_id}")
+        return future.result()
+
+    try:
+        result = _run_or_await_analysis(firestore_doc_id, user_query)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight_analyses.pop(firestore_doc_id, None)
+
+def _run_or_await_analysis(firestore_doc_id: str, user_query: str) -> str:
+    """Takes the analysis lease and runs the analysis, or waits for the lease holder's result."""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + ANALYSIS_WAIT_TIMEOUT_SECONDS
+
+    while True:
+        outcome, request_data = acquire_analysis_lease(firestore_doc_id, owner, ANALYSIS_LEASE_SECONDS)
+        if outcome == "acquired":
+            return _run_leased_analysis(firestore_doc_id, user_query, owner, request_data)
+        if outcome == "missing":
+            return "Error: Could not find the specified document in Firestore."
+        if outcome == "complete":
+            return request_data.get("agent3_initial_summary")
+
+        holder = request_data["analysis_lease"]["owner"]
+        print(f"⏳ Initial analysis for doc ID {firestore_doc_id} is running on {holder}. Waiting for its result...")
+        # Poll until the holder stores its result, fails, or stops renewing its lease
+        while True:
+            if time.monotonic() > deadline:
+                return "Error: Timed out waiting for the analysis already in progress. Please retry."
+            time.sleep(ANALYSIS_WAIT_POLL_SECONDS)
+            request_data = get_request_details(firestore_doc_id)
+            if not request_data:
+                return "Error: Could not find the specified document in Firestore."
+            if request_data.get("status") == "complete":
+                return request_data.get("agent3_initial_summary")
+            lease = request_data.get("analysis_lease")
+            if not lease and request_data.get("status") == "failed":
+                return f"Error: The analysis in progress failed ({request_data.get('error_message')}). Retry to resume it."
+            if not lease or lease["expires_at"] <= time.time():
+                break  # Released or abandoned; try to take it over
+
+def _run_leased_analysis(firestore_doc_id: str, user_query: str, owner: str, request_data: dict) -> str:
+    """Runs the analysis while holding the lease, renewing it in the background."""
+    stop_renewing = threading.Event()
+
+    def keep_lease():
+        while not stop_renewing.wait(ANALYSIS_LEASE_SECONDS / 3):
+            try:
+                if not renew_analysis_lease(firestore_doc_id, owner, ANALYSIS_LEASE_SECONDS):
+                    print(f"⚠️ Lost the analysis lease for doc ID: {firestore_doc_id}")
+                    return
+            except Exception as e:
+                print(f"❌ Error renewing analysis lease: {e}")
+
+    renewer = threading.Thread(target=keep_lease, name=f"lease-{firestore_doc_id}", daemon=True)
+    renewer.start()
+    try:
+        # Run the three-agent orchestration process as a dependency graph. The document's
+        # chunks are fetched inside the graph, overlapping with Agent 1's research. Each
+        # agent's output is checkpointed, so a retry after a failure or a killed worker
+        # resumes from the last completed step.
+        # The first query from the user is used to tailor the initial summary. Identical
+        # documents reuse a cached research + detailed analysis (see analysis_cache.py).
+        # Token and time budgets can be set per request with 'token_budget' and
+        # 'time_budget_seconds' (see usage_ledger.py).
+        ledger = UsageLedger(
+            f"analysis-{firestore_doc_id}",
+            request_data.get("token_budget", ANALYSIS_TOKEN_BUDGET),
+            request_data.get("time_budget_seconds", ANALYSIS_TIME_BUDGET_SECONDS)
+        )
+        try:
+            results = run_checkpointed_analysis(
+                firestore_doc_id, user_query, request_data.get("analysis_checkpoints"),
+                document_fingerprint=request_data.get("document_fingerprint"),
+                use_cache=request_data.get("use_analysis_cache", True),
+                ledger=ledger,
+                time_budget_requested="time_budget_seconds" in request_data
+            )
+        except AnalysisStepFailed as e:
+            if e.step in ("document", "document_head"):
+                finish_analysis_lease(firestore_doc_id, owner, {"status": "failed", "error_message": "Could not find text chunks."})
+                return "Error: Could not find document's text chunks to analyze."
+            finish_analysis_lease(firestore_doc_id, owner, {"status": "failed", "error_message": str(e)})
+            return f"Error: {e}. Completed steps were saved; retry to resume the analysis."
+        except BaseException as e:
+            finish_analysis_lease(firestore_doc_id, owner, {"status": "failed", "error_message": str(e)})
+            raise
+        finally:
+            # Failed runs still spent tokens
+            _record_usage(firestore_doc_id, "analysis", ledger)
+        agent3_summary = results["agent3_initial_summary"]
+        
+        # Store all results, set status to 'complete' and release the lease
+        finish_analysis_lease(firestore_doc_id, owner, {
+            "status": "complete",
+            "agent2_detailed_analysis": results["agent2_detailed_analysis"],
+            "agent3_initial_summary": agent3_summary,
+            "analysis_timing_report": results["timing_report"],
+            "analysis_cache_hit": results["analysis_cache_hit"],
+            "analysis_usage": results["usage"],
+            "chat_history": []  # Initialize an empty array for the conversation
+        })
+        print(f"✅ Initial analysis complete. Results stored in Firestore.")
+        return agent3_summary
+    finally:
+        stop_renewing.set()
+
+def _record_usage(firestore_doc_id: str, kind: str, ledger: UsageLedger):
+    """Adds a ledger's usage to the request's and the day's counters; failures are only logged."""
+    try:
+        record_usage(firestore_doc_id, kind, ledger.summary())
+    except Exception as e:
+        print(f"❌ Error recording {kind} usage: {e}")
+
+def _prepare_follow_up(firestore_doc_id: str, user_query: str, request_data: dict) -> dict:
+    """Gathers the inputs of a follow-up answer: history, initial analysis and retrieved document context."""
+    # A. Get the necessary history and analysis from the fetched data
+    chat_history = request_data.get("chat_history", [])
+    agent2_analysis = request_data.get("agent2_detailed_analysis")
+    agent3_summary = request_data.get("agent3_initial_summary")
+    
+    # B. Retrieve specific document context relevant to the new query
+    doc_context_for_query = retrieve_context_for_query(
+        user_query, firestore_doc_id, num_neighbors=5,
+        index_generation=request_data.get("index_generation")
+    )
+    
+    is_first_follow_up = len(chat_history) == 0
+    return {
+        "query": user_query,
+        "doc_context_for_query": doc_context_for_query,
+        "chat_history": chat_history,
+        "agent_2_analysis": agent2_analysis if is_first_follow_up else None,
+        "agent_3_summary": agent3_summary if is_first_follow_up else None
+    }
+
+def stream_conversation_turn(firestore_doc_id: str, user_query: str, cancelled: threading.Event | None = None):
+    """
+    Same routing as handle_conversation_turn, but yields the answer in pieces.
+
+    Follow-up answers are streamed from Gemini as they are generated and saved to the
+    conversation history once complete; a stream that fails or is abandoned part-way
+    is not saved. The initial analysis can't be streamed, so its summary (or error)
+    is yielded as a single piece when it's ready.
+
+    Args:
+        cancelled (threading.Event | None): Set when the client has gone away (see
+            server.py). The Gemini stream is then closed at the next piece and
+            nothing is saved to the history.
+    """
+    request_data = get_request_details(firestore_doc_id)
+    if not request_data or request_data.get("status") != "complete":
+        yield handle_conversation_turn(firestore_doc_id, user_query)
+        return
+
+    print(f"\n--- Streaming follow-up for doc ID: {firestore_doc_id} ---")
+    ledger = UsageLedger(f"conversation-{firestore_doc_id}", CONVERSATION_TOKEN_BUDGET)
+    response_pieces = []
+    try:
+        for piece in stream_conversational_response(**_prepare_follow_up(firestore_doc_id, user_query, request_data), ledger=ledger):
+            if cancelled is not None and cancelled.is_set():
+                print(f"⏹️ Client disconnected; abandoned the follow-up for doc ID: {firestore_doc_id}")
+                return
+            response_pieces.append(piece)
+            yield piece
+    finally:
+        _record_usage(firestore_doc_id, "conversation", ledger)
+    update_conversation_history(firestore_doc_id, user_query, "".join(response_pieces))
+
+# --- Example Usage for Testing ---
+if __name__ == "__main__":
+
+    TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"
+    
+    if "replace-with" in TEST_FIRESTORE_ID:
+        print("❌ Please update the TEST_FIRESTORE_ID variable with a real ID from your database.")
+    else:
+        # --- Simulate First Interaction ---
+        # To test this, make sure the document in Firestore does NOT have a 'status' of 'complete'
+        # You can manually delete the 'status' field in the Firestore console to reset it for testing.
+        print("\n=============================================")
+        print("      SIMULATING FIRST INTERACTION")
+        print("=============================================")
+        initial_user_prompt = "Can you give me a full breakdown of this contract? I'm mostly worried about payment deadlines and penalties."
+        initial_response = handle_conversation_turn(TEST_FIRESTORE_ID, initial_user_prompt)
+        print("\n--- INITIAL ANALYSIS RESULT ---")
+        print(initial_response)
+        
+        # --- Simulate a Follow-up Question ---
+        # The next call will automatically trigger the "else" block because the status is now 'complete'
+        print("\n\n=============================================")
+        print("      SIMULATING FOLLOW-UP QUESTION")
+        print("=============================================")
+        follow_up_question = "Thanks for the summary. What does 'governing law' mean in the context of California?"
+        follow_up_response = handle_conversation_turn(TEST_FIRESTORE_ID, follow_up_question)
+        print(f"\n--- RESPONSE to '{follow_up_question}' ---")
         print(follow_up_response)
\ No newline at end of file
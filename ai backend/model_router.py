@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from dotenv import load_dotenv
+from vertexai.generative_models import GenerativeModel
+
+# Picks the Gemini model for each step of the analysis.
+#
+# Every step has a default model tier in the routing policy. Steps that default to
+# Pro can name a cheaper 'small_model' that is used when the step's input is both
+# small (at most 'small_max_chars') and simple (complexity score at most
+# 'small_max_complexity'), so a one-page NDA is analyzed on Flash in seconds while
+# a 200-page lease still gets Pro. A step may also have a 'latency_budget_seconds':
+# if the chosen model's estimated latency for the input exceeds it, the slowest
+# (most capable) model that fits the budget is used instead, or the fastest one
+# if none fits.
+#
+# The policy can be overridden with the MODEL_ROUTING_POLICY environment variable,
+# a JSON object merged over DEFAULT_ROUTING_POLICY (per model and per step), e.g.
+#   MODEL_ROUTING_POLICY='{"steps": {"initial_analysis": {"small_max_chars": 60000}}}'
+#
+# Model handles are created once per (model, system instruction) and shared.
+
+load_dotenv()
+
+DEFAULT_ROUTING_POLICY = {
+    # Latency estimates: base_seconds + seconds_per_1k_chars * input size
+    "models": {
+        "flash": {"name": "gemini-1.5-flash-002", "base_seconds": 1.0, "seconds_per_1k_chars": 0.08},
+        "pro": {"name": "gemini-1.5-pro-002", "base_seconds": 3.0, "seconds_per_1k_chars": 0.3},
+    },
+    "steps": {
+        "search_queries": {"model": "flash"},
+        "initial_analysis": {"model": "pro", "small_model": "flash", "small_max_chars": 30000, "small_max_complexity": 0.6},
+        "verification": {"model": "flash"},
+        "refinement": {"model": "pro", "small_model": "flash", "small_max_chars": 20000, "small_max_complexity": 0.6},
+        "presentation": {"model": "flash"},
+    },
+}
+
+# Words and phrases typical of dense, heavily cross-referenced legal drafting
+COMPLEXITY_MARKERS = (
+    "notwithstanding", "subject to", "provided that", "provided however", "indemnif",
+    "arbitration", "liabilit", "warrant", "force majeure", "governing law", "jurisdiction",
+    "assign", "sub-clause", "schedule", "pursuant to", "without prejudice",
+)
+
+
+def _load_routing_policy() -> dict:
+    policy = json.loads(json.dumps(DEFAULT_ROUTING_POLICY))
+    override = os.getenv("MODEL_ROUTING_POLICY")
+    if not override:
+        return policy
+    try:
+        override = json.loads(override)
+        for section in ("models", "steps"):
+            for key, settings in override.get(section, {}).items():
+                policy[section].setdefault(key, {}).update(settings)
+        print("✅ Loaded model routing policy from MODEL_ROUTING_POLICY.")
+    except (ValueError, AttributeError) as e:
+        print(f"❌ Ignoring invalid MODEL_ROUTING_POLICY: {e}")
+    return policy
+
+ROUTING_POLICY = _load_routing_policy()
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def routing_policy_version() -> str:
+    """A short hash of the routing policy, for caches whose contents depend on the chosen models."""
+    return hashlib.sha256(json.dumps(ROUTING_POLICY, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def estimate_complexity(text: str) -> float:
+    """
+    Estimates how demanding a legal text is to analyze, from 0 (plain) to 1 (dense).
+
+    The score combines the density of legal qualifiers (per 1,000 words), the
+    density of cross-references to other sections or clauses, and the average
+    sentence length.
+    """
+    words = text.split()
+    if not words:
+        return 0.0
+    per_1k_words = 1000 / len(words)
+    lowered = text.lower()
+
+    marker_density = sum(lowered.count(marker) for marker in COMPLEXITY_MARKERS) * per_1k_words
+    reference_density = len(re.findall(r"\b(?:section|clause|article|paragraph)\s+\d", lowered)) * per_1k_words
+    sentences = [sentence for sentence in re.split(r"[.;]\s", text) if sentence.strip()]
+    average_sentence_words = len(words) / max(len(sentences), 1)
+
+    score = (
+        0.5 * min(marker_density / 20, 1.0)
+        + 0.2 * min(reference_density / 10, 1.0)
+        + 0.3 * min(max(average_sentence_words - 15, 0) / 25, 1.0)
+    )
+    return round(score, 3)
+
+def estimate_latency(model_key: str, input_chars: int) -> float:
+    """The policy's latency estimate (in seconds) for a model call with this much input."""
+    model = ROUTING_POLICY["models"][model_key]
+    return model["base_seconds"] + model["seconds_per_1k_chars"] * input_chars / 1000
+
+def route_model(step: str, input_text: str, latency_budget_seconds: float | None = None,
+                complexity_text: str | None = None) -> tuple[str, str]:
+    """
+    Chooses the model for one step of the analysis.
+
+    Args:
+        step (str): The step's name in the routing policy (e.g. "initial_analysis").
+        input_text (str): The step's input (typically its full prompt); its size drives the choice.
+        latency_budget_seconds (float | None): Overrides the step's latency budget from the policy.
+        complexity_text (str | None): The text scored for complexity, e.g. the document without the
+                                      prompt's instructions. Defaults to input_text.
+
+    Returns:
+        tuple[str, str]: The model name to use, and the reason it was chosen.
+    """
+    step_policy = ROUTING_POLICY["steps"].get(step, {"model": "flash"})
+    model_key = step_policy["model"]
+    input_chars = len(input_text)
+    reason = "default"
+
+    small_model = step_policy.get("small_model")
+    if small_model and input_chars <= step_policy.get("small_max_chars", 0):
+        complexity = estimate_complexity(input_text if complexity_text is None else complexity_text)
+        if complexity <= step_policy.get("small_max_complexity", 1.0):
+            model_key = small_model
+            reason = f"small input, complexity {complexity:.2f}"
+        else:
+            reason = f"complexity {complexity:.2f}"
+
+    budget = latency_budget_seconds if latency_budget_seconds is not None else step_policy.get("latency_budget_seconds")
+    if budget is not None and estimate_latency(model_key, input_chars) > budget:
+        fastest = min(ROUTING_POLICY["models"], key=lambda key: estimate_latency(key, input_chars))
+        fitting = [key for key in ROUTING_POLICY["models"] if estimate_latency(key, input_chars) <= budget]
+        # Prefer the slowest model that still fits the budget, as a proxy for the most capable one
+        fitting_key = max(fitting, key=lambda key: estimate_latency(key, input_chars)) if fitting else fastest
+        if fitting_key != model_key:
+            model_key = fitting_key
+            reason = f"latency budget {budget:g}s"
+
+    return ROUTING_POLICY["models"][model_key]["name"], reason
+
+def choose_model(step: str, input_text: str, latency_budget_seconds: float | None = None,
+                 complexity_text: str | None = None) -> tuple[str, str]:
+    """Like route_model, but logs the choice."""
+    model_name, reason = route_model(step, input_text, latency_budget_seconds, complexity_text)
+    print(f"🔀 Routed {step} ({len(input_text)} chars) to {model_name} ({reason}).")
+    return model_name, reason
+
+def get_model(model_name: str, system_instruction: str | None = None) -> GenerativeModel:
+    """Returns a shared model handle for this model and system instruction, creating it on first use."""
+    key = (model_name, system_instruction)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            if system_instruction is None:
+                model = GenerativeModel(model_name)
+            else:
+                model = GenerativeModel(model_name, system_instruction=system_instruction)
+            _models[key] = model
+        return model
+
+
+if __name__ == "__main__":
+    sample_text = "The Tenant shall pay the monthly rent on or before the 5th day of each month."
+    for step_name in ROUTING_POLICY["steps"]:
+        choose_model(step_name, sample_text)
+    print(f"Complexity of the sample: {estimate_complexity(sample_text)}")
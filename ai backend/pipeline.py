@@ -0,0 +1,237 @@
+import time
+import queue
+import threading
+
+# A small thread-based pipeline: stages connected by bounded queues, so every
+# stage works concurrently on different items and memory stays bounded by the
+# queue sizes rather than by the size of the input.
+
+_END_OF_STREAM = object()
+
+
+class PipelineAborted(Exception):
+    """Raised inside stage workers to unwind them after another stage has failed."""
+
+
+class _Stage:
+    def __init__(self, name: str, fn, workers: int, streaming: bool):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.streaming = streaming
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    Runs a source iterable through a chain of stages, each in its own thread(s).
+
+    Two kinds of stage are supported:
+    - add_stage(name, fn): calls fn(item) for every item and passes the result on
+      (a result of None is dropped). Can run several workers in parallel.
+    - add_stream_stage(name, fn): calls fn(iterator) once and passes on everything
+      it yields. For stateful steps such as chunking a stream of pages.
+
+    If any stage raises, the pipeline stops and run() re-raises the first error.
+    """
+
+    def __init__(self, name: str, queue_size: int = 4):
+        self.name = name
+        self.queue_size = queue_size
+        self.stages = []
+        self.source_seconds = 0.0
+        self._stop = threading.Event()
+        self._errors = []
+
+    def add_stage(self, name: str, fn, workers: int = 1):
+        self.stages.append(_Stage(name, fn, workers, streaming=False))
+        return self
+
+    def add_stream_stage(self, name: str, fn):
+        self.stages.append(_Stage(name, fn, workers=1, streaming=True))
+        return self
+
+    def _put(self, q: queue.Queue, item):
+        while True:
+            if self._stop.is_set():
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _fail(self, error: Exception):
+        if not isinstance(error, PipelineAborted):
+            self._errors.append(error)
+        self._stop.set()
+
+    def _run_source(self, source, out_q: queue.Queue):
+        try:
+            iterator = iter(source)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.source_seconds += time.perf_counter() - started
+                self._put(out_q, item)
+            self._put(out_q, _END_OF_STREAM)
+        except Exception as e:
+            self._fail(e)
+
+    def _run_map_worker(self, stage: _Stage, in_q: queue.Queue, out_q: queue.Queue, finished: list):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END_OF_STREAM:
+                    # Let sibling workers see the end of the stream too
+                    self._put(in_q, _END_OF_STREAM)
+                    break
+                started = time.perf_counter()
+                result = stage.fn(item)
+                with stage.lock:
+                    stage.busy_seconds += time.perf_counter() - started
+                    stage.items_in += 1
+                if result is not None:
+                    self._put(out_q, result)
+                    with stage.lock:
+                        stage.items_out += 1
+
+            # The last worker of a stage to finish closes the downstream queue
+            with stage.lock:
+                finished[0] += 1
+                is_last_worker = finished[0] == stage.workers
+            if is_last_worker:
+                self._put(out_q, _END_OF_STREAM)
+        except Exception as e:
+            self._fail(e)
+
+    def _run_stream_worker(self, stage: _Stage, in_q: queue.Queue, out_q: queue.Queue):
+        waiting = [0.0]
+
+        def inputs():
+            while True:
+                wait_started = time.perf_counter()
+                item = self._get(in_q)
+                waiting[0] += time.perf_counter() - wait_started
+                if item is _END_OF_STREAM:
+                    return
+                stage.items_in += 1
+                yield item
+
+        try:
+            outputs = iter(stage.fn(inputs()))
+            while True:
+                started = time.perf_counter()
+                waiting[0] = 0.0
+                try:
+                    result = next(outputs)
+                except StopIteration:
+                    break
+                finally:
+                    # Time spent waiting on the upstream stage isn't this stage's work
+                    stage.busy_seconds += time.perf_counter() - started - waiting[0]
+                self._put(out_q, result)
+                stage.items_out += 1
+            self._put(out_q, _END_OF_STREAM)
+        except Exception as e:
+            self._fail(e)
+
+    def run(self, source) -> dict:
+        """
+        Runs the pipeline to completion.
+
+        Returns:
+            dict: A timing report with the wall time and each stage's item counts and busy time.
+        """
+        started = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._run_source, args=(source, queues[0]), name=f"{self.name}-source", daemon=True)]
+
+        for index, stage in enumerate(self.stages):
+            in_q, out_q = queues[index], queues[index + 1]
+            if stage.streaming:
+                threads.append(threading.Thread(
+                    target=self._run_stream_worker, args=(stage, in_q, out_q),
+                    name=f"{self.name}-{stage.name}", daemon=True
+                ))
+            else:
+                finished = [0]
+                for worker in range(stage.workers):
+                    threads.append(threading.Thread(
+                        target=self._run_map_worker, args=(stage, in_q, out_q, finished),
+                        name=f"{self.name}-{stage.name}-{worker}", daemon=True
+                    ))
+
+        for thread in threads:
+            thread.start()
+
+        # Drain the final queue so the last stage never blocks
+        try:
+            while self._get(queues[-1]) is not _END_OF_STREAM:
+                pass
+        except PipelineAborted:
+            pass
+
+        self._stop.set()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return {
+            "pipeline": self.name,
+            "wall_seconds": time.perf_counter() - started,
+            "source_seconds": self.source_seconds,
+            "stages": [
+                {
+                    "name": stage.name,
+                    "workers": stage.workers,
+                    "items_in": stage.items_in,
+                    "items_out": stage.items_out,
+                    "busy_seconds": stage.busy_seconds,
+                }
+                for stage in self.stages
+            ],
+        }
+
+
+def format_pipeline_report(report: dict) -> str:
+    """Formats a Pipeline.run() report as one line per stage, marking the slowest stage."""
+    slowest = max(report["stages"], key=lambda stage: stage["busy_seconds"] / stage["workers"], default=None)
+    lines = [f"Pipeline '{report['pipeline']}' finished in {report['wall_seconds']:.2f}s (source {report['source_seconds']:.2f}s)"]
+    for stage in report["stages"]:
+        marker = "  <- slowest" if stage is slowest else ""
+        lines.append(
+            f"  {stage['name']:<12} {stage['items_in']:>5} in / {stage['items_out']:>5} out, "
+            f"{stage['busy_seconds']:.2f}s busy x{stage['workers']}{marker}"
+        )
+    return "\n".join(lines)
+
+
+def batched(items, batch_size: int):
+    """Groups an iterable into lists of up to batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,121 @@
+import re
+import numpy as np
+
+# Reranking helpers for retrieval: pick a relevant but diverse subset of the
+# candidate chunks, then strip the text that overlapping chunks repeat, so the
+# context sent to Gemini carries fewer, more useful tokens.
+
+MIN_OVERLAP_WORDS = 5
+MAX_OVERLAP_WORDS = 60
+_WORD = re.compile(r'\S+')
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def mmr_select(query_embedding, candidate_embeddings, k: int, lambda_mult: float = 0.7) -> list[int]:
+    """
+    Maximal marginal relevance: greedily picks up to k candidates, each time taking
+    the one with the best trade-off between similarity to the query and
+    dissimilarity to the candidates already picked.
+
+    Args:
+        query_embedding: The query vector.
+        candidate_embeddings: One vector per candidate, in retrieval order.
+        k (int): The number of candidates to select.
+        lambda_mult (float): 1.0 ranks purely by relevance; lower values favour diversity.
+
+    Returns:
+        list[int]: The indices of the selected candidates, in selection order.
+    """
+    candidates = _normalize_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+    if candidates.ndim != 2 or not len(candidates) or k <= 0:
+        return []
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+
+    relevance = candidates @ query
+    pairwise_similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of each candidate to anything selected so far
+    max_similarity = pairwise_similarity[selected[0]].copy()
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, pairwise_similarity[best], out=max_similarity)
+    return selected
+
+def _word_overlap(first_words: list[str], second_words: list[str]) -> int:
+    """Returns how many trailing words of `first_words` are repeated at the start of `second_words`."""
+    longest = min(len(first_words), len(second_words), MAX_OVERLAP_WORDS)
+    for size in range(longest, MIN_OVERLAP_WORDS - 1, -1):
+        if first_words[-size:] == second_words[:size]:
+            return size
+    return 0
+
+def _drop_leading_words(text: str, num_words: int) -> str:
+    """Removes the first num_words words of text, keeping the rest of its original spacing."""
+    for index, word in enumerate(_WORD.finditer(text), start=1):
+        if index == num_words:
+            return text[word.end():].lstrip()
+    return ""
+
+def merge_overlapping_chunks(texts: list[str]) -> list[str]:
+    """
+    Merges chunks that overlap at their edges (as adjacent chunks from
+    chunk_document_text do) and drops chunks fully contained in another.
+
+    Chunks keep their input order; a chunk that continues an earlier one is
+    appended to it without the repeated words.
+    """
+    merged = []
+    for text in texts:
+        words = text.split()
+        joined = f" {' '.join(words)} "
+        for index, existing in enumerate(merged):
+            existing_words = existing.split()
+            existing_joined = f" {' '.join(existing_words)} "
+            if joined in existing_joined:
+                break
+            if existing_joined in joined:
+                merged[index] = text
+                break
+            overlap = _word_overlap(existing_words, words)
+            if overlap:
+                merged[index] = existing + " " + _drop_leading_words(text, overlap)
+                break
+            overlap = _word_overlap(words, existing_words)
+            if overlap:
+                merged[index] = text + " " + _drop_leading_words(existing, overlap)
+                break
+        else:
+            merged.append(text)
+    return merged
+
+def build_context(texts: list[str], max_chars: int, separator: str = "\n---\n") -> str:
+    """
+    Joins texts in order until the next one would exceed max_chars. The text that
+    crosses the limit is trimmed at its last sentence end if enough of it fits.
+    The first text is always included, hard-trimmed to max_chars if it has no
+    such sentence end, so the context is never empty.
+    """
+    parts = []
+    used = 0
+    for text in texts:
+        remaining = max_chars - used - (len(separator) if parts else 0)
+        if len(text) <= remaining:
+            parts.append(text)
+            used += len(text) + (len(separator) if len(parts) > 1 else 0)
+            continue
+        if remaining <= 0:
+            break
+        sentence_end = max(text.rfind(mark, 0, remaining) for mark in (". ", "? ", "! "))
+        if sentence_end > remaining // 2:
+            parts.append(text[:sentence_end + 1])
+        elif not parts:
+            parts.append(text[:max_chars])
+        break
+    return separator.join(parts)
@@ -1,71 +1,359 @@
-import os
-from dotenv import load_dotenv
-from google.cloud import aiplatform
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
-from gcp_handler import get_chunks_by_ids
-
-load_dotenv()
-
-# --- Configuration ---
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")  
-GCP_REGION = "asia-south1"
-VECTOR_SEARCH_INDEX_ID = os.getenv("VECTOR_SEARCH_INDEX_ID")
-
-# ✅ FIXED: Initialize with updated approach
-vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-aiplatform.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-
-# ✅ FIXED: Use latest embedding model
-embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
-
-# ✅ FIXED: Use streaming-enabled index
-streaming_index = aiplatform.MatchingEngineIndex(index_name=VECTOR_SEARCH_INDEX_ID)
-
-def retrieve_context_for_query(query: str, firestore_doc_id: str, num_neighbors: int = 5) -> str:
-    """
-    ✅ UPDATED: Compatible with new doc_processor.py approach
-    """
-    print(f"Retrieving context for query: {query}")
-    
-    try:
-        # Generate embedding for query using new model
-        embeddings = embedding_model.get_embeddings([query])
-        query_embedding = embeddings[0].values
-        
-        # Query Vector Search using streaming index
-        response = streaming_index.find_neighbors(
-            queries=[query_embedding],
-            num_neighbors=num_neighbors,
-            filter={
-                "namespace": "firestore_doc_id", 
-                "allow_list": [firestore_doc_id]
-            }
-        )
-        
-        # Extract neighbor IDs
-        neighbor_ids = [neighbor.id for neighbor in response[0]] if response else []
-        
-        if not neighbor_ids:
-            print("No relevant document chunks found in Vector Search.")
-            return ""
-        
-        # Get actual text from Firestore
-        context_chunks = get_chunks_by_ids(firestore_doc_id, neighbor_ids)
-        return "\n---\n".join(context_chunks)
-        
-    except Exception as e:
-        print(f"❌ Error in retrieve_context_for_query: {e}")
-        return ""
-
-if __name__ == "__main__":
-    if not VECTOR_SEARCH_INDEX_ID or "YOUR_VECTOR" in str(VECTOR_SEARCH_INDEX_ID):
-        print("❌ Please update the VECTOR_SEARCH_INDEX_ID in your .env file.")
-    else:
-        TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"  # Use your working doc ID
-        TEST_QUERY = "What is the penalty for late delivery?"
-        
-        print(f"--- Testing Retrieval for document {TEST_FIRESTORE_ID} ---")
-        retrieved_context = retrieve_context_for_query(TEST_QUERY, TEST_FIRESTORE_ID)
-        print("--- Retrieved Context ---")
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from google.cloud import aiplatform
+import vertexai
+from vertexai.language_models import TextEmbeddingModel
+import numpy as np
+from gcp_handler import get_chunks_for_documents, get_chunks_with_embeddings, save_chunk_embeddings, get_clauses, get_chunk_neighbors, stitch_chunks
+from reranker import mmr_select, merge_overlapping_chunks, build_context
+from embedding_codec import encode_embeddings, decode_embeddings, embedding_dim
+from embedding_settings import EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSIONALITY, EMBEDDING_BATCH_SIZE, EMBEDDING_STORAGE_FORMAT
+from vector_shards import open_shard, write_shard
+from clause_index import find_clause_references, names_unresolved_clauses, clause_lookup_ids, format_clause
+
+load_dotenv()
+
+# --- Configuration ---
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")  
+GCP_REGION = "asia-south1"
+VECTOR_SEARCH_INDEX_ID = os.getenv("VECTOR_SEARCH_INDEX_ID")
+# text-embedding-004 accepts at most 250 texts per request
+MAX_EMBEDDING_BATCH = 250
+# Reranking: candidates fetched per returned chunk, MMR relevance/diversity balance, context size target
+RERANK_CANDIDATE_MULTIPLIER = int(os.getenv("RERANK_CANDIDATE_MULTIPLIER", "4"))
+RERANK_LAMBDA = float(os.getenv("RERANK_LAMBDA", "0.7"))
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "6000"))
+# Chunks on each side of a selected chunk to include in its passage (0 = the chunk alone)
+CONTEXT_NEIGHBOR_WINDOW = int(os.getenv("CONTEXT_NEIGHBOR_WINDOW", "0"))
+# Serve single-document retrieval from local memory-mapped shards (see vector_shards.py)
+USE_LOCAL_VECTOR_SHARDS = os.getenv("USE_LOCAL_VECTOR_SHARDS", "true").lower() == "true"
+# Seconds before a failed background shard rebuild is tried again
+SHARD_REBUILD_RETRY_SECONDS = float(os.getenv("SHARD_REBUILD_RETRY_SECONDS", "300"))
+# Concurrent per-document Vector Search requests in multi-document retrieval
+MAX_PARALLEL_SEARCHES = int(os.getenv("MAX_PARALLEL_SEARCHES", "8"))
+# Answer queries that name a clause ("clause 6", "Schedule A") from the clause index (see clause_index.py)
+USE_CLAUSE_INDEX = os.getenv("USE_CLAUSE_INDEX", "true").lower() == "true"
+
+# ✅ FIXED: Initialize with updated approach
+vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+aiplatform.init(project=GCP_PROJECT_ID, location=GCP_REGION)
+
+# ✅ FIXED: Use latest embedding model
+embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
+
+# ✅ FIXED: Use streaming-enabled index
+streaming_index = aiplatform.MatchingEngineIndex(index_name=VECTOR_SEARCH_INDEX_ID)
+
+# Background shard rebuilds: doc ID -> "running", or the monotonic time of the last failure
+_shard_rebuilds = {}
+_shard_rebuild_lock = threading.Lock()
+
+def _embed_queries(queries: list[str]) -> list[list[float]]:
+    """Embeds queries in as few calls as possible (one call per MAX_EMBEDDING_BATCH queries)."""
+    query_embeddings = []
+    for start in range(0, len(queries), MAX_EMBEDDING_BATCH):
+        embeddings = embedding_model.get_embeddings(
+            queries[start:start + MAX_EMBEDDING_BATCH], output_dimensionality=EMBEDDING_DIMENSIONALITY
+        )
+        query_embeddings.extend(embedding.values for embedding in embeddings)
+    return query_embeddings
+
+def _rebuild_vector_shard(firestore_doc_id: str, index_generation: str | None):
+    """
+    Background job: builds a document's shard, embedding the chunks that have no
+    stored vector (in batches of EMBEDDING_BATCH_SIZE) and saving those vectors on
+    their chunks so later rebuilds, on any node, don't need to embed them again.
+    """
+    try:
+        chunks = get_chunks_with_embeddings(firestore_doc_id)
+        vectors = _stored_vectors(chunks)
+        missing_rows = [row for row, vector in enumerate(vectors) if vector is None]
+        for start in range(0, len(missing_rows), EMBEDDING_BATCH_SIZE):
+            batch_rows = missing_rows[start:start + EMBEDDING_BATCH_SIZE]
+            embeddings = embedding_model.get_embeddings(
+                [chunks[row][1] for row in batch_rows], output_dimensionality=EMBEDDING_DIMENSIONALITY
+            )
+            batch_vectors = [embedding.values for embedding in embeddings]
+            save_chunk_embeddings(
+                firestore_doc_id, [chunks[row][0] for row in batch_rows],
+                encode_embeddings(batch_vectors, EMBEDDING_STORAGE_FORMAT), EMBEDDING_MODEL_NAME
+            )
+            for row, vector in zip(batch_rows, batch_vectors):
+                vectors[row] = vector
+
+        if chunks:
+            write_shard(firestore_doc_id, [chunk_id for chunk_id, _, _ in chunks],
+                        np.asarray(vectors, dtype=np.float32), generation=index_generation)
+        print(f"✅ Rebuilt vector shard for doc ID {firestore_doc_id} ({len(missing_rows)} chunks re-embedded).")
+        with _shard_rebuild_lock:
+            _shard_rebuilds.pop(firestore_doc_id, None)
+    except Exception as e:
+        print(f"❌ Error rebuilding vector shard: {e}")
+        with _shard_rebuild_lock:
+            _shard_rebuilds[firestore_doc_id] = time.monotonic()
+
+def _stored_vectors(chunks: list[tuple[str, str, bytes | None]]) -> list:
+    """Decodes the chunks' stored embeddings; None for chunks without one of EMBEDDING_DIMENSIONALITY."""
+    vectors = [None] * len(chunks)
+    stored_rows = [row for row, (_, _, blob) in enumerate(chunks) if blob and embedding_dim(blob) == EMBEDDING_DIMENSIONALITY]
+    if stored_rows:
+        for row, vector in zip(stored_rows, decode_embeddings([chunks[row][2] for row in stored_rows])):
+            vectors[row] = vector
+    return vectors
+
+def load_vector_shard(firestore_doc_id: str, index_generation: str | None = None):
+    """
+    Returns the local vector shard for a document, building it if this node doesn't
+    have an up-to-date one.
+
+    A shard is built only from the embeddings stored on the document's Firestore chunks
+    (see doc_processor.upsert_datapoints). If some chunks have no stored embedding, or
+    one of a different size than EMBEDDING_DIMENSIONALITY, the shard is rebuilt in a
+    background thread and None is returned, so the current request uses Vector Search.
+    A failed rebuild is retried after SHARD_REBUILD_RETRY_SECONDS.
+
+    Args:
+        firestore_doc_id (str): The ID of the document's record in 'analysis_requests'.
+        index_generation (str | None): The document's current 'index_generation'. Shards
+                                       from other generations are rebuilt.
+
+    Returns:
+        VectorShard | None: The shard, or None if it isn't available yet.
+    """
+    shard = open_shard(firestore_doc_id, index_generation)
+    if shard is not None and shard.matrix.shape[1] == EMBEDDING_DIMENSIONALITY:
+        return shard
+
+    with _shard_rebuild_lock:
+        rebuild_state = _shard_rebuilds.get(firestore_doc_id)
+        if rebuild_state == "running":
+            return None
+        if rebuild_state is not None and time.monotonic() - rebuild_state < SHARD_REBUILD_RETRY_SECONDS:
+            return None
+
+    try:
+        chunks = get_chunks_with_embeddings(firestore_doc_id)
+        if not chunks:
+            return None
+        vectors = _stored_vectors(chunks)
+        if all(vector is not None for vector in vectors):
+            print(f"Building vector shard for doc ID {firestore_doc_id} from {len(chunks)} stored embeddings.")
+            write_shard(firestore_doc_id, [chunk_id for chunk_id, _, _ in chunks],
+                        np.asarray(vectors, dtype=np.float32), generation=index_generation)
+            return open_shard(firestore_doc_id, index_generation)
+    except Exception as e:
+        print(f"❌ Error building vector shard: {e}")
+        with _shard_rebuild_lock:
+            _shard_rebuilds[firestore_doc_id] = time.monotonic()
+        return None
+
+    with _shard_rebuild_lock:
+        if _shard_rebuilds.get(firestore_doc_id) == "running":
+            return None
+        _shard_rebuilds[firestore_doc_id] = "running"
+    print(f"⏳ {sum(vector is None for vector in vectors)} chunks of doc ID {firestore_doc_id} have no stored embedding; "
+          f"rebuilding its vector shard in the background.")
+    threading.Thread(
+        target=_rebuild_vector_shard, args=(firestore_doc_id, index_generation),
+        name=f"shard-rebuild-{firestore_doc_id}", daemon=True
+    ).start()
+    return None
+
+def retrieve_context_for_queries(queries: list[str], firestore_doc_ids: list[str], num_neighbors: int = 5) -> dict[str, dict[str, list[str]]]:
+    """
+    Batched retrieval for many queries across many documents.
+
+    All queries are embedded in one call. Each document is searched with one
+    multi-query find_neighbors request restricted to it (the documents' requests
+    run in parallel), so every document gets its own top num_neighbors. Every
+    referenced chunk is then fetched from Firestore in one batched read.
+
+    Args:
+        queries (list[str]): The queries to retrieve context for.
+        firestore_doc_ids (list[str]): The documents to search.
+        num_neighbors (int): The maximum number of chunks returned per query and document.
+
+    Returns:
+        dict[str, dict[str, list[str]]]: For each query, the matching chunk texts grouped by
+        document ID, best match first. Duplicate chunks are removed; a document with no
+        matches has an empty list.
+    """
+    queries = list(dict.fromkeys(queries))
+    firestore_doc_ids = list(dict.fromkeys(firestore_doc_ids))
+    results = {query: {doc_id: [] for doc_id in firestore_doc_ids} for query in queries}
+    if not queries or not firestore_doc_ids:
+        return results
+
+    print(f"Retrieving context for {len(queries)} queries across {len(firestore_doc_ids)} documents")
+    
+    try:
+        query_embeddings = _embed_queries(queries)
+        
+        def search_document(doc_id):
+            # All queries in one request, restricted to this document
+            response = streaming_index.find_neighbors(
+                queries=query_embeddings,
+                num_neighbors=num_neighbors,
+                filter={
+                    "namespace": "firestore_doc_id",
+                    "allow_list": [doc_id]
+                }
+            )
+            return [[neighbor.id for neighbor in neighbors] for neighbors in response] if response else [[] for _ in queries]
+
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_SEARCHES, len(firestore_doc_ids))) as search_pool:
+            neighbor_ids_by_doc = dict(zip(firestore_doc_ids, search_pool.map(search_document, firestore_doc_ids)))
+
+        # Every hit's document is known, so each chunk is exactly one read
+        chunk_refs = [
+            (doc_id, chunk_id)
+            for doc_id, neighbor_ids_per_query in neighbor_ids_by_doc.items()
+            for neighbor_ids in neighbor_ids_per_query
+            for chunk_id in neighbor_ids
+        ]
+        if not chunk_refs:
+            print("No relevant document chunks found in Vector Search.")
+            return results
+
+        # Get actual text from Firestore, each chunk read once
+        chunks = get_chunks_for_documents(chunk_refs)
+
+        for doc_id, neighbor_ids_per_query in neighbor_ids_by_doc.items():
+            for query, neighbor_ids in zip(queries, neighbor_ids_per_query):
+                group = results[query][doc_id]
+                for chunk_id in dict.fromkeys(neighbor_ids):
+                    if chunk_id in chunks and chunks[chunk_id][1] not in group:
+                        group.append(chunks[chunk_id][1])
+        return results
+        
+    except Exception as e:
+        print(f"❌ Error in retrieve_context_for_queries: {e}")
+        return results
+
+def retrieve_clause_context(query: str, firestore_doc_id: str, max_context_chars: int = MAX_CONTEXT_CHARS) -> str | None:
+    """
+    Resolves the clauses a query names explicitly through the document's clause
+    index, with a single batched Firestore read and no embedding or Vector Search call.
+
+    Returns:
+        str | None: The referenced clauses' text, or None if the query names no clause,
+                    names clauses that couldn't all be parsed (see
+                    clause_index.names_unresolved_clauses) or any named clause isn't
+                    in the index (e.g. a document indexed before clause indexing
+                    existed), so the caller falls back to semantic retrieval.
+    """
+    references = find_clause_references(query)
+    if not references:
+        return None
+    if names_unresolved_clauses(query):
+        print("Query names more clauses than could be resolved; using semantic retrieval.")
+        return None
+
+    lookup_ids = {reference: clause_lookup_ids(reference) for reference in references}
+    entries = get_clauses(firestore_doc_id, [clause_id for ids in lookup_ids.values() for clause_id in ids])
+    passages = []
+    for reference, ids in lookup_ids.items():
+        entry = next((entries[clause_id] for clause_id in ids if clause_id in entries), None)
+        if entry is None:
+            print(f"Clause '{reference}' is not in the clause index; using semantic retrieval.")
+            return None
+        passages.append(format_clause(entry))
+
+    context = build_context(list(dict.fromkeys(passages)), max_context_chars)
+    print(f"Resolved {', '.join(references)} from the clause index ({len(context)} chars).")
+    return context
+
+def retrieve_context_for_query(query: str, firestore_doc_id: str, num_neighbors: int = 5, max_context_chars: int = MAX_CONTEXT_CHARS,
+                               index_generation: str | None = None) -> str:
+    """
+    Retrieves a compact, deduplicated context for one query within one document.
+
+    Over-fetches num_neighbors * RERANK_CANDIDATE_MULTIPLIER candidates, picks
+    num_neighbors of them with maximal-marginal-relevance (so near-duplicate
+    chunks don't crowd out other relevant text), merges chunks that overlap at
+    their edges and trims the result to max_context_chars. With
+    CONTEXT_NEIGHBOR_WINDOW set, each selected chunk is widened to its neighbors
+    in the document (see gcp_handler.get_chunk_neighbors).
+
+    Candidates come from this node's local vector shard when USE_LOCAL_VECTOR_SHARDS
+    is on, and from Vector Search otherwise (or if no shard can be built).
+    Pass the document's 'index_generation' so a shard from before a re-index isn't used.
+
+    Queries that name specific clauses are answered from the clause index instead,
+    when USE_CLAUSE_INDEX is on (see retrieve_clause_context).
+    """
+    print(f"Retrieving context for query: {query}")
+    
+    try:
+        if USE_CLAUSE_INDEX:
+            clause_context = retrieve_clause_context(query, firestore_doc_id, max_context_chars)
+            if clause_context:
+                return clause_context
+
+        query_embedding = _embed_queries([query])[0]
+        num_candidates = num_neighbors * RERANK_CANDIDATE_MULTIPLIER
+        
+        shard = load_vector_shard(firestore_doc_id, index_generation) if USE_LOCAL_VECTOR_SHARDS else None
+        if shard is not None:
+            # Search the memory-mapped shard; it already holds the candidates' vectors
+            matches = shard.search(query_embedding, num_candidates)
+            neighbor_ids = [chunk_id for chunk_id, _, _ in matches]
+            vectors_by_id = {chunk_id: vector for chunk_id, _, vector in matches}
+        else:
+            # Over-fetch candidates, with their vectors for reranking
+            response = streaming_index.find_neighbors(
+                queries=[query_embedding],
+                num_neighbors=num_candidates,
+                filter={
+                    "namespace": "firestore_doc_id", 
+                    "allow_list": [firestore_doc_id]
+                },
+                return_full_datapoint=True
+            )
+            neighbors = list(response[0]) if response else []
+            neighbor_ids = [neighbor.id for neighbor in neighbors]
+            vectors_by_id = {neighbor.id: getattr(neighbor, "feature_vector", None) for neighbor in neighbors}
+        
+        # Get actual text from Firestore
+        chunks = get_chunks_for_documents([(firestore_doc_id, chunk_id) for chunk_id in neighbor_ids])
+        candidate_ids = [chunk_id for chunk_id in neighbor_ids if chunk_id in chunks]
+        if not candidate_ids:
+            print("No relevant document chunks found in Vector Search.")
+            return ""
+        candidate_texts = [chunks[chunk_id][1] for chunk_id in candidate_ids]
+        
+        # Use the vectors returned by the search; embed the candidates only if they're missing
+        candidate_vectors = [vectors_by_id[chunk_id] for chunk_id in candidate_ids]
+        if any(vector is None or len(vector) == 0 for vector in candidate_vectors):
+            candidate_vectors = _embed_queries(candidate_texts)
+        
+        selected = mmr_select(query_embedding, candidate_vectors, num_neighbors, RERANK_LAMBDA)
+        context_chunks = None
+        if CONTEXT_NEIGHBOR_WINDOW > 0:
+            # Widen each selection to its neighboring chunks, stitched in document order
+            runs = get_chunk_neighbors(firestore_doc_id, [candidate_ids[index] for index in selected], CONTEXT_NEIGHBOR_WINDOW)
+            context_chunks = [passage for run in runs for passage in stitch_chunks(run)]
+        if not context_chunks:
+            context_chunks = merge_overlapping_chunks([candidate_texts[index] for index in selected])
+        context = build_context(context_chunks, max_context_chars)
+        print(f"Reranked {len(candidate_ids)} candidates into {len(context_chunks)} passages ({len(context)} chars).")
+        return context
+        
+    except Exception as e:
+        print(f"❌ Error in retrieve_context_for_query: {e}")
+        return ""
+
+if __name__ == "__main__":
+    if not VECTOR_SEARCH_INDEX_ID or "YOUR_VECTOR" in str(VECTOR_SEARCH_INDEX_ID):
+        print("❌ Please update the VECTOR_SEARCH_INDEX_ID in your .env file.")
+    else:
+        TEST_FIRESTORE_ID = "Tll9dhfupWZnhljQiQT4"  # Use your working doc ID
+        TEST_QUERY = "What is the penalty for late delivery?"
+        
+        print(f"--- Testing Retrieval for document {TEST_FIRESTORE_ID} ---")
+        retrieved_context = retrieve_context_for_query(TEST_QUERY, TEST_FIRESTORE_ID)
+        print("--- Retrieved Context ---")
         print(retrieved_context if retrieved_context else "No context was found.")
\ No newline at end of file
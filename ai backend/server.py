@@ -0,0 +1,330 @@
+import os
+import json
+import asyncio
+import threading
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from gcp_handler import get_request_details, update_ingestion_status
+from input import process_legal_document
+from doc_processor import process_and_index_document
+from main import handle_conversation_turn, stream_conversation_turn
+from usage_ledger import process_usage
+
+# HTTP service for the Python pipeline: document upload + background ingestion, and
+# conversation turns with optional server-sent-event streaming.
+#
+# All pipeline calls are blocking, so they run on bounded thread pools. Each pool has
+# an admission limit (running + waiting); requests past it get an immediate 429 with
+# Retry-After instead of queueing up, so a saturated node sheds load quickly and the
+# load balancer can send the client elsewhere.
+#
+# Run with:  python server.py   (or: uvicorn server:app --host 0.0.0.0 --port 8080)
+# Use one uvicorn worker per process; the limits below are per process.
+
+load_dotenv()
+
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+# Request pool: uploads, status reads and conversation turns
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "8"))
+SERVICE_QUEUE_DEPTH = int(os.getenv("SERVICE_QUEUE_DEPTH", "16"))
+# Background ingestion jobs (process_and_index_document runs its own pipeline threads)
+INGESTION_JOB_WORKERS = int(os.getenv("INGESTION_JOB_WORKERS", "2"))
+INGESTION_JOB_QUEUE_DEPTH = int(os.getenv("INGESTION_JOB_QUEUE_DEPTH", "8"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+
+class AdmissionController:
+    """
+    Caps the amount of work admitted to a pool (running plus waiting) and rejects
+    anything beyond the cap immediately, rather than letting queues grow.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def overloaded_error(self) -> HTTPException:
+        return HTTPException(
+            status_code=429,
+            detail=f"The {self.name} pool is at capacity ({self.limit}). Retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+    @contextmanager
+    def admit(self):
+        """Holds a slot for the duration of the block, or raises a 429 if none is free."""
+        if not self.try_acquire():
+            raise self.overloaded_error()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": self.in_flight, "limit": self.limit, "rejected": self.rejected}
+
+
+class StreamSlot:
+    """
+    A request slot held by a streaming response. It is handed to the producer thread
+    when streaming starts; until then the response itself releases it. Released at most once.
+    """
+
+    def __init__(self, admission: AdmissionController):
+        self.admission = admission
+        self.handed_off = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.admission.release()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """A StreamingResponse that releases its StreamSlot if the body was never streamed."""
+
+    def __init__(self, content, slot: StreamSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.slot.handed_off:
+                self.slot.release()
+
+
+request_executor = ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="request")
+request_admission = AdmissionController("request", SERVICE_WORKERS + SERVICE_QUEUE_DEPTH)
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_JOB_WORKERS, thread_name_prefix="ingestion")
+ingestion_admission = AdmissionController("ingestion", INGESTION_JOB_WORKERS + INGESTION_JOB_QUEUE_DEPTH)
+
+app = FastAPI(title="Sparrow Legal Analyst")
+
+
+class ConversationTurn(BaseModel):
+    query: str
+
+
+async def _run_blocking(fn, *args):
+    """Runs a blocking pipeline call on the request pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request_executor, functools.partial(fn, *args))
+
+def _run_ingestion_job(gcs_uri: str, firestore_doc_id: str, full_text: str | None):
+    """Background job: indexes an uploaded document and records its progress in Firestore."""
+    try:
+        update_ingestion_status(firestore_doc_id, "running")
+        stats = process_and_index_document(gcs_uri, firestore_doc_id, full_text=full_text)
+        if stats:
+            update_ingestion_status(
+                firestore_doc_id, "complete",
+                num_chunks=stats["num_chunks"],
+                num_datapoints=stats["num_datapoints"],
+                num_clauses=stats.get("num_clauses", 0),
+                fallback_batches=stats["fallback_batches"],
+                index_generation=stats.get("index_generation")
+            )
+        else:
+            update_ingestion_status(firestore_doc_id, "failed", error="Document ingestion failed.")
+    except Exception as e:
+        print(f"❌ Ingestion job for doc ID {firestore_doc_id} failed: {e}")
+        try:
+            update_ingestion_status(firestore_doc_id, "failed", error=str(e))
+        except Exception as status_error:
+            print(f"❌ Could not record ingestion failure: {status_error}")
+    finally:
+        ingestion_admission.release()
+
+def _require_ingested(request_data: dict):
+    """
+    Raises a 409 unless the document's background ingestion is complete: with
+    Retry-After while it is queued or running, without it if ingestion failed.
+    Documents with no ingestion record were indexed outside this service and pass.
+    """
+    ingestion_status = request_data.get("ingestion", {}).get("status")
+    if ingestion_status in (None, "complete"):
+        return
+    if ingestion_status == "failed":
+        raise HTTPException(status_code=409, detail="Document ingestion failed; upload the document again.")
+    raise HTTPException(
+        status_code=409,
+        detail=f"Document ingestion is {ingestion_status}. Retry when it is complete.",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_events(generate_pieces, slot: StreamSlot):
+    """
+    Runs a blocking generator on the request pool and relays its pieces as
+    server-sent events: 'chunk' for each piece, then 'done' or 'error'.
+    The request slot (already acquired by the caller) is released when the generator finishes.
+
+    generate_pieces is called with a threading.Event that is set when the client
+    disconnects. The generator should stop at the next piece when it is set, and
+    the producer closes it there in any case, so an abandoned answer stops using
+    the model and the request slot.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def publish(event, data):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+        except RuntimeError:
+            # The event loop is gone (server shutting down); nobody is listening anymore
+            pass
+
+    def produce():
+        try:
+            for piece in generate_pieces(cancelled):
+                if cancelled.is_set():
+                    print("⏹️ Client disconnected; stopping the stream.")
+                    return
+                publish("chunk", {"text": piece})
+            publish("done", {})
+        except Exception as e:
+            print(f"❌ Error while streaming response: {e}")
+            publish("error", {"error": str(e)})
+        finally:
+            slot.release()
+
+    slot.handed_off = True
+    try:
+        request_executor.submit(produce)
+    except Exception:
+        slot.release()
+        raise
+
+    try:
+        while True:
+            event, data = await events.get()
+            yield _sse_event(event, data)
+            if event != "chunk":
+                break
+    finally:
+        # Runs on completion and when the response is cancelled by a client disconnect
+        cancelled.set()
+
+
+@app.get("/health")
+async def health():
+    """Liveness plus current pool usage, for load balancer checks and dashboards."""
+    return {
+        "status": "ok",
+        "request_pool": request_admission.stats(),
+        "ingestion_pool": ingestion_admission.stats()
+    }
+
+@app.get("/usage")
+async def usage():
+    """Model calls, tokens and seconds spent by this node since it started, by step and by model."""
+    return process_usage.snapshot()
+
+@app.post("/documents", status_code=202)
+async def upload_document(file: UploadFile = File(...), prompt: str = Form(...), use_analysis_cache: bool = Form(True)):
+    """
+    Uploads a document and registers the analysis request, then indexes it in a
+    background job. Poll GET /documents/{firestore_id}/ingestion for its progress.
+    Set use_analysis_cache to false to force a fresh analysis of a previously seen document.
+    """
+    # Reserve the ingestion slot first, so an overloaded node rejects before doing any work
+    if not ingestion_admission.try_acquire():
+        raise ingestion_admission.overloaded_error()
+
+    try:
+        with request_admission.admit():
+            file_content = await file.read()
+            result = await _run_blocking(process_legal_document, file.filename, file_content, prompt, True, use_analysis_cache)
+            if result.get("status") != "success":
+                raise HTTPException(status_code=502, detail=result.get("message", "Upload failed."))
+
+            firestore_doc_id = result["firestore_id"]
+            await _run_blocking(update_ingestion_status, firestore_doc_id, "queued")
+        ingestion_executor.submit(_run_ingestion_job, result["gcs_uri"], firestore_doc_id, result.get("full_text"))
+    except BaseException:
+        ingestion_admission.release()
+        raise
+
+    return {
+        "firestore_id": firestore_doc_id,
+        "gcs_uri": result["gcs_uri"],
+        "ingestion_status": "queued",
+        "status_url": f"/documents/{firestore_doc_id}/ingestion"
+    }
+
+@app.get("/documents/{firestore_doc_id}/ingestion")
+async def get_ingestion_status(firestore_doc_id: str):
+    """Returns the background ingestion job's status ('queued', 'running', 'complete' or 'failed')."""
+    with request_admission.admit():
+        request_data = await _run_blocking(get_request_details, firestore_doc_id)
+    if not request_data:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    return {"firestore_id": firestore_doc_id, **request_data.get("ingestion", {"status": "unknown"})}
+
+@app.post("/documents/{firestore_doc_id}/conversation")
+async def conversation_turn(firestore_doc_id: str, turn: ConversationTurn, request: Request, stream: bool = False):
+    """
+    Runs one conversation turn (the initial analysis on the first turn, a follow-up answer after).
+
+    With ?stream=true or an 'Accept: text/event-stream' header, the answer is sent as
+    server-sent events as it is generated; otherwise it is returned as JSON when complete.
+    Returns 409 (with Retry-After) until the document's ingestion is complete.
+    """
+    with request_admission.admit():
+        request_data = await _run_blocking(get_request_details, firestore_doc_id)
+    if not request_data:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    _require_ingested(request_data)
+
+    stream = stream or "text/event-stream" in request.headers.get("accept", "")
+    if stream:
+        if not request_admission.try_acquire():
+            raise request_admission.overloaded_error()
+        slot = StreamSlot(request_admission)
+        return AdmittedStreamingResponse(
+            _stream_events(lambda cancelled: stream_conversation_turn(firestore_doc_id, turn.query, cancelled), slot),
+            slot,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    with request_admission.admit():
+        response = await _run_blocking(handle_conversation_turn, firestore_doc_id, turn.query)
+    return {"firestore_id": firestore_doc_id, "response": response}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=SERVICE_PORT)
@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class TaskGraph:
+    """
+    A small dependency graph of steps, run on a thread pool.
+
+    Each step starts as soon as all of its dependencies have finished, and steps
+    that don't depend on each other run concurrently. Every step's start and end
+    time is recorded so the run's critical path can be reported afterwards.
+
+    Usage:
+        graph = TaskGraph("analysis")
+        graph.add_step("a", fetch_a)
+        graph.add_step("b", fetch_b)
+        graph.add_step("c", combine, deps=["a", "b"])   # called as combine(a_result, b_result)
+        results = graph.run(targets=["c"])
+    """
+
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        self.max_workers = max_workers
+        self.steps = {}
+        self.timings = {}
+        self.wall_seconds = 0.0
+
+    def add_step(self, name: str, fn, deps: list[str] | tuple = ()):
+        """Adds a step. fn is called with the results of `deps`, in order."""
+        if name in self.steps:
+            raise ValueError(f"Step '{name}' is already defined.")
+        self.steps[name] = (fn, tuple(deps))
+        return self
+
+    def _required_steps(self, targets) -> set[str]:
+        """Returns the targets and everything they transitively depend on."""
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in required:
+                continue
+            if name not in self.steps:
+                raise KeyError(f"Unknown step '{name}'.")
+            required.add(name)
+            pending.extend(self.steps[name][1])
+        return required
+
+    def run(self, targets: list[str] | None = None) -> dict:
+        """
+        Runs the steps needed for `targets` (all steps by default).
+
+        Returns:
+            dict: The result of every step that ran, keyed by step name.
+
+        Raises:
+            The first exception raised by a step. Steps that already started are
+            allowed to finish, but nothing new is started after a failure.
+        """
+        required = self._required_steps(targets or list(self.steps))
+        remaining_deps = {name: set(self.steps[name][1]) for name in required}
+        results = {}
+        error = None
+        started = time.perf_counter()
+
+        def run_step(name):
+            fn, deps = self.steps[name]
+            step_started = time.perf_counter()
+            try:
+                return fn(*[results[dep] for dep in deps])
+            finally:
+                self.timings[name] = (step_started - started, time.perf_counter() - started)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name) as executor:
+            running = {}
+
+            def start_ready_steps():
+                for name, deps in list(remaining_deps.items()):
+                    if not deps:
+                        del remaining_deps[name]
+                        running[executor.submit(run_step, name)] = name
+
+            start_ready_steps()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    for deps in remaining_deps.values():
+                        deps.discard(name)
+                if error is None:
+                    start_ready_steps()
+
+        self.wall_seconds = time.perf_counter() - started
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path(self) -> list[str]:
+        """
+        Returns the chain of steps that determined the total run time: starting from
+        the step that finished last, repeatedly follow the dependency that finished last.
+        """
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self.steps[path[-1]][1] if dep in self.timings]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda dep: self.timings[dep][1]))
+        return list(reversed(path))
+
+    def timing_report(self) -> dict:
+        """Returns per-step timings (seconds from the start of the run) and the critical path."""
+        critical_path = self.critical_path()
+        return {
+            "graph": self.name,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "critical_path": critical_path,
+            "critical_path_seconds": round(sum(self.timings[name][1] - self.timings[name][0] for name in critical_path), 3),
+            "steps": {
+                name: {"start": round(start, 3), "end": round(end, 3), "seconds": round(end - start, 3)}
+                for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0])
+            },
+        }
+
+    def format_timing_report(self) -> str:
+        report = self.timing_report()
+        lines = [f"Task graph '{self.name}' finished in {report['wall_seconds']:.2f}s"]
+        for name, timing in report["steps"].items():
+            marker = " *" if name in report["critical_path"] else ""
+            lines.append(f"  {name:<26} {timing['start']:>7.2f}s -> {timing['end']:>7.2f}s ({timing['seconds']:.2f}s){marker}")
+        lines.append(f"  Critical path (*): {' -> '.join(report['critical_path'])}")
+        return "\n".join(lines)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The backend modules import each other by file name (e.g. "from gcp_handler import ..."),
+# so the tests run with the backend directory on the import path, like the scripts do.
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIRECTORY)
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import pytest
+
+# retrieval_agent imports Vertex AI and Firestore; run it against the in-memory fakes.
+os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="test-shards-"))
+import local_fakes
+local_fakes.install_fakes(profile="fast")
+
+import retrieval_agent
+from clause_index import find_clause_references, names_unresolved_clauses, clause_lookup_ids, build_clause_index
+from text_processing import iter_pdf_page_texts
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_rent_agreement_filled_expanded.pdf")
+
+CONTRACT = """RENT AGREEMENT
+1. The Tenant shall pay rent monthly.
+2. The deposit is refundable.
+(a) Deductions are itemised.
+(b) Refunds are made within 30 days.
+3. Section 21 of the Rent
+Control Act applies to evictions.
+SCHEDULE A
+1. Fixtures and fittings.
+2. Keys handed over.
+GENERAL
+4. Either party may terminate."""
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("What does clause 6 say about late fees?", ["6"]),
+    ("Compare clauses 3 and 4", ["3", "4"]),
+    ("Does clause 3, 5 or 7 cover repairs?", ["3", "5", "7"]),
+    ("clause 3, 5, and 7", ["3", "5", "7"]),
+    ("Summarize sections 2 to 4", ["2", "3", "4"]),
+    ("clauses 3-5", ["3", "4", "5"]),
+    ("clauses 12.1 through 12.3", ["12.1", "12.2", "12.3"]),
+    ("clause 3(a) and 4(b)", ["3(a)", "4(b)"]),
+    ("Section 12.3 (b)", ["12.3(b)"]),
+    ("clauses 1 and 2 of Schedule A", ["schedule a:1", "schedule a:2"]),
+    ("Schedule A, clause 2", ["schedule a:2"]),
+    ("clause 6, and Annexure I", ["6", "annexure i"]),
+    ("Is section 21 of the Rent Control Act relevant?", []),
+    ("sections 3 and 4 of the Rent Act", []),
+    ("clause 6 says 30 days, see clause 6 again", ["6"]),
+])
+def test_find_clause_references(query, expected):
+    assert find_clause_references(query) == expected
+
+
+@pytest.mark.parametrize("query, unresolved", [
+    ("clauses 3 and 4", False),
+    ("clause 6", False),
+    ("Clauses 3 through to 5", True),
+    ("clauses 2 to 40", True),
+    ("clauses 3(a) to 3(c)", True),
+    ("sections 3 to 40 of the Rent Act", False),
+])
+def test_names_unresolved_clauses(query, unresolved):
+    assert names_unresolved_clauses(query) is unresolved
+
+
+def test_clause_lookup_ids_fall_back_to_the_enclosing_clause():
+    assert clause_lookup_ids("12.3(b)(ii)") == ["12.3(b)(ii)", "12.3(b)", "12.3", "12"]
+    assert clause_lookup_ids("schedule a:2") == ["schedule a:2", "schedule a"]
+
+
+def test_build_clause_index_qualifies_schedules_and_ignores_wrapped_statutes():
+    entries = {entry["clause_id"]: entry for entry in build_clause_index(CONTRACT.split("\n", 5))}
+    # The main numbering resumes after the schedule once a heading follows it
+    assert list(entries) == ["1", "2", "2(a)", "2(b)", "3", "schedule a", "schedule a:1", "schedule a:2", "4"]
+    assert entries["2(b)"]["parent"] == "2"
+    assert entries["schedule a:2"]["label"] == "Schedule A, Clause 2"
+    assert "Control Act" in entries["3"]["text"]
+    for entry in entries.values():
+        assert CONTRACT[entry["start"]:entry["end"]] == entry["text"]
+
+
+def test_sample_agreement_clause_ids():
+    clause_ids = [entry["clause_id"] for entry in build_clause_index(iter_pdf_page_texts(SAMPLE_PDF))]
+    assert [clause_id for clause_id in clause_ids if clause_id.isdigit()] == [str(number) for number in range(1, 38)]
+    assert [clause_id for clause_id in clause_ids if not clause_id.isdigit()] == ["annexure i", "annexure ii", "annexure iii"]
+
+
+@pytest.fixture
+def indexed_clauses(monkeypatch):
+    entries = {entry["clause_id"]: entry for entry in build_clause_index([CONTRACT])}
+    monkeypatch.setattr(retrieval_agent, "get_clauses", lambda doc_id, clause_ids: {
+        clause_id: entries[clause_id] for clause_id in clause_ids if clause_id in entries
+    })
+
+
+def test_retrieve_clause_context_resolves_every_listed_clause(indexed_clauses):
+    context = retrieval_agent.retrieve_clause_context("Compare clauses 1 and 4", "doc")
+    assert "rent monthly" in context and "may terminate" in context
+
+
+@pytest.mark.parametrize("query", ["clauses 1 through to 4", "clauses 1 and 9"])
+def test_retrieve_clause_context_falls_back_when_a_clause_is_unresolved(indexed_clauses, query):
+    assert retrieval_agent.retrieve_clause_context(query, "doc") is None
@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+# doc_processor imports Vertex AI, Firestore and Cloud Storage; run it against the in-memory fakes.
+os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="test-shards-"))
+import local_fakes
+local_fakes.install_fakes(profile="fast")
+
+import doc_processor
+from gcp_handler import deterministic_chunk_ids, stream_document_chunks
+
+DOCUMENT = "1. The monthly rent is payable by the fifth day of each month without demand. " * 400
+
+
+def test_deterministic_chunk_ids_continue_across_batches():
+    assert deterministic_chunk_ids("doc", 3, first_index=2) == deterministic_chunk_ids("doc", 5)[2:]
+    assert deterministic_chunk_ids("doc", 2) != deterministic_chunk_ids("other", 2)
+
+
+def test_reindexing_overwrites_the_documents_chunks(monkeypatch):
+    monkeypatch.setattr(doc_processor, "INGESTION_MICRO_BATCH_SIZE", 5)  # several save batches
+    first = doc_processor.process_and_index_document("gs://bucket/lease.pdf", "reindexed-doc", full_text=DOCUMENT)
+    second = doc_processor.process_and_index_document("gs://bucket/lease.pdf", "reindexed-doc", full_text=DOCUMENT)
+
+    chunks = list(stream_document_chunks("reindexed-doc"))
+    assert first["num_chunks"] == second["num_chunks"] == len(chunks) > 5
+    assert [chunk["seq"] for chunk in chunks] == list(range(len(chunks)))
+    assert [chunk["id"] for chunk in chunks] == deterministic_chunk_ids("reindexed-doc", len(chunks))
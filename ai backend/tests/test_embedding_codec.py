@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from embedding_codec import (
+    encode_embeddings, encode_embedding, decode_embeddings, decode_embedding, embedding_dim, recall_check,
+)
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(3).normal(size=(20, 768)).astype(np.float32)
+
+
+def test_float16_round_trip(vectors):
+    blobs = encode_embeddings(vectors, "float16")
+    assert all(len(blob) == 16 + 768 * 2 for blob in blobs)
+    np.testing.assert_allclose(decode_embeddings(blobs), vectors, rtol=1e-3, atol=1e-3)
+
+
+def test_int8_round_trip_within_half_a_quantization_step(vectors):
+    blobs = encode_embeddings(vectors, "int8")
+    assert all(len(blob) == 16 + 768 for blob in blobs)
+    decoded = decode_embeddings(blobs)
+    steps = (vectors.max(axis=1) - vectors.min(axis=1)) / 254
+    assert np.all(np.abs(decoded - vectors) <= steps[:, None] * 0.5 + 1e-5)
+
+
+def test_int8_keeps_each_vectors_own_scale():
+    vectors = np.array([[0.001, -0.002, 0.003], [100.0, -50.0, 25.0]], dtype=np.float32)
+    np.testing.assert_allclose(decode_embeddings(encode_embeddings(vectors, "int8")), vectors, rtol=0.01, atol=1e-5)
+
+
+def test_constant_vector_round_trips():
+    np.testing.assert_allclose(decode_embedding(encode_embedding([0.5] * 8, "int8")), [0.5] * 8)
+
+
+def test_mixed_formats_decode_in_input_order(vectors):
+    blobs = [encode_embedding(vectors[0], "int8"), encode_embedding(vectors[1], "float16"), encode_embedding(vectors[2], "int8")]
+    np.testing.assert_allclose(decode_embeddings(blobs), vectors[:3], atol=0.05)
+
+
+def test_dimension_is_read_from_the_header():
+    assert embedding_dim(encode_embedding(np.ones(256), "float16")) == 256
+    assert decode_embeddings([]).shape == (0, 0)
+
+
+def test_invalid_inputs_are_rejected(vectors):
+    with pytest.raises(ValueError):
+        encode_embeddings(vectors, "float64")
+    with pytest.raises(ValueError):
+        decode_embeddings([encode_embedding(np.ones(4)), encode_embedding(np.ones(8))])
+    with pytest.raises(ValueError):
+        decode_embeddings([b"JUNK" + encode_embedding(np.ones(4))[4:]])
+
+
+@pytest.mark.parametrize("storage_format", ["int8", "float16"])
+def test_quantized_search_matches_full_precision(storage_format):
+    rng = np.random.default_rng(7)
+    centers = rng.normal(size=(10, 128))
+    corpus = centers[rng.integers(0, 10, size=500)] + 0.35 * rng.normal(size=(500, 128))
+    queries = centers[rng.integers(0, 10, size=20)] + 0.35 * rng.normal(size=(20, 128))
+    assert recall_check(corpus, queries, k=10, storage_format=storage_format) >= 0.95
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import pytest
+
+# llm_orchestration imports Vertex AI, Tavily and Firestore; run it against the in-memory fakes.
+os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="test-shards-"))
+import local_fakes
+local_fakes.install_fakes(profile="fast")
+
+import llm_orchestration
+from llm_orchestration import run_web_research, run_checkpointed_analysis, NO_RESEARCH_FOUND_MESSAGE, RESEARCH_FAILED_MESSAGE
+
+DOCUMENT = "This Rent Agreement is made at Mumbai. 1. The monthly rent is Rs. 25,000, payable by the 5th. " * 5
+
+
+class FlakyTavily:
+    """Fails the searches whose query contains one of failing_words."""
+
+    def __init__(self, *failing_words, results_per_search: int = 1):
+        self.failing_words = failing_words
+        self.results_per_search = results_per_search
+
+    def search(self, query, **kwargs):
+        if any(word in query for word in self.failing_words):
+            raise ConnectionError("Tavily unavailable")
+        return {"results": [{"title": f"Result for {query}", "url": "https://example.org", "content": "Commentary."}] * self.results_per_search}
+
+
+def test_research_raises_when_every_search_failed(monkeypatch):
+    monkeypatch.setattr(llm_orchestration, "tavily_client", FlakyTavily("rent", "deposit"))
+    with pytest.raises(RuntimeError, match="All 2 Tavily searches failed"):
+        run_web_research(["rent control", "deposit limits"])
+
+
+def test_research_keeps_the_searches_that_succeeded(monkeypatch):
+    monkeypatch.setattr(llm_orchestration, "tavily_client", FlakyTavily("deposit"))
+    findings = run_web_research(["rent control", "deposit limits"])
+    assert "Result for legal rent control" in findings
+    assert "deposit" not in findings
+
+
+def test_searches_without_results_are_not_a_failure(monkeypatch):
+    monkeypatch.setattr(llm_orchestration, "tavily_client", FlakyTavily(results_per_search=0))
+    assert run_web_research(["rent control"]) == NO_RESEARCH_FOUND_MESSAGE
+    assert run_web_research([]) == NO_RESEARCH_FOUND_MESSAGE
+
+
+@pytest.fixture
+def analysis_store(monkeypatch):
+    """Serves DOCUMENT to the analysis and records its checkpoints and cache writes."""
+    store = {"checkpoints": {}, "cached": []}
+    monkeypatch.setattr(llm_orchestration, "get_document_head", lambda doc_id: DOCUMENT[:2000])
+    monkeypatch.setattr(llm_orchestration, "get_all_chunks_for_document", lambda doc_id: DOCUMENT)
+    monkeypatch.setattr(llm_orchestration, "get_cached_analysis", lambda fingerprint, version: None)
+    monkeypatch.setattr(llm_orchestration, "save_analysis_checkpoint", lambda doc_id, step, output: store["checkpoints"].__setitem__(step, output))
+    monkeypatch.setattr(llm_orchestration, "save_cached_analysis", lambda *args: store["cached"].append(args))
+    return store
+
+
+def test_failed_research_is_neither_checkpointed_nor_cached(monkeypatch, analysis_store):
+    monkeypatch.setattr(llm_orchestration, "tavily_client", FlakyTavily(""))  # every query fails
+    result = run_checkpointed_analysis("doc", "Summarize the rent terms.", document_fingerprint="fingerprint")
+    assert result["research_findings"] == RESEARCH_FAILED_MESSAGE
+    assert "research_findings" not in analysis_store["checkpoints"]
+    assert "agent2_detailed_analysis" in analysis_store["checkpoints"]
+    assert analysis_store["cached"] == []
+
+
+def test_successful_research_is_checkpointed_and_cached(monkeypatch, analysis_store):
+    monkeypatch.setattr(llm_orchestration, "tavily_client", FlakyTavily())
+    result = run_checkpointed_analysis("doc", "Summarize the rent terms.", document_fingerprint="fingerprint")
+    assert analysis_store["checkpoints"]["research_findings"] == result["research_findings"]
+    assert len(analysis_store["cached"]) == 1
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+# llm_response imports Vertex AI; run it against the in-memory fakes.
+os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="test-shards-"))
+import local_fakes
+local_fakes.install_fakes(profile="fast")
+
+from llm_response import _fit_to_budget, CONVERSATIONAL_PROMPT
+from usage_ledger import UsageLedger, CHARS_PER_TOKEN, OUTPUT_TOKEN_RESERVE
+
+QUERY = "When is the rent due?"
+DOC_CONTEXT = "1. The monthly rent is payable by the fifth day of each month."
+SUMMARY = "A residential lease."
+ANALYSIS = "Detailed analysis. " * 50
+HISTORY = [{"role": "user" if index % 2 == 0 else "model", "content": f"Message {index}. " * 10} for index in range(6)]
+FIXED_CHARS = len(CONVERSATIONAL_PROMPT) + len(QUERY) + len(DOC_CONTEXT) + len(SUMMARY)
+
+
+def message_chars(message):
+    return len(message["role"]) + len(message["content"]) + 3
+
+
+def ledger_allowing(prompt_chars):
+    """A conversation ledger whose remaining tokens leave exactly prompt_chars of prompt."""
+    assert prompt_chars % CHARS_PER_TOKEN == 0
+    return UsageLedger("conversation", token_budget=OUTPUT_TOKEN_RESERVE + prompt_chars // CHARS_PER_TOKEN)
+
+
+def fit(ledger):
+    return _fit_to_budget(QUERY, DOC_CONTEXT, HISTORY, ANALYSIS, SUMMARY, ledger)
+
+
+def padded(chars):
+    # Rounds a prompt size up to whole tokens
+    return chars + (-chars) % CHARS_PER_TOKEN
+
+
+def test_without_a_token_budget_nothing_is_trimmed():
+    assert fit(None) == (HISTORY, ANALYSIS)
+    assert fit(UsageLedger("conversation")) == (HISTORY, ANALYSIS)
+
+
+def test_a_prompt_within_budget_is_unchanged():
+    ledger = ledger_allowing(padded(FIXED_CHARS + sum(map(message_chars, HISTORY)) + len(ANALYSIS)))
+    assert fit(ledger) == (HISTORY, ANALYSIS)
+    assert ledger.adjustments == []
+
+
+def test_oldest_history_is_dropped_first():
+    # Room for everything but the first two messages
+    ledger = ledger_allowing(padded(FIXED_CHARS + sum(map(message_chars, HISTORY[2:])) + len(ANALYSIS)))
+    assert fit(ledger) == (HISTORY[2:], ANALYSIS)
+    assert ledger.adjustments == [{"step": "conversation", "action": "dropped the 2 oldest of 6 history messages"}]
+
+
+def test_analysis_is_truncated_once_the_history_is_gone():
+    allowed_chars = padded(FIXED_CHARS + len(ANALYSIS) // 2)
+    chat_history, analysis = fit(ledger_allowing(allowed_chars))
+    assert chat_history == []
+    assert analysis == ANALYSIS[:allowed_chars - FIXED_CHARS]
+
+
+def test_a_budget_below_the_fixed_prompt_drops_all_optional_context():
+    assert fit(UsageLedger("conversation", token_budget=OUTPUT_TOKEN_RESERVE)) == ([], "")
+
+
+def test_truncate_to_budget_keeps_the_steps_share():
+    ledger = UsageLedger("analysis", token_budget=100_000)
+    assert ledger.truncate_to_budget("step", "short") == "short"
+    truncated = ledger.truncate_to_budget("step", "x" * 1_000_000, other_chars=1000)
+    assert len(truncated) == int((50_000 - OUTPUT_TOKEN_RESERVE) * CHARS_PER_TOKEN) - 1000
+    assert len(ledger.adjustments) == 1
@@ -0,0 +1,48 @@
+import local_fakes
+local_fakes.install_fakes(profile="fast")  # model_router imports vertexai
+
+from model_router import route_model, estimate_complexity, estimate_latency, ROUTING_POLICY
+
+FLASH = ROUTING_POLICY["models"]["flash"]["name"]
+PRO = ROUTING_POLICY["models"]["pro"]["name"]
+PLAIN = "The Tenant shall pay the monthly rent on or before the 5th day of each month. "
+DENSE = ("Notwithstanding clause 4, and subject to Section 7, provided that the indemnifying party's liability "
+         "under any warranty, assignment or arbitration pursuant to Schedule 2 shall be without prejudice to clause 9. ")
+
+
+def test_complexity_scores_dense_drafting_above_plain_text():
+    assert estimate_complexity("") == 0.0
+    assert estimate_complexity(PLAIN * 20) < 0.3 < estimate_complexity(DENSE * 20) <= 1.0
+
+
+def test_small_simple_input_goes_to_the_small_model():
+    assert route_model("initial_analysis", PLAIN * 20) == (FLASH, f"small input, complexity {estimate_complexity(PLAIN * 20):.2f}")
+
+
+def test_small_but_complex_input_stays_on_pro():
+    model_name, reason = route_model("initial_analysis", DENSE * 20)
+    assert model_name == PRO and reason.startswith("complexity")
+
+
+def test_large_input_stays_on_pro():
+    assert route_model("initial_analysis", PLAIN * 1000) == (PRO, "default")
+
+
+def test_complexity_is_scored_on_the_given_text_not_the_prompt():
+    prompt = DENSE * 5 + PLAIN * 20  # instructions full of legal terms around a plain document
+    assert route_model("initial_analysis", prompt)[0] == PRO
+    assert route_model("initial_analysis", prompt, complexity_text=PLAIN * 20)[0] == FLASH
+
+
+def test_latency_budget_downgrades_to_the_slowest_model_that_fits():
+    text = PLAIN * 1000
+    budget = (estimate_latency("flash", len(text)) + estimate_latency("pro", len(text))) / 2
+    assert route_model("initial_analysis", text, latency_budget_seconds=budget) == (FLASH, f"latency budget {budget:g}s")
+    # Nothing fits: the fastest model is used
+    assert route_model("initial_analysis", text, latency_budget_seconds=0.01)[0] == FLASH
+    # A budget the default model meets changes nothing
+    assert route_model("initial_analysis", text, latency_budget_seconds=10_000) == (PRO, "default")
+
+
+def test_unknown_steps_default_to_flash():
+    assert route_model("not_a_step", PLAIN) == (FLASH, "default")
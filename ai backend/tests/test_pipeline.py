@@ -0,0 +1,61 @@
+import pytest
+from pipeline import Pipeline, batched
+
+
+def test_items_flow_through_map_and_stream_stages():
+    collected = []
+
+    def pairs(numbers):
+        pending = []
+        for number in numbers:
+            pending.append(number)
+            if len(pending) == 2:
+                yield tuple(pending)
+                pending = []
+        if pending:
+            yield tuple(pending)
+
+    pipeline = (Pipeline("test", queue_size=2)
+                .add_stage("double", lambda number: number * 2)
+                .add_stream_stage("pair", pairs)
+                .add_stage("collect", collected.append))
+    report = pipeline.run(range(5))
+    assert collected == [(0, 2), (4, 6), (8,)]
+    assert [stage["items_in"] for stage in report["stages"]] == [5, 5, 3]
+    assert [stage["items_out"] for stage in report["stages"]] == [5, 3, 0]  # None results are dropped
+
+
+def test_parallel_workers_process_every_item_once():
+    collected = []
+    Pipeline("test").add_stage("square", lambda number: number * number, workers=4).add_stage("collect", collected.append).run(range(50))
+    assert sorted(collected) == [number * number for number in range(50)]
+
+
+def test_stage_error_stops_the_pipeline_and_is_raised():
+    def fail_on_three(number):
+        if number == 3:
+            raise ValueError("bad item")
+        return number
+
+    def endless():
+        number = 0
+        while True:
+            yield number
+            number += 1
+
+    with pytest.raises(ValueError, match="bad item"):
+        Pipeline("test", queue_size=1).add_stage("check", fail_on_three).add_stage("sink", lambda number: None).run(endless())
+
+
+def test_source_error_is_raised():
+    def broken_source():
+        yield 1
+        raise OSError("read failed")
+
+    with pytest.raises(OSError, match="read failed"):
+        Pipeline("test").add_stage("sink", lambda number: None).run(broken_source())
+
+
+def test_batched_keeps_the_remainder():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 3)) == []
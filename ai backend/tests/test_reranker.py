@@ -0,0 +1,64 @@
+import pytest
+from reranker import mmr_select, merge_overlapping_chunks, build_context
+
+
+def test_mmr_with_lambda_one_ranks_by_relevance():
+    query = [1.0, 0.0]
+    candidates = [[0.0, 1.0], [1.0, 0.1], [1.0, 0.5]]
+    assert mmr_select(query, candidates, k=3, lambda_mult=1.0) == [1, 2, 0]
+
+
+def test_mmr_prefers_a_diverse_candidate_over_a_near_duplicate():
+    query = [1.0, 1.0]
+    candidates = [[1.0, 0.9], [1.0, 0.89], [0.6, 1.0]]
+    assert mmr_select(query, candidates, k=2, lambda_mult=0.5) == [0, 2]
+
+
+def test_mmr_handles_empty_input_and_small_k():
+    assert mmr_select([1.0], [], k=3) == []
+    assert mmr_select([1.0, 0.0], [[1.0, 0.0]], k=0) == []
+    assert mmr_select([1.0, 0.0], [[1.0, 0.0], [0.0, 1.0]], k=5) == [0, 1]
+
+
+def test_merge_joins_chunks_that_overlap_at_their_edges():
+    first = "one two three four five six seven"
+    second = "three four five six seven eight nine"
+    assert merge_overlapping_chunks([first, second]) == ["one two three four five six seven eight nine"]
+    # Also when the later chunk comes first
+    assert merge_overlapping_chunks([second, first]) == ["one two three four five six seven eight nine"]
+
+
+def test_merge_drops_contained_chunks_and_keeps_unrelated_ones():
+    long_text = "alpha beta gamma delta epsilon zeta eta theta"
+    assert merge_overlapping_chunks([long_text, "gamma delta epsilon", "unrelated text"]) == [long_text, "unrelated text"]
+    assert merge_overlapping_chunks(["gamma delta epsilon", long_text]) == [long_text]
+
+
+def test_merge_ignores_overlaps_shorter_than_the_minimum():
+    assert merge_overlapping_chunks(["a b c d", "c d e f"]) == ["a b c d", "c d e f"]
+
+
+def test_build_context_joins_texts_that_fit():
+    assert build_context(["first", "second"], 100, separator="|") == "first|second"
+
+
+def test_build_context_trims_the_crossing_text_at_a_sentence_end():
+    context = build_context(["x" * 20, "One sentence here. Another sentence that does not fit."], 50, separator="|")
+    assert context == "x" * 20 + "|One sentence here."
+
+
+def test_build_context_hard_trims_a_first_text_without_sentence_ends():
+    assert build_context(["y" * 500], 100) == "y" * 100
+
+
+@pytest.mark.parametrize("first_length", [97, 98, 100])
+def test_build_context_stops_when_the_separator_does_not_fit(first_length):
+    # After the first text there is no room left for the separator, so nothing more is added
+    context = build_context(["x" * first_length, "Sentence one. Sentence two. " * 20], 100)
+    assert context == "x" * first_length
+
+
+@pytest.mark.parametrize("max_chars", [50, 100, 101, 150, 300, 1000])
+def test_build_context_never_exceeds_max_chars(max_chars):
+    texts = ["x" * 97, "Sentence one. Sentence two. " * 20, "Short one.", "z" * 40]
+    assert len(build_context(texts, max_chars)) <= max_chars
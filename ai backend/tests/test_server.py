@@ -0,0 +1,132 @@
+import os
+import asyncio
+import tempfile
+import threading
+import pytest
+
+# The service imports the Google Cloud pipeline modules; run them against the
+# in-memory fakes, as load_test.py does, with shards in a scratch directory.
+os.environ.setdefault("VECTOR_SHARD_DIR", tempfile.mkdtemp(prefix="test-shards-"))
+import local_fakes
+local_fakes.install_fakes(profile="fast")
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import main
+import server
+from server import AdmissionController, StreamSlot
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_admission_rejects_past_the_limit_and_recovers_on_release():
+    admission = AdmissionController("test", 2)
+    assert admission.try_acquire() and admission.try_acquire()
+    assert not admission.try_acquire()
+    admission.release()
+    assert admission.try_acquire()
+    assert admission.stats() == {"in_flight": 2, "limit": 2, "rejected": 1}
+
+
+def test_admit_raises_429_with_retry_after():
+    admission = AdmissionController("test", 1)
+    with admission.admit():
+        with pytest.raises(HTTPException) as rejected:
+            with admission.admit():
+                pass
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers["Retry-After"] == str(server.RETRY_AFTER_SECONDS)
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_admit_releases_the_slot_when_the_block_raises():
+    admission = AdmissionController("test", 1)
+    with pytest.raises(RuntimeError):
+        with admission.admit():
+            raise RuntimeError("request failed")
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_saturated_request_pool_returns_429(client, monkeypatch):
+    monkeypatch.setattr(server.request_admission, "in_flight", server.request_admission.limit)
+    response = client.get("/documents/any/ingestion")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == str(server.RETRY_AFTER_SECONDS)
+
+
+def test_saturated_ingestion_pool_rejects_uploads_before_reading_them(client, monkeypatch):
+    monkeypatch.setattr(server.ingestion_admission, "in_flight", server.ingestion_admission.limit)
+    response = client.post("/documents", files={"file": ("lease.pdf", b"%PDF", "application/pdf")}, data={"prompt": "Summarize"})
+    assert response.status_code == 429
+    assert server.request_admission.stats()["in_flight"] == 0
+
+
+def test_stream_slot_is_released_once():
+    admission = AdmissionController("test", 1)
+    admission.try_acquire()
+    slot = StreamSlot(admission)
+    slot.release()
+    slot.release()
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_client_disconnect_stops_the_producer_and_releases_the_slot():
+    produced = []
+    stopped = threading.Event()
+
+    def generate_pieces(cancelled):
+        try:
+            for index in range(1000):
+                if cancelled.is_set():
+                    return
+                produced.append(index)
+                yield f"piece {index} "
+                cancelled.wait(0.01)
+        finally:
+            stopped.set()
+
+    async def read_first_event_then_disconnect():
+        admission = server.request_admission
+        assert admission.try_acquire()
+        events = server._stream_events(generate_pieces, StreamSlot(admission))
+        first_event = await events.__anext__()
+        await events.aclose()  # what the response does when the client goes away
+        return first_event
+
+    in_flight_before = server.request_admission.stats()["in_flight"]
+    assert asyncio.run(read_first_event_then_disconnect()).startswith("event: chunk")
+    assert stopped.wait(2)
+    assert len(produced) < 1000
+    assert server.request_admission.stats()["in_flight"] == in_flight_before
+
+
+def test_cancelled_follow_up_stream_is_not_saved(monkeypatch):
+    saved, recorded = [], []
+    closed = threading.Event()
+
+    def fake_stream(**kwargs):
+        try:
+            for piece in ("The deposit ", "is returned ", "within 30 days."):
+                yield piece
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(main, "get_request_details", lambda doc_id: {"status": "complete"})
+    monkeypatch.setattr(main, "_prepare_follow_up", lambda doc_id, query, request_data: {})
+    monkeypatch.setattr(main, "stream_conversational_response", fake_stream)
+    monkeypatch.setattr(main, "_record_usage", lambda *args: recorded.append(args))
+    monkeypatch.setattr(main, "update_conversation_history", lambda *args: saved.append(args))
+
+    cancelled = threading.Event()
+    pieces = []
+    for piece in main.stream_conversation_turn("doc", "deposit?", cancelled):
+        pieces.append(piece)
+        cancelled.set()
+    assert pieces == ["The deposit "]
+    assert closed.is_set() and saved == [] and len(recorded) == 1
+
+    assert "".join(main.stream_conversation_turn("doc", "deposit?", threading.Event())) == "The deposit is returned within 30 days."
+    assert saved == [("doc", "deposit?", "The deposit is returned within 30 days.")]
@@ -0,0 +1,84 @@
+import threading
+import time
+import pytest
+from task_graph import TaskGraph
+
+
+def test_steps_receive_dependency_results_in_order():
+    graph = TaskGraph("test")
+    graph.add_step("a", lambda: 2)
+    graph.add_step("b", lambda: 3)
+    graph.add_step("c", lambda a, b: a * 10 + b, deps=["a", "b"])
+    graph.add_step("d", lambda c: c + 1, deps=["c"])
+    assert graph.run() == {"a": 2, "b": 3, "c": 23, "d": 24}
+
+
+def test_step_starts_only_after_its_dependencies_finish():
+    graph = TaskGraph("test")
+    graph.add_step("slow", lambda: time.sleep(0.05))
+    graph.add_step("fast", lambda: None)
+    graph.add_step("after", lambda slow, fast: None, deps=["slow", "fast"])
+    graph.run()
+    assert graph.timings["after"][0] >= max(graph.timings["slow"][1], graph.timings["fast"][1])
+
+
+def test_independent_steps_run_concurrently():
+    both_started = threading.Barrier(2, timeout=2)
+    graph = TaskGraph("test", max_workers=2)
+    graph.add_step("a", both_started.wait)
+    graph.add_step("b", both_started.wait)
+    graph.run()  # would raise BrokenBarrierError if a and b ran one after the other
+
+
+def test_run_only_computes_what_the_targets_need():
+    calls = []
+    graph = TaskGraph("test")
+    graph.add_step("a", lambda: calls.append("a"))
+    graph.add_step("b", lambda a: calls.append("b"), deps=["a"])
+    graph.add_step("unrelated", lambda: calls.append("unrelated"))
+    assert set(graph.run(targets=["b"])) == {"a", "b"}
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_failure_stops_dependents_and_is_raised():
+    calls = []
+
+    def fail():
+        raise RuntimeError("step failed")
+
+    graph = TaskGraph("test")
+    graph.add_step("a", fail)
+    graph.add_step("b", lambda a: calls.append("b"), deps=["a"])
+    with pytest.raises(RuntimeError, match="step failed"):
+        graph.run()
+    assert calls == []
+
+
+def test_duplicate_and_unknown_steps_are_rejected():
+    graph = TaskGraph("test")
+    graph.add_step("a", lambda: None)
+    with pytest.raises(ValueError):
+        graph.add_step("a", lambda: None)
+    graph.add_step("b", lambda missing: None, deps=["missing"])
+    with pytest.raises(KeyError):
+        graph.run()
+
+
+def test_critical_path_follows_the_last_finishing_dependency():
+    graph = TaskGraph("test")
+    graph.add_step("document", lambda: time.sleep(0.01))
+    graph.add_step("slow_research", lambda document: time.sleep(0.08), deps=["document"])
+    graph.add_step("quick_check", lambda document: None, deps=["document"])
+    graph.add_step("summary", lambda research, check: None, deps=["slow_research", "quick_check"])
+    graph.run()
+    assert graph.critical_path() == ["document", "slow_research", "summary"]
+
+    report = graph.timing_report()
+    assert report["critical_path"] == ["document", "slow_research", "summary"]
+    assert report["critical_path_seconds"] <= report["wall_seconds"] + 0.001
+    assert list(report["steps"])[0] == "document"
+    assert "Critical path (*): document -> slow_research -> summary" in graph.format_timing_report()
+
+
+def test_critical_path_is_empty_before_a_run():
+    assert TaskGraph("test").critical_path() == []
@@ -0,0 +1,67 @@
+import os
+import re
+import pytest
+from text_processing import (
+    iter_pdf_page_texts, iter_sentence_spans, iter_document_chunk_spans, iter_document_chunks,
+    chunk_document_text, document_fingerprint,
+)
+
+SAMPLE_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_rent_agreement_filled_expanded.pdf")
+
+
+def baseline_chunk_document_text(text, max_chunk_size=1500, min_chunk_size=100, overlap_size=200):
+    """The chunker as it was before streaming ingestion, kept as the reference output."""
+    chunks = []
+    current_chunk = ""
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        if len(current_chunk) + len(sentence) > max_chunk_size and len(current_chunk) > min_chunk_size:
+            chunks.append(current_chunk.strip())
+            words = current_chunk.split()
+            overlap_words = words[-overlap_size//10:] if len(words) > overlap_size//10 else words
+            current_chunk = ' '.join(overlap_words) + ' ' + sentence
+        else:
+            current_chunk += ' ' + sentence if current_chunk else sentence
+    if current_chunk.strip() and len(current_chunk.strip()) > min_chunk_size:
+        chunks.append(current_chunk.strip())
+    return [chunk for chunk in chunks if len(chunk.strip()) > min_chunk_size]
+
+
+@pytest.fixture(scope="module")
+def sample_pages():
+    return list(iter_pdf_page_texts(SAMPLE_PDF))
+
+
+def test_sentence_spans_match_splitting_the_joined_text(sample_pages):
+    text = "\n".join(sample_pages)
+    spans = list(iter_sentence_spans(sample_pages))
+    assert [sentence for sentence, _, _ in spans] == re.split(r'(?<=[.!?])\s+', text)
+    assert all(text[start:end] == sentence for sentence, start, end in spans)
+
+
+@pytest.mark.parametrize("max_chunk_size", [1500, 400])
+def test_streaming_chunker_matches_baseline(sample_pages, max_chunk_size):
+    expected = baseline_chunk_document_text("\n".join(sample_pages), max_chunk_size=max_chunk_size)
+    assert list(iter_document_chunks(sample_pages, max_chunk_size=max_chunk_size)) == expected
+    assert chunk_document_text("\n".join(sample_pages), max_chunk_size=max_chunk_size) == expected
+
+
+def test_chunks_split_across_pages_match_baseline():
+    pages = ["First clause here. It continues on", "the next page. " + "Filler sentence. " * 40, "Last one."]
+    assert list(iter_document_chunks(pages, max_chunk_size=300)) == baseline_chunk_document_text("\n".join(pages), max_chunk_size=300)
+
+
+def test_chunk_spans_cover_the_document_in_order(sample_pages):
+    text = "\n".join(sample_pages)
+    chunks = list(iter_document_chunk_spans(sample_pages))
+    assert len(chunks) > 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous["end"] < chunk["start"]
+        assert text[previous["end"]:chunk["start"]].isspace()
+    for chunk in chunks:
+        # The chunk's own text (after the overlap) is its span, with whitespace collapsed
+        assert chunk["text"][chunk["overlap_chars"]:].split() == text[chunk["start"]:chunk["end"]].split()
+
+
+def test_fingerprint_ignores_layout_and_case():
+    assert document_fingerprint(["Rent is due\non the 5th."]) == document_fingerprint(["RENT  is due on", "the 5th."])
+    assert document_fingerprint(["Rent is due on the 5th."]) != document_fingerprint(["Rent is due on the 6th."])
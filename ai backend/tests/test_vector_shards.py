@@ -0,0 +1,85 @@
+import json
+import os
+import numpy as np
+import pytest
+import vector_shards
+from vector_shards import ShardWriter, write_shard, open_shard, invalidate_shard
+
+
+@pytest.fixture(autouse=True)
+def shard_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_shards, "VECTOR_SHARD_DIR", str(tmp_path))
+    monkeypatch.setattr(vector_shards, "SHARD_COPY_ROWS", 3)  # publish in several blocks
+    vector_shards._open_shards.clear()
+    yield tmp_path
+    vector_shards._open_shards.clear()
+
+
+def test_writer_publishes_manifest_matrix_and_ids(shard_dir):
+    rng = np.random.default_rng(0)
+    batches = [rng.normal(size=(4, 8)), rng.normal(size=(3, 8))]
+    writer = ShardWriter("doc")
+    writer.append([f"c{i}" for i in range(4)], batches[0])
+    writer.append([f"c{i}" for i in range(4, 7)], batches[1])
+    assert writer.commit("gen-1") == "gen-1"
+
+    with open(shard_dir / "doc.json", encoding="utf-8") as manifest_file:
+        assert json.load(manifest_file) == {"generation": "gen-1", "num_chunks": 7, "dim": 8}
+    assert sorted(os.listdir(shard_dir)) == ["doc.gen-1.ids.json", "doc.gen-1.npy", "doc.json"]  # spill file removed
+
+    shard = open_shard("doc")
+    assert shard.generation == "gen-1"
+    assert shard.chunk_ids == [f"c{i}" for i in range(7)]
+    expected = np.vstack(batches)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(shard.matrix, expected, rtol=1e-6)
+
+
+def test_search_returns_the_most_similar_chunks_first():
+    write_shard("doc", ["north", "east", "south"], [[0, 1], [1, 0], [0, -1]], "gen-1")
+    results = open_shard("doc").search([0.1, 1.0], k=2)
+    assert [chunk_id for chunk_id, _, _ in results] == ["north", "east"]
+    assert results[0][1] > results[1][1]
+    assert open_shard("doc").search([0.1, 1.0], k=0) == []
+
+
+def test_open_shard_rejects_another_generation():
+    write_shard("doc", ["a"], [[1.0, 0.0]], "gen-1")
+    assert open_shard("doc", generation="gen-1").generation == "gen-1"
+    assert open_shard("doc", generation="gen-2") is None
+    assert open_shard("missing") is None
+
+
+def test_rewrite_replaces_the_cached_shard_and_removes_old_files(shard_dir):
+    write_shard("doc", ["a"], [[1.0, 0.0]], "gen-1")
+    assert open_shard("doc", generation="gen-1") is not None
+    write_shard("doc", ["a", "b"], [[1.0, 0.0], [0.0, 1.0]], "gen-2")
+
+    shard = open_shard("doc", generation="gen-2")
+    assert shard is not None and shard.chunk_ids == ["a", "b"]
+    assert open_shard("doc", generation="gen-1") is None
+    assert not (shard_dir / "doc.gen-1.npy").exists()
+
+
+def test_invalidate_removes_the_shard(shard_dir):
+    write_shard("doc", ["a"], [[1.0, 0.0]], "gen-1")
+    open_shard("doc")
+    invalidate_shard("doc")
+    assert open_shard("doc") is None
+    assert os.listdir(shard_dir) == []
+
+
+def test_discard_and_empty_commit_write_nothing(shard_dir):
+    writer = ShardWriter("doc")
+    writer.append(["a"], [[1.0, 0.0]])
+    writer.discard()
+    assert ShardWriter("empty").commit("gen-1") is None
+    assert os.listdir(shard_dir) == []
+
+
+def test_writer_rejects_mixed_dimensions():
+    writer = ShardWriter("doc")
+    writer.append(["a"], [[1.0, 0.0]])
+    with pytest.raises(ValueError):
+        writer.append(["b"], [[1.0, 0.0, 0.0]])
+    writer.discard()
@@ -0,0 +1,182 @@
+import re
+import hashlib
+import unicodedata
+import pypdf
+from clause_index import build_clause_index
+
+# This module deliberately has no Google Cloud imports or client initialization,
+# so it can be loaded cheaply inside worker processes (see bulk_ingest.py).
+
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+def iter_pdf_page_texts(source):
+    """
+    Yields the text of each PDF page that has extractable text, one page at a time.
+
+    Args:
+        source: A local file path or a binary file-like object containing the PDF.
+    """
+    reader = pypdf.PdfReader(source)
+    for page in reader.pages:
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text
+
+def extract_text_from_pdf(source) -> str:
+    """
+    Extracts the text of every page of a PDF and joins them with newlines.
+
+    Args:
+        source: A local file path or a binary file-like object containing the PDF.
+
+    Returns:
+        str: The concatenated text of all pages that contain extractable text.
+    """
+    return "\n".join(iter_pdf_page_texts(source))
+
+def iter_sentence_spans(text_parts):
+    """
+    Splits a stream of text parts (e.g. pages) into sentences without joining the
+    whole stream into one string. Parts are treated as if joined with newlines, so
+    the output matches splitting "\n".join(text_parts) in one go.
+
+    Yields:
+        tuple[str, int, int]: Each sentence with its start and end offsets in the
+                              joined text (empty parts are skipped, as in extract_text_from_pdf).
+    """
+    carry = ""
+    carry_start = 0
+    started = False
+    for part in text_parts:
+        if not part:
+            continue
+        buffer = carry + "\n" + part if started else part
+        started = True
+
+        sentence_start = 0
+        for boundary in SENTENCE_BOUNDARY.finditer(buffer):
+            # A boundary touching the end of the buffer may continue into the next part
+            if boundary.end() == len(buffer):
+                break
+            yield buffer[sentence_start:boundary.start()], carry_start + sentence_start, carry_start + boundary.start()
+            sentence_start = boundary.end()
+        carry = buffer[sentence_start:]
+        carry_start += sentence_start
+
+    sentence_start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(carry):
+        yield carry[sentence_start:boundary.start()], carry_start + sentence_start, carry_start + boundary.start()
+        sentence_start = boundary.end()
+    yield carry[sentence_start:], carry_start + sentence_start, carry_start + len(carry)
+
+def iter_sentences(text_parts):
+    """Like iter_sentence_spans, but yields only the sentences."""
+    for sentence, _, _ in iter_sentence_spans(text_parts):
+        yield sentence
+
+def _chunk_span(current_chunk: str, overlap_length: int, start: int, end: int) -> dict:
+    chunk = current_chunk.strip()
+    leading_whitespace = len(current_chunk) - len(current_chunk.lstrip())
+    return {"text": chunk, "start": start, "end": end, "overlap_chars": max(overlap_length - leading_whitespace, 0)}
+
+def iter_document_chunk_spans(text_parts, max_chunk_size=1500, min_chunk_size=100, overlap_size=200):
+    """
+    Streaming chunker: consumes text parts (e.g. PDF pages) and yields chunks as
+    soon as they are complete, with their position in the document.
+
+    Each chunk starts with the last words of the previous chunk as overlap. 'start'
+    and 'end' are the offsets (in "\n".join(text_parts)) of the chunk's own text,
+    after that overlap, so consecutive chunks cover consecutive spans of the document.
+
+    Yields:
+        dict: 'text', 'start', 'end', and 'overlap_chars' (the length of the leading
+              overlap in 'text').
+    """
+    current_chunk = ""
+    overlap_length = 0
+    chunk_start = chunk_end = 0
+
+    for sentence, sentence_start, sentence_end in iter_sentence_spans(text_parts):
+        # Check if adding this sentence exceeds max size
+        if len(current_chunk) + len(sentence) > max_chunk_size and len(current_chunk) > min_chunk_size:
+            if len(current_chunk.strip()) > min_chunk_size:
+                yield _chunk_span(current_chunk, overlap_length, chunk_start, chunk_end)
+            # Start new chunk with overlap
+            words = current_chunk.split()
+            overlap_words = words[-overlap_size//10:] if len(words) > overlap_size//10 else words
+            current_chunk = ' '.join(overlap_words) + ' ' + sentence
+            overlap_length = len(current_chunk) - len(sentence)
+            chunk_start = sentence_start
+        elif current_chunk:
+            current_chunk += ' ' + sentence
+        else:
+            current_chunk = sentence
+            chunk_start = sentence_start
+        chunk_end = sentence_end
+
+    # Add the last chunk
+    if current_chunk.strip() and len(current_chunk.strip()) > min_chunk_size:
+        yield _chunk_span(current_chunk, overlap_length, chunk_start, chunk_end)
+
+def iter_document_chunks(text_parts, max_chunk_size=1500, min_chunk_size=100, overlap_size=200):
+    """
+    Streaming version of chunk_document_text: consumes text parts (e.g. PDF pages)
+    and yields chunks as soon as they are complete.
+    """
+    for chunk in iter_document_chunk_spans(text_parts, max_chunk_size, min_chunk_size, overlap_size):
+        yield chunk["text"]
+
+def chunk_document_text(text, max_chunk_size=1500, min_chunk_size=100, overlap_size=200):
+    """
+    Robust text chunking for legal documents
+    """
+    return list(iter_document_chunks([text], max_chunk_size, min_chunk_size, overlap_size))
+
+class TextFingerprint:
+    """
+    A streaming SHA-256 fingerprint of a document's normalized text: Unicode NFKC,
+    lower-cased, with all whitespace collapsed. Two copies of a document that differ
+    only in layout, line breaks or page boundaries get the same fingerprint.
+
+    Usage:
+        fingerprint = TextFingerprint()
+        for page_text in pages:
+            fingerprint.update(page_text)
+        fingerprint.hexdigest()
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def update(self, text_part: str):
+        # Parts are treated as separated by whitespace, like pages joined with newlines
+        for word in unicodedata.normalize("NFKC", text_part).lower().split():
+            self._hash.update(word.encode("utf-8") + b" ")
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def document_fingerprint(text_parts) -> str:
+    """Returns the TextFingerprint of a document given as an iterable of text parts (e.g. pages)."""
+    fingerprint = TextFingerprint()
+    for text_part in text_parts:
+        fingerprint.update(text_part)
+    return fingerprint.hexdigest()
+
+def parse_pdf_for_indexing(file_path: str) -> tuple[list[dict], str, list[dict]]:
+    """
+    Extracts and chunks a local PDF in one call. Used as the process-pool task
+    for bulk ingestion, so it must stay free of any network or client state.
+
+    Args:
+        file_path (str): The local path to the PDF.
+
+    Returns:
+        tuple: The chunks with their positions (see iter_document_chunk_spans),
+               the document's text fingerprint (see TextFingerprint) and its
+               clause index (see clause_index.py), computed from the same pages.
+    """
+    page_texts = list(iter_pdf_page_texts(file_path))
+    return list(iter_document_chunk_spans(page_texts)), document_fingerprint(page_texts), build_clause_index(page_texts)
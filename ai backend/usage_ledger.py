@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+# Token and latency accounting for model calls, plus per-request budgets.
+#
+# Every Gemini call made through generate_with_usage (or stream_with_usage) records
+# the response's usage metadata and its latency in the request's UsageLedger and in
+# the process-wide `process_usage` counters. The analysis ledger is stored with the
+# analysis ('analysis_usage'), and every ledger's totals are added to the request's
+# and the day's usage counters in Firestore (see gcp_handler.record_usage).
+#
+# A ledger can carry a token budget and a time budget. Steps ask it how much they
+# may spend: inputs are truncated to the step's share of the remaining tokens,
+# optional steps are skipped once a budget is exhausted, and the remaining time is
+# passed to the model router as a latency budget, so Pro is downgraded to Flash
+# when it would not finish in time. The time budget is opt-in: Pro's estimated
+# latency for a large contract is minutes, and a default budget would quietly
+# move those analyses to Flash.
+
+load_dotenv()
+
+# Per-request budgets; 0 disables a budget
+ANALYSIS_TOKEN_BUDGET = int(os.getenv("ANALYSIS_TOKEN_BUDGET", "400000"))
+ANALYSIS_TIME_BUDGET_SECONDS = float(os.getenv("ANALYSIS_TIME_BUDGET_SECONDS", "0"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "60000"))
+# Share of the remaining budget a single step may use, so later steps still get some
+STEP_BUDGET_SHARE = float(os.getenv("STEP_BUDGET_SHARE", "0.5"))
+# Rough size of a token, for estimating a prompt's tokens before sending it
+CHARS_PER_TOKEN = 4
+# Tokens kept free for a step's response when truncating its input
+OUTPUT_TOKEN_RESERVE = 8192
+
+TOTAL_FIELDS = ("calls", "errors", "input_tokens", "output_tokens", "total_tokens", "seconds")
+
+
+def _empty_totals() -> dict:
+    return {field: 0 for field in TOTAL_FIELDS}
+
+def _add_entry(totals: dict, entry: dict):
+    totals["calls"] += 1
+    totals["errors"] += 0 if entry["ok"] else 1
+    totals["input_tokens"] += entry["input_tokens"]
+    totals["output_tokens"] += entry["output_tokens"]
+    totals["total_tokens"] += entry["total_tokens"]
+    totals["seconds"] = round(totals["seconds"] + entry["seconds"], 3)
+
+def _usage_entry(step: str, model: str, seconds: float, usage_metadata=None, ok: bool = True) -> dict:
+    return {
+        "step": step,
+        "model": model,
+        "ok": ok,
+        "input_tokens": getattr(usage_metadata, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(usage_metadata, "candidates_token_count", 0) or 0,
+        "total_tokens": getattr(usage_metadata, "total_token_count", 0) or 0,
+        "seconds": round(seconds, 3)
+    }
+
+def model_label(model) -> str:
+    """The short model name of a GenerativeModel (e.g. 'gemini-1.5-pro-002')."""
+    name = getattr(model, "_model_name", None) or getattr(model, "model_name", None) or "unknown"
+    return name.split("/")[-1]
+
+
+class UsageCounters:
+    """Thread-safe running totals of model calls, by step and by model, for this process."""
+
+    def __init__(self):
+        self._by_step = {}
+        self._by_model = {}
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict):
+        with self._lock:
+            _add_entry(self._by_step.setdefault(entry["step"], _empty_totals()), entry)
+            _add_entry(self._by_model.setdefault(entry["model"], _empty_totals()), entry)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "by_step": {step: dict(totals) for step, totals in self._by_step.items()},
+                "by_model": {model: dict(totals) for model, totals in self._by_model.items()}
+            }
+
+process_usage = UsageCounters()
+
+
+class UsageLedger:
+    """
+    The model calls of one request (an initial analysis or a conversation turn),
+    with optional token and time budgets. Safe to share between the threads of a
+    TaskGraph run.
+    """
+
+    def __init__(self, name: str, token_budget: int | None = None, time_budget_seconds: float | None = None):
+        self.name = name
+        self.token_budget = token_budget or None
+        self.time_budget_seconds = time_budget_seconds or None
+        self.started = time.monotonic()
+        self.entries = []
+        self.adjustments = []
+        self._lock = threading.Lock()
+
+    def record(self, step: str, model: str, seconds: float, usage_metadata=None, ok: bool = True):
+        """Records one call. usage_metadata is the response's (None for non-model calls or failures)."""
+        entry = _usage_entry(step, model, seconds, usage_metadata, ok)
+        with self._lock:
+            self.entries.append(entry)
+        process_usage.add(entry)
+
+    def note(self, step: str, action: str):
+        """Records a budget adjustment (a truncated input, a skipped or downgraded step)."""
+        print(f"💸 [{self.name}] {step}: {action}")
+        with self._lock:
+            self.adjustments.append({"step": step, "action": action})
+
+    def tokens_used(self) -> int:
+        with self._lock:
+            return sum(entry["total_tokens"] for entry in self.entries)
+
+    def remaining_tokens(self) -> int | None:
+        if self.token_budget is None:
+            return None
+        return max(self.token_budget - self.tokens_used(), 0)
+
+    def remaining_seconds(self) -> float | None:
+        if self.time_budget_seconds is None:
+            return None
+        return max(self.time_budget_seconds - (time.monotonic() - self.started), 0.0)
+
+    def exhausted(self) -> bool:
+        """True once either budget is used up."""
+        return self.remaining_tokens() == 0 or self.remaining_seconds() == 0
+
+    def step_time_budget(self) -> float | None:
+        """The latency budget for the next model call (its share of the remaining time)."""
+        remaining = self.remaining_seconds()
+        return None if remaining is None else remaining * STEP_BUDGET_SHARE
+
+    def truncate_to_budget(self, step: str, text: str, other_chars: int = 0) -> str:
+        """
+        Truncates a step's variable input so the whole prompt (text plus other_chars
+        of fixed prompt) fits in the step's share of the remaining tokens.
+        """
+        remaining = self.remaining_tokens()
+        if remaining is None:
+            return text
+        step_tokens = remaining * STEP_BUDGET_SHARE
+        # Small budgets keep at most a quarter of the step's share for the response
+        input_tokens = step_tokens - min(OUTPUT_TOKEN_RESERVE, step_tokens / 4)
+        allowed_chars = max(int(input_tokens * CHARS_PER_TOKEN) - other_chars, 0)
+        if len(text) <= allowed_chars:
+            return text
+        self.note(step, f"input truncated from {len(text)} to {allowed_chars} chars")
+        return text[:allowed_chars]
+
+    def summary(self) -> dict:
+        """Totals overall, by step and by model, with the budgets and any adjustments."""
+        with self._lock:
+            entries = list(self.entries)
+            adjustments = list(self.adjustments)
+        totals, by_step, by_model = _empty_totals(), {}, {}
+        for entry in entries:
+            _add_entry(totals, entry)
+            _add_entry(by_step.setdefault(entry["step"], _empty_totals()), entry)
+            _add_entry(by_model.setdefault(entry["model"], _empty_totals()), entry)
+        return {
+            "totals": totals,
+            "by_step": by_step,
+            "by_model": by_model,
+            "token_budget": self.token_budget,
+            "time_budget_seconds": self.time_budget_seconds,
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "adjustments": adjustments
+        }
+
+    def to_dict(self) -> dict:
+        """The summary plus every recorded call, for storing with the analysis."""
+        with self._lock:
+            entries = list(self.entries)
+        return {**self.summary(), "calls": entries}
+
+    def format_report(self) -> str:
+        summary = self.summary()
+        lines = [f"Usage for '{self.name}': {summary['totals']['total_tokens']} tokens in "
+                 f"{summary['totals']['calls']} calls, {summary['elapsed_seconds']:.1f}s elapsed"]
+        for step, totals in summary["by_step"].items():
+            lines.append(f"  {step:<26} {totals['input_tokens']:>8} in {totals['output_tokens']:>7} out {totals['seconds']:>8.2f}s")
+        return "\n".join(lines)
+
+
+def generate_with_usage(model, contents, step: str, ledger: UsageLedger | None = None, **kwargs):
+    """
+    Calls model.generate_content and records the call's usage and latency in the
+    ledger (if given) and the process counters. Exceptions are recorded and re-raised.
+    """
+    started = time.perf_counter()
+    try:
+        response = model.generate_content(contents, **kwargs)
+    except Exception:
+        _record(ledger, step, model_label(model), time.perf_counter() - started, None, ok=False)
+        raise
+    _record(ledger, step, model_label(model), time.perf_counter() - started, getattr(response, "usage_metadata", None))
+    return response
+
+def stream_with_usage(model, contents, step: str, ledger: UsageLedger | None = None, **kwargs):
+    """
+    Streaming version of generate_with_usage: yields the response pieces, then records
+    the call. A stream that fails or is closed early (e.g. the client disconnected) is
+    recorded as failed, with the usage metadata received so far.
+    """
+    started = time.perf_counter()
+    usage_metadata = None
+    ok = False
+    try:
+        for response in model.generate_content(contents, stream=True, **kwargs):
+            # The usage metadata of the last piece covers the whole response
+            usage_metadata = getattr(response, "usage_metadata", None) or usage_metadata
+            yield response
+        ok = True
+    finally:
+        _record(ledger, step, model_label(model), time.perf_counter() - started, usage_metadata, ok=ok)
+
+def _record(ledger, step, model, seconds, usage_metadata, ok=True):
+    if ledger is not None:
+        ledger.record(step, model, seconds, usage_metadata, ok)
+    else:
+        process_usage.add(_usage_entry(step, model, seconds, usage_metadata, ok))
@@ -0,0 +1,269 @@
+import os
+import json
+import uuid
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+# Local, memory-mapped vector shards: one per firestore_doc_id.
+#
+# A shard is a contiguous float32 matrix of L2-normalized chunk embeddings (.npy)
+# plus a JSON table of chunk IDs in the same row order, published by a small
+# manifest file. Worker processes open shards with np.load(mmap_mode="r"), so
+# every process on a node reads the same OS page-cache pages instead of holding
+# its own copy, and opening a warm shard takes milliseconds.
+#
+# Files for a document in VECTOR_SHARD_DIR:
+#   <doc_id>.json                       manifest: {"generation", "num_chunks", "dim"}
+#   <doc_id>.<generation>.npy           embedding matrix
+#   <doc_id>.<generation>.ids.json      chunk IDs
+# A rebuilt shard gets a new generation and the manifest is swapped atomically,
+# so readers never see a half-written shard. ShardWriter builds a shard from
+# embeddings that arrive in batches (e.g. during pipelined ingestion) without
+# holding the whole matrix in memory.
+
+load_dotenv()
+
+VECTOR_SHARD_DIR = os.getenv("VECTOR_SHARD_DIR", "vector_shards")
+VECTOR_SHARD_CACHE_SIZE = int(os.getenv("VECTOR_SHARD_CACHE_SIZE", "64"))
+# Rows copied at a time when a ShardWriter publishes its shard
+SHARD_COPY_ROWS = 4096
+
+
+class VectorShard:
+    """A read-only, memory-mapped shard of one document's chunk embeddings."""
+
+    def __init__(self, firestore_doc_id: str, generation: str, chunk_ids: list[str], matrix: np.ndarray, manifest_stamp: tuple[int, int]):
+        self.firestore_doc_id = firestore_doc_id
+        self.generation = generation
+        self.chunk_ids = chunk_ids
+        self.matrix = matrix
+        self.manifest_stamp = manifest_stamp
+
+    def search(self, query_embedding, k: int) -> list[tuple[str, float, np.ndarray]]:
+        """
+        Returns the k chunks most similar to the query by cosine similarity.
+
+        Returns:
+            list[tuple[str, float, np.ndarray]]: (chunk ID, similarity, chunk vector), best first.
+        """
+        if not len(self.chunk_ids) or k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.matrix @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[row], float(scores[row]), self.matrix[row]) for row in top]
+
+
+_open_shards = OrderedDict()
+_open_shards_lock = threading.Lock()
+
+
+def _manifest_path(firestore_doc_id: str) -> str:
+    return os.path.join(VECTOR_SHARD_DIR, f"{firestore_doc_id}.json")
+
+def _data_paths(firestore_doc_id: str, generation: str) -> tuple[str, str]:
+    prefix = os.path.join(VECTOR_SHARD_DIR, f"{firestore_doc_id}.{generation}")
+    return f"{prefix}.npy", f"{prefix}.ids.json"
+
+def _manifest_stamp(manifest_path: str) -> tuple[int, int]:
+    # A published manifest is a new file (see ShardWriter._publish), so its inode
+    # changes even when two writes land within the filesystem's timestamp granularity
+    stat = os.stat(manifest_path)
+    return stat.st_ino, stat.st_mtime_ns
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        # Already gone, or still mapped by a reader on Windows; harmless either way
+        pass
+
+class ShardWriter:
+    """
+    Builds a document's shard from embeddings appended in batches. Rows are
+    normalized and spilled to a temporary file as they arrive, so only the chunk
+    IDs are kept in memory. Safe to append from several threads.
+
+    Usage:
+        writer = ShardWriter(firestore_doc_id)
+        writer.append(chunk_ids, embeddings)   # any number of times
+        writer.commit(generation)              # or writer.discard()
+    """
+
+    def __init__(self, firestore_doc_id: str):
+        self.firestore_doc_id = firestore_doc_id
+        self.chunk_ids = []
+        self.dim = None
+        self._rows_path = None
+        self._rows_file = None
+        self._lock = threading.Lock()
+
+    def append(self, chunk_ids: list[str], embeddings):
+        if not len(chunk_ids):
+            return
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(chunk_ids), -1)
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            if self._rows_file is None:
+                os.makedirs(VECTOR_SHARD_DIR, exist_ok=True)
+                self.dim = matrix.shape[1]
+                self._rows_path = os.path.join(VECTOR_SHARD_DIR, f"{self.firestore_doc_id}.rows-{uuid.uuid4().hex}")
+                self._rows_file = open(self._rows_path, "wb")
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Cannot add {matrix.shape[1]}-dim embeddings to a {self.dim}-dim shard.")
+            self._rows_file.write(matrix.tobytes())
+            self.chunk_ids.extend(chunk_ids)
+
+    def commit(self, generation: str | None = None) -> str | None:
+        """
+        Writes (or replaces) the document's shard from the appended rows.
+
+        Args:
+            generation (str | None): The document's index generation (see gcp_handler.mark_document_indexed).
+                                     A random one is used if omitted.
+
+        Returns:
+            str | None: The generation of the written shard, or None if nothing was appended.
+        """
+        with self._lock:
+            if self._rows_file is None:
+                return None
+            self._rows_file.close()
+            try:
+                return self._publish(generation or uuid.uuid4().hex)
+            finally:
+                _remove_quietly(self._rows_path)
+                self._rows_file = None
+
+    def discard(self):
+        """Drops the appended rows without writing a shard."""
+        with self._lock:
+            if self._rows_file is not None:
+                self._rows_file.close()
+                _remove_quietly(self._rows_path)
+                self._rows_file = None
+
+    def _publish(self, generation: str) -> str:
+        firestore_doc_id = self.firestore_doc_id
+        num_rows = len(self.chunk_ids)
+        previous_generation = None
+        manifest_path = _manifest_path(firestore_doc_id)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+                previous_generation = json.load(manifest_file).get("generation")
+
+        matrix_path, ids_path = _data_paths(firestore_doc_id, generation)
+        temp_suffix = f".tmp-{uuid.uuid4().hex}"
+        # Copy the spilled rows into the .npy file block by block, both memory-mapped
+        rows = np.memmap(self._rows_path, dtype=np.float32, mode="r", shape=(num_rows, self.dim))
+        matrix = np.lib.format.open_memmap(matrix_path + temp_suffix, mode="w+", dtype=np.float32, shape=(num_rows, self.dim))
+        for start in range(0, num_rows, SHARD_COPY_ROWS):
+            matrix[start:start + SHARD_COPY_ROWS] = rows[start:start + SHARD_COPY_ROWS]
+        matrix.flush()
+        del matrix, rows
+        os.replace(matrix_path + temp_suffix, matrix_path)
+        with open(ids_path + temp_suffix, "w", encoding="utf-8") as ids_file:
+            json.dump(self.chunk_ids, ids_file)
+        os.replace(ids_path + temp_suffix, ids_path)
+
+        # Publishing the manifest last makes the new shard visible in one atomic step
+        with open(manifest_path + temp_suffix, "w", encoding="utf-8") as manifest_file:
+            json.dump({"generation": generation, "num_chunks": num_rows, "dim": int(self.dim)}, manifest_file)
+        os.replace(manifest_path + temp_suffix, manifest_path)
+
+        if previous_generation and previous_generation != generation:
+            for path in _data_paths(firestore_doc_id, previous_generation):
+                _remove_quietly(path)
+
+        print(f"✅ Wrote vector shard for doc ID {firestore_doc_id} ({num_rows} chunks, generation {generation}).")
+        return generation
+
+def write_shard(firestore_doc_id: str, chunk_ids: list[str], embeddings, generation: str | None = None) -> str:
+    """
+    Writes (or replaces) a document's shard in one step.
+
+    Args:
+        firestore_doc_id (str): The ID of the document's record in 'analysis_requests'.
+        chunk_ids (list[str]): The chunk IDs, one per embedding row.
+        embeddings: A 2-D array-like of shape (len(chunk_ids), dim).
+        generation (str | None): The document's index generation (see gcp_handler.mark_document_indexed).
+                                 A random one is used if omitted.
+
+    Returns:
+        str: The generation of the written shard.
+    """
+    writer = ShardWriter(firestore_doc_id)
+    writer.append(chunk_ids, embeddings)
+    return writer.commit(generation)
+
+def _load_shard(firestore_doc_id: str) -> VectorShard | None:
+    manifest_path = _manifest_path(firestore_doc_id)
+    try:
+        manifest_stamp = _manifest_stamp(manifest_path)
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            generation = json.load(manifest_file)["generation"]
+        matrix_path, ids_path = _data_paths(firestore_doc_id, generation)
+        with open(ids_path, "r", encoding="utf-8") as ids_file:
+            chunk_ids = json.load(ids_file)
+        matrix = np.load(matrix_path, mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    return VectorShard(firestore_doc_id, generation, chunk_ids, matrix, manifest_stamp)
+
+def open_shard(firestore_doc_id: str, generation: str | None = None) -> VectorShard | None:
+    """
+    Returns a document's shard, memory-mapped, or None if there is no usable shard.
+
+    Open shards are kept in an LRU of VECTOR_SHARD_CACHE_SIZE entries. Each access
+    checks the manifest's inode and modification time, so a shard replaced or
+    invalidated by another process is picked up without restarting. If `generation`
+    is given, a shard built from a different index generation is treated as stale.
+    """
+    manifest_path = _manifest_path(firestore_doc_id)
+    with _open_shards_lock:
+        shard = _open_shards.get(firestore_doc_id)
+        if shard is not None:
+            try:
+                current_stamp = _manifest_stamp(manifest_path)
+            except OSError:
+                current_stamp = None
+            if current_stamp == shard.manifest_stamp:
+                _open_shards.move_to_end(firestore_doc_id)
+            else:
+                del _open_shards[firestore_doc_id]
+                shard = None
+
+        if shard is None:
+            shard = _load_shard(firestore_doc_id)
+            if shard is None:
+                return None
+            _open_shards[firestore_doc_id] = shard
+            while len(_open_shards) > VECTOR_SHARD_CACHE_SIZE:
+                _open_shards.popitem(last=False)
+
+    if generation is not None and shard.generation != generation:
+        return None
+    return shard
+
+def invalidate_shard(firestore_doc_id: str):
+    """Removes a document's shard (e.g. because it was re-indexed) and evicts it from the LRU."""
+    with _open_shards_lock:
+        _open_shards.pop(firestore_doc_id, None)
+
+    manifest_path = _manifest_path(firestore_doc_id)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            generation = json.load(manifest_file).get("generation")
+    except (OSError, ValueError):
+        return
+    _remove_quietly(manifest_path)
+    if generation:
+        for path in _data_paths(firestore_doc_id, generation):
+            _remove_quietly(path)
+    print(f"🗑️ Invalidated vector shard for doc ID: {firestore_doc_id}")